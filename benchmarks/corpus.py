@@ -0,0 +1,250 @@
+"""
+Synthetic large-file corpus for the parser benchmark
+
+One generator per parser registered in lib.file_manager.PARSERS. A generator
+takes a size in units (resources, lines, modules ... whatever the format
+repeats) and a seeded random generator, and returns the file content. The
+content grows linearly with the units, so parse time should too.
+"""
+
+import base64
+import json
+import random
+from typing import Callable, Dict, NamedTuple
+
+SERVICES = ['s3', 'ec2', 'sqs', 'sns', 'dynamodb', 'lambda', 'iam', 'rds']
+CFN_TYPES = ['AWS::S3::Bucket', 'AWS::SQS::Queue', 'AWS::SNS::Topic', 'AWS::IAM::Role',
+             'AWS::Lambda::Function', 'AWS::DynamoDB::Table', 'AWS::EC2::Instance']
+TF_TYPES = ['aws_s3_bucket', 'aws_iam_role', 'aws_instance', 'aws_sqs_queue', 'aws_lambda_function']
+SDK_CLASSES = ['S3', 'EC2', 'SQS', 'SNS', 'DynamoDB', 'Lambda']
+ACTIONS = ['create', 'delete', 'describe', 'get', 'list', 'put', 'update', 'start', 'stop']
+
+
+class CorpusFile(NamedTuple):
+    """A generator and the number of units of its largest benchmark input."""
+    name: str
+    generate: Callable[[int, random.Random], str]
+    units: int
+
+
+def cloudformation(units: int, rng: random.Random) -> str:
+    """A YAML template with `units` resources using short form intrinsics."""
+    lines = ['AWSTemplateFormatVersion: "2010-09-09"', 'Parameters:', '  Env:', '    Type: String', 'Resources:']
+    for index in range(units):
+        lines += [f'  Resource{index}:',
+                  f'    Type: {rng.choice(CFN_TYPES)}',
+                  '    Properties:',
+                  f'      Name: !Sub "${{Env}}-resource-{index}"',
+                  f'      Role: !GetAtt Role{index % 50}.Arn',
+                  '      Tags:',
+                  '        - Key: Owner',
+                  f'          Value: !Ref Owner{index % 7}']
+    return '\n'.join(lines) + '\n'
+
+
+def ansible(units: int, rng: random.Random) -> str:
+    """A playbook with `units` tasks calling amazon.aws modules."""
+    lines = ['- hosts: all', '  tasks:']
+    for index in range(units):
+        lines += [f'    - name: task {index}',
+                  f'      amazon.aws.{rng.choice(SERVICES)}_info:',
+                  f'        region: us-east-{index % 2 + 1}']
+    return '\n'.join(lines) + '\n'
+
+
+def boto3(units: int, rng: random.Random) -> str:
+    """A module with `units` functions calling boto3 clients."""
+    lines = ['import boto3', '']
+    for service in SERVICES:
+        lines.append(f'{service}_client = boto3.client("{service}")')
+    for index in range(units):
+        service = rng.choice(SERVICES)
+        lines += ['', '', f'def handler_{index}(event):',
+                  f'    response = {service}_client.{rng.choice(ACTIONS)}_thing(Name=event["name"])',
+                  '    return response']
+    return '\n'.join(lines) + '\n'
+
+
+def powershell(units: int, rng: random.Random) -> str:
+    """A script with `units` AWS Tools for PowerShell cmdlet calls."""
+    verbs = ['New', 'Get', 'Remove', 'Start', 'Stop']
+    return '\n'.join(f'{rng.choice(verbs)}-{rng.choice(["EC2", "S3", "SQS"])}Thing -Name item{index}'
+                     for index in range(units)) + '\n'
+
+
+def shell(units: int, rng: random.Random) -> str:
+    """A script of `units` lines, one in four an AWS CLI call."""
+    lines = ['#!/bin/bash', 'set -euo pipefail']
+    for index in range(units):
+        if index % 4 == 0:
+            service = rng.choice(['ec2', 's3', 'iam', 'rds', 'lambda'])
+            lines.append(f'aws {service} {rng.choice(["describe", "create", "delete"])}-things --name item{index}')
+        else:
+            lines.append(f'echo "step {index}" && cp build/file{index} dist/ || true')
+    return '\n'.join(lines) + '\n'
+
+
+def terraform(units: int, rng: random.Random) -> str:
+    """`units` module blocks, each followed by a resource with nested blocks."""
+    blocks = []
+    for index in range(units):
+        blocks.append(f'module "mod{index}" {{\n'
+                      f'  source = "git::https://example.com/modules/m{index % 20}.git"\n'
+                      f'  name   = "mod-{index}"\n'
+                      f'  tags   = {{ owner = "team{index % 5}", index = "{index}" }}\n'
+                      '}\n')
+        blocks.append(f'resource "{rng.choice(TF_TYPES)}" "r{index}" {{\n'
+                      f'  name = "r-{index}"\n'
+                      '  lifecycle {\n    create_before_destroy = true\n  }\n'
+                      '  dynamic "setting" {\n    for_each = var.settings\n'
+                      '    content {\n      key   = setting.key\n      value = setting.value\n    }\n  }\n'
+                      '}\n')
+    return '\n'.join(blocks)
+
+
+def javascript(units: int, rng: random.Random) -> str:
+    """A webpack style bundle of `units` modules, some creating AWS SDK clients."""
+    parts = ['(function(modules) { /* bundle */ })({']
+    for index in range(units):
+        body = [f'  {index}: function(module, exports, require) {{',
+                '    var AWS = require("aws-sdk");']
+        if index % 3 == 0:
+            body += [f'    var client{index} = new AWS.{rng.choice(SDK_CLASSES)}();',
+                     f'    client{index}.{rng.choice(ACTIONS)}Thing({{Name: "item{index}"}});']
+        body += [f'    exports.value{index} = function(a, b) {{ return a + b * {index}; }};', '  },']
+        parts.extend(body)
+    parts.append('});')
+    return '\n'.join(parts) + '\n'
+
+
+def java(units: int, rng: random.Random) -> str:
+    """A class with `units` methods, each building an AWS client."""
+    lines = ['import com.amazonaws.services.s3.AmazonS3;', 'public class Generated {']
+    for index in range(units):
+        service = rng.choice(['S3', 'SQS', 'SNS'])
+        lines += [f'    public void method{index}() {{',
+                  f'        Amazon{service} client{index} = Amazon{service}ClientBuilder.defaultClient();',
+                  f'        client{index}.{rng.choice(ACTIONS)}Thing("item{index}");',
+                  '    }']
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def ruby(units: int, rng: random.Random) -> str:
+    """A script with `units` AWS SDK calls."""
+    lines = ['require "aws-sdk-s3"', 's3 = Aws::S3::Client.new']
+    lines += [f's3.{rng.choice(ACTIONS)}_thing(bucket: "item{index}")' for index in range(units)]
+    return '\n'.join(lines) + '\n'
+
+
+def chef(units: int, rng: random.Random) -> str:
+    """A recipe with `units` resources calling AWS helpers."""
+    lines = ['include_recipe "aws"']
+    for index in range(units):
+        lines += [f'aws_s3_file "/tmp/file{index}" do',
+                  f'  bucket "bucket{index % 10}"',
+                  'end',
+                  f'ec2.{rng.choice(ACTIONS)}_instances(instance_ids: ["i-{index:08d}"])']
+    return '\n'.join(lines) + '\n'
+
+
+def csharp(units: int, rng: random.Random) -> str:
+    """Generated C#, as from a designer or client generator, with `units` methods."""
+    lines = ['using System;', 'using Amazon.S3;', 'namespace Generated', '{', '    public partial class Client', '    {']
+    for index in range(units):
+        lines += [f'        public void Method{index}()',
+                  '        {',
+                  f'            var request{index} = new Amazon.S3.Model.{rng.choice(["Get", "Put", "List"])}ObjectRequest();',
+                  f'            Amazon.S3.AmazonS3Client.{rng.choice(["Create", "Delete", "Get"])}Bucket{index}(request{index});',
+                  '        }']
+    lines += ['    }', '}']
+    return '\n'.join(lines) + '\n'
+
+
+def springcloud(units: int, rng: random.Random) -> str:
+    """A Spring Cloud AWS service with `units` annotated methods."""
+    lines = ['package io.awspring.cloud.generated;', 'public class Listener {']
+    for index in range(units):
+        lines += [f'    @SqsListener("queue{index}")',
+                  f'    public void on{index}(String message) {{',
+                  f'        com.amazonaws.services.sqs.AmazonSQS{index % 5}.{rng.choice(ACTIONS)}Message(message);',
+                  '    }']
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def groovy(units: int, rng: random.Random) -> str:
+    """A Jenkinsfile with `units` stages running AWS CLI and SDK calls."""
+    lines = ['pipeline {', '  agent any', '  stages {']
+    for index in range(units):
+        lines += [f'    stage("step {index}") {{',
+                  f'      steps {{ sh "aws s3 cp build/{index} s3://bucket/{index}" }}',
+                  f'      script {{ s3.{rng.choice(["create", "delete", "get"])}Bucket("b{index}") }}',
+                  '    }']
+    lines += ['  }', '}']
+    return '\n'.join(lines) + '\n'
+
+
+def dotnet(units: int, rng: random.Random) -> str:
+    """A VB.NET module with `units` methods."""
+    lines = ['Imports System', 'Imports Amazon.S3', 'Public Class Generated']
+    for index in range(units):
+        lines += [f'    Public Sub Method{index}()',
+                  f'        Amazon.S3.AmazonS3Client.{rng.choice(["Create", "Get", "List"])}Object{index}()',
+                  '    End Sub']
+    lines.append('End Class')
+    return '\n'.join(lines) + '\n'
+
+
+def manifest(units: int, rng: random.Random) -> str:
+    """A Cloud Foundry manifest with `units` applications."""
+    lines = ['applications:']
+    for index in range(units):
+        lines += [f'  - name: app{index}', f'    instances: {rng.randint(1, 8)}',
+                  '    env:', f'      AWS_REGION: us-east-{index % 2 + 1}']
+    return '\n'.join(lines) + '\n'
+
+
+def javaproperty(units: int, rng: random.Random) -> str:
+    """A properties file with `units` keys, some of them AWS settings."""
+    return '\n'.join(f'aws.s3.bucket{index}=bucket-{index}' if rng.random() < 0.3 else f'app.key{index}=value{index}'
+                     for index in range(units)) + '\n'
+
+
+def jupyter(units: int, rng: random.Random) -> str:
+    """A notebook with `units` code cells, each with a heavy image output."""
+    cells = []
+    for index in range(units):
+        cells.append({'cell_type': 'code',
+                      'source': ['import boto3\n', f's3_{index} = boto3.client("s3")\n',
+                                 '%matplotlib inline\n', f's3_{index}.list_objects_v2(Bucket="b{index}")\n'],
+                      'outputs': [{'output_type': 'display_data',
+                                   'data': {'image/png': base64.b64encode(rng.randbytes(16384)).decode()}}]})
+    return json.dumps({'nbformat': 4, 'nbformat_minor': 5, 'metadata': {}, 'cells': cells})
+
+
+# parser name -> generator and its largest size; sized for a few seconds per parser
+CORPUS: Dict[str, CorpusFile] = {
+    'cloudformation': CorpusFile('template.yaml', cloudformation, 5000),
+    'ansible': CorpusFile('playbook.yml', ansible, 5000),
+    'boto3': CorpusFile('module.py', boto3, 5000),
+    'powershell': CorpusFile('script.ps1', powershell, 5000),
+    'shell': CorpusFile('script.sh', shell, 50000),
+    'terraform': CorpusFile('main.tf', terraform, 200),
+    'javascript': CorpusFile('bundle.js', javascript, 2000),
+    'java': CorpusFile('Generated.java', java, 1000),
+    'ruby': CorpusFile('script.rb', ruby, 20000),
+    'chef': CorpusFile('recipe.rb', chef, 10000),
+    'csharp': CorpusFile('Generated.cs', csharp, 1000),
+    'springcloud': CorpusFile('Listener.java', springcloud, 1000),
+    'groovy': CorpusFile('Jenkinsfile', groovy, 5000),
+    'dotnet': CorpusFile('Generated.vb', dotnet, 1000),
+    'manifest': CorpusFile('manifest.yml', manifest, 5000),
+    'javaproperty': CorpusFile('app.properties', javaproperty, 50000),
+    'jupyter': CorpusFile('notebook.ipynb', jupyter, 200),
+}
+
+
+def generate(parser: str, units: int, seed: int) -> str:
+    """The corpus file of a parser at a given size; the same seed gives the same content."""
+    return CORPUS[parser].generate(units, random.Random(f'{seed}:{parser}:{units}'))
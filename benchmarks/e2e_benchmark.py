@@ -0,0 +1,145 @@
+"""
+End-to-end crawler benchmark against a local fake GitHub API
+
+Generates a synthetic organization from a seed, serves it with
+benchmarks/fake_github.py and runs main.main against it with a cold parse
+cache. Reports repos/s, files/s, API calls per repo and bytes transferred.
+
+    python -m benchmarks.e2e_benchmark --repos 50 --depth 2 --seconds-between-requests 0
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+import yaml
+
+import main as crawler
+from benchmarks.fake_github import FakeGithub, generate_org
+from lib.file_manager import load_config
+
+ORG_NAME = 'bench-org'
+
+
+def run_benchmark(config_path: str, seed: int, repos: int, depth: int, dirs_per_level: int,
+                  files_per_dir: int, fork_ratio: float, latency: float,
+                  crawler_overrides: Optional[Dict[str, Any]] = None,
+                  profile_dir: Optional[str] = None, trace_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Crawl a synthetic organization once and measure the run.
+
+    Args:
+        config_path: The crawler configuration, config.yaml.
+        seed, repos, depth, dirs_per_level, files_per_dir, fork_ratio: Shape of
+            the synthetic organization, see fake_github.generate_org.
+        latency: Seconds the fake API waits before answering each request.
+        crawler_overrides: Keys replacing those of the crawler section.
+        profile_dir: Profile the crawl into this directory, see lib/profiler.py.
+        trace_path: Write a trace-event timeline of the crawl to this file.
+
+    Returns:
+        The measurements.
+    """
+    org = generate_org(seed, repos, depth, dirs_per_level, files_per_dir, fork_ratio)
+    total_files = sum(len(repo.files) for repo in org.values())
+    total_bytes = sum(len(data) for repo in org.values() for data in repo.files.values())
+
+    config = load_config(config_path)
+    config['crawler'] = dict(config.get('crawler') or {}, **(crawler_overrides or {}))
+
+    with tempfile.TemporaryDirectory() as workdir, FakeGithub(ORG_NAME, org, latency) as fake:
+        # cold cache: every file is parsed
+        config['cache'] = {'path': os.path.join(workdir, 'parse_results.sqlite')}
+        config['metrics'] = {'path': os.path.join(workdir, 'metrics.prom')}
+        # a fresh results store, so the crawl neither reads nor updates that of --delta runs
+        config['results_store'] = {'path': os.path.join(workdir, 'results.sqlite')}
+        config['rollups'] = dict(config.get('rollups') or {}, path=os.path.join(workdir, 'rollups.json'))
+        bench_config = os.path.join(workdir, 'config.yaml')
+        with open(bench_config, 'w', encoding='utf-8') as stream:
+            yaml.safe_dump(config, stream)
+        output_file = os.path.join(workdir, 'output.csv')
+
+        os.environ['GH_TOKEN'] = 'benchmark'
+        start = time.perf_counter()
+        crawler.main(bench_config, ORG_NAME, output_file, fake.url, None,
+                     crawler.RunOptions(profile_dir=profile_dir, trace_path=trace_path))
+        elapsed = time.perf_counter() - start
+
+        with open(output_file, encoding='utf-8') as stream:
+            rows = sum(1 for _ in stream) - 1
+        api_calls = sum(fake.calls.values())
+
+        return {
+            'seed': seed,
+            'repos': repos,
+            'files': total_files,
+            'file_bytes': total_bytes,
+            'findings': rows,
+            'seconds': round(elapsed, 3),
+            'repos_per_second': round(repos / elapsed, 2),
+            'files_per_second': round(total_files / elapsed, 2),
+            'api_calls': api_calls,
+            'api_calls_per_repo': round(api_calls / max(repos, 1), 2),
+            'bytes_transferred': fake.bytes_sent,
+            'calls_by_endpoint': dict(sorted(fake.calls.items())),
+            'crawler': config['crawler'],
+        }
+
+
+def main():
+    """Parse arguments, run the benchmark and print the report."""
+    parser = argparse.ArgumentParser(description="End-to-end crawler benchmark against a fake GitHub API")
+    parser.add_argument("--config", default="config.yaml", help="crawler configuration to benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repos", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=2, help="directory levels per repo")
+    parser.add_argument("--dirs-per-level", type=int, default=2)
+    parser.add_argument("--files-per-dir", type=int, default=5)
+    parser.add_argument("--fork-ratio", type=float, default=0.1, help="share of repos that are forks")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--io-workers", type=int, help="override crawler.io_workers")
+    parser.add_argument("--cpu-workers", type=int, help="override crawler.cpu_workers")
+    parser.add_argument("--seconds-between-requests", type=float,
+                        help="override crawler.seconds_between_requests")
+    parser.add_argument("--profile", dest="profile_dir", nargs="?", const="profile",
+                        help="profile the crawl into this directory (default: profile)")
+    parser.add_argument("--trace", dest="trace_path", nargs="?", const="trace.json",
+                        help="write a trace-event timeline of the crawl to this file (default: trace.json)")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the crawler's logs on stderr")
+    args = parser.parse_args()
+
+    overrides = {key: value for key, value in (('io_workers', args.io_workers),
+                                               ('cpu_workers', args.cpu_workers),
+                                               ('seconds_between_requests', args.seconds_between_requests))
+                 if value is not None}
+
+    stderr = None
+    if not args.verbose:
+        # parse processes log as well, so silence the stderr they inherit
+        stderr = os.dup(sys.stderr.fileno())
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stderr.fileno())
+        os.close(devnull)
+    try:
+        report = run_benchmark(args.config, args.seed, args.repos, args.depth, args.dirs_per_level,
+                               args.files_per_dir, args.fork_ratio, args.latency, overrides,
+                               args.profile_dir, args.trace_path)
+    finally:
+        if stderr is not None:
+            os.dup2(stderr, sys.stderr.fileno())
+            os.close(stderr)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+"""Local stand-in for the GitHub REST endpoints used by lib/github_manager"""
+
+import base64
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+TIMESTAMP = '2024-01-01T00:00:00Z'
+
+# Hourly request budget reported in the rate limit headers
+RATE_LIMIT = 5000
+
+# Code search requests per minute of a token, counted apart from the core rate limit
+SEARCH_RATE_LIMIT = 10
+
+# Like GitHub, the contents API leaves larger files without content
+CONTENTS_INLINE_LIMIT = 1_000_000
+
+# (file name pattern, weight, content template); the mix follows the assets of
+# config.yaml with a share of files no asset matches. {n} varies the content so
+# blobs are distinct, {word} picks from WORDS.
+FILE_MIX: List[Tuple[str, int, str]] = [
+    ('main{n}.tf', 4,
+     'resource "aws_s3_bucket" "b{n}" {{\n  bucket = "{word}-{n}"\n}}\n\n'
+     'resource "aws_iam_role" "r{n}" {{\n  name = "{word}"\n}}\n'),
+    ('stack{n}.yaml', 3,
+     'AWSTemplateFormatVersion: "2010-09-09"\nResources:\n'
+     '  Bucket{n}:\n    Type: AWS::S3::Bucket\n    Properties:\n      BucketName: !Sub "${{AWS::StackName}}-{word}"\n'
+     '  Queue{n}:\n    Type: AWS::SQS::Queue\n'),
+    ('playbook{n}.yml', 2,
+     '- hosts: all\n  tasks:\n    - name: {word}\n      amazon.aws.s3_bucket:\n        name: {word}-{n}\n'),
+    ('app{n}.py', 6,
+     'import boto3\n\ns3 = boto3.client("s3")\n\n\ndef handler_{n}(event):\n'
+     '    return s3.list_objects_v2(Bucket="{word}")\n'),
+    ('util{n}.py', 6, 'def {word}_{n}(x):\n    return x * {n}\n'),
+    ('deploy{n}.sh', 2, '#!/bin/sh\naws s3 cp build/ s3://{word}-{n}/ --recursive\n'),
+    ('index{n}.js', 3,
+     'const AWS = require("aws-sdk");\nconst s3 = new AWS.S3();\ns3.getObject({{Bucket: "{word}"}});\n'),
+    ('client{n}.rb', 1, 'require "aws-sdk-s3"\ns3 = Aws::S3::Client.new\ns3.list_buckets()\n'),
+    ('Service{n}.java', 2,
+     'import com.amazonaws.services.s3.AmazonS3;\npublic class Service{n} {{\n'
+     '    void run(AmazonS3 s3) {{ s3.listBuckets(); }}\n}}\n'),
+    ('notebook{n}.ipynb', 1, None),
+    ('Jenkinsfile', 1, 'pipeline {{\n  stages {{\n    stage("{word}") {{ steps {{ sh "aws s3 ls" }} }}\n  }}\n}}\n'),
+    ('README{n}.md', 5, '# {word}\n\nNothing to see here.\n'),
+    ('data{n}.json', 3, '{{"name": "{word}", "value": {n}}}\n'),
+]
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']
+
+
+def blob_sha(data: bytes) -> str:
+    """Git blob SHA of a file content."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def _notebook(rng: random.Random, n: int) -> str:
+    cells = [{'cell_type': 'code', 'source': ['import boto3\n', f's3 = boto3.client("s3")\ns3.list_buckets()  # {n}\n'],
+              'outputs': [{'output_type': 'display_data',
+                           'data': {'image/png': base64.b64encode(rng.randbytes(2048)).decode()}}]}]
+    return json.dumps({'nbformat': 4, 'cells': cells})
+
+
+class FakeRepo(NamedTuple):
+    """A synthetic repository: its files by path, and its fork parent."""
+    name: str
+    files: Dict[str, bytes]
+    parent: Optional[str]
+
+    @property
+    def tree_sha(self) -> str:
+        """Root tree SHA; identical contents give identical SHAs like in git."""
+        digest = hashlib.sha1()
+        for path in sorted(self.files):
+            digest.update(f'{path}\0{blob_sha(self.files[path])}\n'.encode())
+        return digest.hexdigest()
+
+
+def generate_org(seed: int, repos: int, depth: int, dirs_per_level: int, files_per_dir: int,
+                 fork_ratio: float = 0.0) -> Dict[str, FakeRepo]:
+    """
+    Generate the repositories of a synthetic organization.
+
+    Args:
+        seed: Seed of the generator; the same arguments give the same org.
+        repos: Number of repositories.
+        depth: Directory levels below the repository root.
+        dirs_per_level: Subdirectories of every directory above the deepest level.
+        files_per_dir: Files in every directory, drawn from FILE_MIX.
+        fork_ratio: Share of repositories that are forks of another one,
+            with a few files changed.
+
+    Returns:
+        The repositories by name.
+    """
+    rng = random.Random(seed)
+    weights = [weight for _, weight, _ in FILE_MIX]
+    org: Dict[str, FakeRepo] = {}
+    counter = 0
+
+    def fill(files: Dict[str, bytes], prefix: str, level: int):
+        nonlocal counter
+        for _ in range(files_per_dir):
+            counter += 1
+            name, _, template = rng.choices(FILE_MIX, weights)[0]
+            name = name.format(n=counter)
+            if template is None:
+                content = _notebook(rng, counter)
+            else:
+                content = template.format(n=counter, word=rng.choice(WORDS))
+            files[prefix + name] = content.encode()
+        if level < depth:
+            for index in range(dirs_per_level):
+                fill(files, f'{prefix}dir{level}_{index}/', level + 1)
+
+    for index in range(repos):
+        name = f'repo{index:04d}'
+        sources = [repo for repo in org.values() if repo.parent is None]
+        if sources and rng.random() < fork_ratio:
+            parent = rng.choice(sources)
+            files = dict(parent.files)
+            for path in rng.sample(sorted(files), min(2, len(files))):
+                files[path] = files[path] + f'\n# changed in {name}\n'.encode()
+            org[name] = FakeRepo(name, files, parent.name)
+            continue
+        files: Dict[str, bytes] = {}
+        fill(files, '', 0)
+        org[name] = FakeRepo(name, files, None)
+    return org
+
+
+class FakeGithub:
+    """
+    Serves a synthetic organization over HTTP, counting calls and bytes.
+
+    Only the endpoints and fields lib/github_manager reads are implemented.
+    Every token, the Authorization header, gets its own rate limit of
+    rate_limit requests; beyond it requests are refused with a 403. Code
+    search answers plain phrases with extension:, filename:, org: and repo:
+    qualifiers under its own limit of search_rate_limit requests a minute.
+    Commits are the root tree SHAs served as branch heads; files changed in
+    place after the start compare against the heads served before.
+    """
+
+    def __init__(self, org_name: str, repos: Dict[str, FakeRepo], latency: float = 0.0,
+                 rate_limit: int = RATE_LIMIT, search_rate_limit: int = SEARCH_RATE_LIMIT):
+        self.org_name = org_name
+        self.repos = repos
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.search_rate_limit = search_rate_limit
+        # start of the current one minute search window and the searches in it
+        self._search_window = (0.0, 0)
+        self.calls: Dict[str, int] = collections.Counter()
+        self.calls_by_token: Dict[str, int] = collections.Counter()
+        self.bytes_sent = 0
+        self.rate_limit_reset = int(time.time()) + 3600
+        self._lock = threading.Lock()
+        # (repository name, head SHA) -> files, for the compare API
+        self.commits: Dict[Tuple[str, str], Dict[str, bytes]] = {
+            (repo.name, repo.tree_sha): dict(repo.files) for repo in repos.values()}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass as gh_endpoint."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record(self, endpoint: str, size: int):
+        """Count one call and its response bytes."""
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.bytes_sent += size
+
+    def spend(self, token: str) -> int:
+        """Count one request against a token's rate limit; returns the requests it has left, -1 when over."""
+        with self._lock:
+            if self.calls_by_token[token] >= self.rate_limit:
+                return -1
+            self.calls_by_token[token] += 1
+            return self.rate_limit - self.calls_by_token[token]
+
+    def spend_search(self) -> Tuple[int, int]:
+        """Count one search request; returns the searches left in the window, -1 when over, and its reset."""
+        with self._lock:
+            start, count = self._search_window
+            now = time.time()
+            if now - start >= 60:
+                start, count = now, 0
+            if count >= self.search_rate_limit:
+                return -1, int(start + 60)
+            self._search_window = (start, count + 1)
+            return self.search_rate_limit - count - 1, int(start + 60)
+
+    # JSON documents
+
+    def repo_json(self, repo: FakeRepo, full: bool = False) -> dict:
+        """A repository as listed, or as returned by GET /repos/{owner}/{repo} when full."""
+        full_name = f'{self.org_name}/{repo.name}'
+        document = {
+            'id': abs(hash(full_name)) % 10 ** 9,
+            'name': repo.name,
+            'full_name': full_name,
+            'owner': {'login': self.org_name, 'type': 'Organization'},
+            'url': f'{self.url}/repos/{full_name}',
+            'html_url': f'https://github.example/{full_name}',
+            'default_branch': 'main',
+            'created_at': TIMESTAMP,
+            'pushed_at': TIMESTAMP,
+            'updated_at': TIMESTAMP,
+            'language': 'Python',
+            'topics': [],
+            'archived': False,
+            'fork': repo.parent is not None,
+            'private': False,
+        }
+        if full and repo.parent is not None:
+            document['parent'] = self.repo_json(self.repos[repo.parent])
+            document['source'] = document['parent']
+        return document
+
+    def content_json(self, repo: FakeRepo, path: str, with_content: bool) -> dict:
+        """A file or directory entry of the contents API."""
+        full_name = f'{self.org_name}/{repo.name}'
+        data = repo.files.get(path)
+        sha = blob_sha(data) if data is not None else hashlib.sha1(path.encode()).hexdigest()
+        document = {
+            'type': 'file' if data is not None else 'dir',
+            'name': path.rsplit('/', 1)[-1],
+            'path': path,
+            'sha': sha,
+            'size': len(data) if data is not None else 0,
+            'url': f'{self.url}/repos/{full_name}/contents/{quote(path)}?ref=main',
+            'git_url': f'{self.url}/repos/{full_name}/git/{"blobs" if data is not None else "trees"}/{sha}',
+            'html_url': f'https://github.example/{full_name}/blob/main/{quote(path)}',
+        }
+        if with_content and data is not None:
+            inline = len(data) <= CONTENTS_INLINE_LIMIT
+            document['encoding'] = 'base64' if inline else 'none'
+            document['content'] = base64.b64encode(data).decode() if inline else ''
+        return document
+
+    def directory_json(self, repo: FakeRepo, path: str) -> Optional[list]:
+        """The entries of a directory, or None if there is no such directory."""
+        prefix = f'{path}/' if path else ''
+        names = {}
+        for file_path in repo.files:
+            if file_path.startswith(prefix):
+                name, _, rest = file_path[len(prefix):].partition('/')
+                names[name] = bool(rest)
+        if not names:
+            return None
+        return [self.content_json(repo, prefix + name, with_content=False) for name in sorted(names)]
+
+    def search_code(self, query: Dict[str, List[str]]) -> Tuple[str, int, object, Dict[str, str]]:
+        """GET /search/code: files containing every phrase of q, forks excluded like on GitHub."""
+        q = query.get('q', [''])[0]
+        phrases = [phrase.lower() for phrase in re.findall(r'"([^"]*)"', q)]
+        qualifiers = dict(re.findall(r'(\w+):(\S+)', re.sub(r'"[^"]*"', '', q)))
+        owner = qualifiers.get('org') or qualifiers.get('repo', '').split('/')[0]
+        hits = []
+        if owner == self.org_name:
+            for name in sorted(self.repos):
+                repo = self.repos[name]
+                if repo.parent is not None or qualifiers.get('repo', f'{owner}/{name}') != f'{owner}/{name}':
+                    continue
+                for file_path, data in sorted(repo.files.items()):
+                    file_name = file_path.rsplit('/', 1)[-1]
+                    if 'extension' in qualifiers and not file_name.endswith('.' + qualifiers['extension']):
+                        continue
+                    if 'filename' in qualifiers and file_name != qualifiers['filename']:
+                        continue
+                    text = data.decode('utf-8', 'replace').lower()
+                    if all(phrase in text for phrase in phrases):
+                        hits.append((repo, file_path))
+
+        per_page = int(query.get('per_page', ['30'])[0])
+        page = int(query.get('page', ['1'])[0])
+        chunk = hits[(page - 1) * per_page:page * per_page]
+        items = [dict(self.content_json(repo, file_path, with_content=False),
+                      repository=self.repo_json(repo), score=1.0) for repo, file_path in chunk]
+        headers = {}
+        if page * per_page < len(hits):
+            headers['Link'] = f'<{self.url}/search/code?q={quote(q)}&per_page={per_page}&page={page + 1}>; rel="next"'
+        return 'search', 200, {'total_count': len(hits), 'incomplete_results': False, 'items': items}, headers
+
+    def compare(self, repo: FakeRepo, basehead: str) -> Tuple[str, int, object, Dict[str, str]]:
+        """The files changed between two served heads, capped at 300 like GitHub."""
+        base_sha, _, head_sha = basehead.partition('...')
+        with self._lock:
+            base = self.commits.get((repo.name, base_sha))
+            head = self.commits.get((repo.name, head_sha))
+        if base is None or head is None:
+            return 'not_found', 404, {'message': 'Not Found'}, {}
+        files = []
+        for path in sorted(set(base) | set(head)):
+            if path not in head:
+                files.append({'filename': path, 'status': 'removed', 'sha': blob_sha(base[path])})
+            elif path not in base:
+                files.append({'filename': path, 'status': 'added', 'sha': blob_sha(head[path])})
+            elif base[path] != head[path]:
+                files.append({'filename': path, 'status': 'modified', 'sha': blob_sha(head[path])})
+        status = 'ahead' if files else 'identical'
+        return 'compare', 200, {'status': status, 'ahead_by': int(bool(files)), 'behind_by': 0,
+                                'total_commits': int(bool(files)), 'commits': [], 'files': files[:300]}, {}
+
+    def route(self, path: str, query: Dict[str, List[str]],
+              remaining: int = RATE_LIMIT) -> Tuple[str, int, object, Dict[str, str]]:
+        """Resolve a request to (endpoint, status, document, extra headers)."""
+        match = re.fullmatch(r'/orgs/([^/]+)', path)
+        if match and match.group(1) == self.org_name:
+            return 'org', 200, {'login': self.org_name, 'url': f'{self.url}/orgs/{self.org_name}'}, {}
+
+        match = re.fullmatch(r'/orgs/([^/]+)/repos', path)
+        if match and match.group(1) == self.org_name:
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            names = sorted(self.repos)
+            chunk = names[(page - 1) * per_page:page * per_page]
+            headers = {}
+            if page * per_page < len(names):
+                headers['Link'] = f'<{self.url}{path}?per_page={per_page}&page={page + 1}>; rel="next"'
+            return 'repos', 200, [self.repo_json(self.repos[name]) for name in chunk], headers
+
+        if path == '/rate_limit':
+            core = {'limit': self.rate_limit, 'remaining': remaining, 'reset': self.rate_limit_reset,
+                    'used': self.rate_limit - remaining}
+            return 'rate_limit', 200, {'resources': {'core': core}, 'rate': core}, {}
+
+        match = re.fullmatch(r'/repos/([^/]+)/([^/]+)(/.*)?', path)
+        if not match or match.group(1) != self.org_name or match.group(2) not in self.repos:
+            return 'not_found', 404, {'message': 'Not Found'}, {}
+        repo = self.repos[match.group(2)]
+        rest = match.group(3) or ''
+
+        if rest == '':
+            return 'repo', 200, self.repo_json(repo, full=True), {}
+        if rest in ('/languages', '/labels'):
+            return rest[1:], 200, {} if rest == '/languages' else [], {}
+        if rest.startswith('/branches/'):
+            tree_sha = repo.tree_sha
+            with self._lock:
+                self.commits.setdefault((repo.name, tree_sha), dict(repo.files))
+            return 'branch', 200, {'name': 'main', 'protected': False,
+                                   'commit': {'sha': tree_sha, 'commit': {'tree': {'sha': tree_sha}}}}, {}
+        if rest.startswith('/compare/'):
+            return self.compare(repo, unquote(rest[len('/compare/'):]))
+        if rest.startswith('/git/trees/'):
+            tree = [{'path': file_path, 'type': 'blob', 'mode': '100644', 'sha': blob_sha(data), 'size': len(data)}
+                    for file_path, data in sorted(repo.files.items())]
+            directories = {'/'.join(file_path.split('/')[:depth]) for file_path in repo.files
+                           for depth in range(1, file_path.count('/') + 1)}
+            tree += [{'path': directory, 'type': 'tree', 'mode': '040000',
+                      'sha': hashlib.sha1(directory.encode()).hexdigest()} for directory in sorted(directories)]
+            return 'tree', 200, {'sha': repo.tree_sha, 'tree': tree, 'truncated': False}, {}
+        if rest.startswith('/git/blobs/'):
+            sha = rest[len('/git/blobs/'):]
+            for data in repo.files.values():
+                if blob_sha(data) == sha:
+                    return 'blob', 200, {'sha': sha, 'size': len(data), 'encoding': 'base64',
+                                         'content': base64.encodebytes(data).decode()}, {}
+            return 'not_found', 404, {'message': 'Not Found'}, {}
+        if rest == '/contents' or rest.startswith('/contents/'):
+            content_path = unquote(rest[len('/contents/'):]).strip('/')
+            if content_path in repo.files:
+                return 'file', 200, self.content_json(repo, content_path, with_content=True), {}
+            listing = self.directory_json(repo, content_path)
+            if listing is None:
+                return 'not_found', 404, {'message': 'Not Found'}, {}
+            return 'contents', 200, listing, {}
+        return 'not_found', 404, {'message': 'Not Found'}, {}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers GET requests from the synthetic organization."""
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Serve one request."""
+                if fake.latency:
+                    threading.Event().wait(fake.latency)
+                url = urlsplit(self.path)
+                path = url.path
+                if path.startswith('/api/v3'):
+                    path = path[len('/api/v3'):]
+                if path == '/search/code':
+                    remaining, reset = fake.spend_search()
+                    limit_headers = {'X-RateLimit-Resource': 'code_search',
+                                     'X-RateLimit-Limit': str(fake.search_rate_limit)}
+                else:
+                    remaining, reset = fake.spend(self.headers.get('Authorization', '')), fake.rate_limit_reset
+                    limit_headers = {'X-RateLimit-Limit': str(fake.rate_limit)}
+                limit_headers.update({'X-RateLimit-Remaining': str(max(0, remaining)), 'X-RateLimit-Reset': str(reset)})
+                if remaining < 0:
+                    endpoint, status, document, headers = 'rate_limited', 403, {'message': 'API rate limit exceeded'}, {}
+                elif path == '/search/code':
+                    endpoint, status, document, headers = fake.search_code(parse_qs(url.query))
+                else:
+                    endpoint, status, document, headers = fake.route(path, parse_qs(url.query), remaining)
+                body = json.dumps(document).encode()
+                fake.record(endpoint, len(body))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in {**limit_headers, **headers}.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                """Keep the benchmark output readable."""
+
+        return Handler
@@ -0,0 +1,197 @@
+"""
+Parser micro-benchmark
+
+Times every parser registered in lib.file_manager.PARSERS on synthetic large
+inputs from benchmarks/corpus.py at several sizes. Reports throughput (MB/s)
+and peak memory at the largest size, and the scaling exponent of parse time
+over input size: 1 is linear, 2 quadratic.
+
+Results can be saved as a JSON baseline and compared against it; any parser
+slower, hungrier or scaling worse than its baseline fails the run.
+
+    python -m benchmarks.parser_benchmark --save-baseline
+    python -m benchmarks.parser_benchmark
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from benchmarks.corpus import CORPUS, generate
+from lib.file_manager import PARSERS
+from lib.parsers.shared import clear_caches
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'parser_baseline.json')
+
+# Fractions of a corpus file's units the scaling is measured at
+SIZE_STEPS = (0.25, 0.5, 1.0)
+
+# Scaling exponents above this are reported as superlinear
+SUPERLINEAR = 1.3
+
+
+def time_parse(parse_function, content: str, repeat: int) -> float:
+    """Best wall time of repeat parses, with the parse-once caches emptied before each."""
+    best = math.inf
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        parse_function(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(parse_function, content: str) -> int:
+    """Peak bytes allocated by one parse."""
+    clear_caches()
+    tracemalloc.start()
+    try:
+        parse_function(content)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scaling_exponent(sizes: List[int], seconds: List[float]) -> float:
+    """Least squares slope of log(time) over log(size)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(second, 1e-9)) for second in seconds]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+
+def benchmark_parser(parser: str, seed: int, scale: float, repeat: int) -> Dict[str, Any]:
+    """Measure one parser over the size steps of its corpus file."""
+    parse_function, _ = PARSERS[parser]
+    corpus_file = CORPUS[parser]
+    sizes, seconds = [], []
+    content = ''
+    try:
+        for step in SIZE_STEPS:
+            content = generate(parser, max(1, int(corpus_file.units * scale * step)), seed)
+            sizes.append(len(content.encode()))
+            seconds.append(time_parse(parse_function, content, repeat))
+        peak = peak_memory(parse_function, content)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return {'error': f"{type(e).__name__}: {e}"}
+
+    exponent = scaling_exponent(sizes, seconds)
+    return {
+        'bytes': sizes[-1],
+        'seconds': round(seconds[-1], 4),
+        'mb_per_second': round(sizes[-1] / 1e6 / max(seconds[-1], 1e-9), 3),
+        'peak_memory_mb': round(peak / 1e6, 2),
+        'scaling_exponent': round(exponent, 2),
+        'superlinear': exponent > SUPERLINEAR,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Compare results against a baseline.
+
+    Returns:
+        One message per regression: throughput or peak memory worse than the
+        baseline by more than tolerance, a superlinear scaling exponent that
+        grew, or a parser that stopped working.
+    """
+    regressions = []
+    for parser, result in results.items():
+        base = baseline.get(parser)
+        if not base or 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append(f"{parser}: fails with {result['error']}")
+            continue
+        if result['mb_per_second'] < base['mb_per_second'] * (1 - tolerance):
+            regressions.append(f"{parser}: {result['mb_per_second']} MB/s, baseline {base['mb_per_second']} MB/s")
+        if result['peak_memory_mb'] > base['peak_memory_mb'] * (1 + tolerance):
+            regressions.append(f"{parser}: peak {result['peak_memory_mb']} MB, baseline {base['peak_memory_mb']} MB")
+        if result['superlinear'] and result['scaling_exponent'] > base['scaling_exponent'] + 0.2:
+            regressions.append(f"{parser}: scales as size^{result['scaling_exponent']}, "
+                               f"baseline size^{base['scaling_exponent']}")
+    return regressions
+
+
+def write_corpus(directory: str, seed: int, scale: float):
+    """Write the largest corpus file of every parser, for a look or a profiler."""
+    os.makedirs(directory, exist_ok=True)
+    for parser, corpus_file in CORPUS.items():
+        content = generate(parser, max(1, int(corpus_file.units * scale)), seed)
+        with open(os.path.join(directory, f'{parser}-{corpus_file.name}'), 'w', encoding='utf-8') as stream:
+            stream.write(content)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse arguments, run the benchmark, compare or save the baseline."""
+    parser = argparse.ArgumentParser(description="Parser micro-benchmark on a synthetic large-file corpus")
+    parser.add_argument("parsers", nargs="*", help="parsers to benchmark, all by default")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of every corpus file size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed parses per size, the best one counts")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative throughput and memory regression")
+    parser.add_argument("--write-corpus", metavar="DIR", help="only write the corpus files to DIR")
+    args = parser.parse_args(argv)
+
+    if args.write_corpus:
+        write_corpus(args.write_corpus, args.seed, args.scale)
+        return 0
+
+    unknown = [name for name in args.parsers if name not in PARSERS or name not in CORPUS]
+    if unknown:
+        parser.error(f"no parser or corpus for: {', '.join(unknown)}")
+
+    # parsers log every failure; keep the report readable
+    logging.disable(logging.ERROR)
+
+    results = {}
+    for name in args.parsers or [name for name in PARSERS if name in CORPUS]:
+        results[name] = benchmark_parser(name, args.seed, args.scale, args.repeat)
+        print(f"{name:15} {json.dumps(results[name])}", file=sys.stderr)
+
+    report = {'seed': args.seed, 'scale': args.scale, 'parsers': results}
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as stream:
+                baseline = json.load(stream)
+        baseline.update({'seed': args.seed, 'scale': args.scale})
+        baseline.setdefault('parsers', {}).update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as stream:
+            json.dump(baseline, stream, indent=2)
+            stream.write('\n')
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as stream:
+        baseline = json.load(stream)
+    if (baseline.get('seed'), baseline.get('scale')) != (args.seed, args.scale):
+        print("Baseline was recorded with another seed or scale; not comparing", file=sys.stderr)
+        return 0
+
+    regressions = compare(results, baseline.get('parsers', {}), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Module running the crawls of several organizations, listed in a manifest, as one crawl"""
+
+import csv
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+from github import Github, Repository
+
+from lib import metrics, tracing
+from lib.file_manager import Finding
+from lib.github_manager import format_findings, retrieve_repos
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class BatchTarget(NamedTuple):
+    """An organization of the manifest and where its results go."""
+    org: str
+    output: str
+    # repository names of the organization; None crawls all of them
+    repos: Optional[List[str]]
+    # path of the organization's own rollup report
+    rollups: Optional[str]
+
+
+def load_manifest(path: str) -> List[BatchTarget]:
+    """
+    Read a batch manifest: a YAML file with a targets list, each with an org,
+    its output CSV file, and optionally the repos to crawl and a rollups path.
+
+    Raises:
+        ValueError: If the manifest is not YAML, or a target misses its org or output.
+    """
+    with open(path, 'r', encoding='utf-8') as stream:
+        try:
+            manifest = yaml.safe_load(stream) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid manifest '{path}': {e}") from e
+    targets = []
+    for index, target in enumerate(manifest.get('targets') or []):
+        if not target.get('org') or not target.get('output'):
+            raise ValueError(f"Target {index} of '{path}' needs an org and an output")
+        repos = target.get('repos')
+        targets.append(BatchTarget(target['org'], target['output'],
+                                   [repos] if isinstance(repos, str) else repos, target.get('rollups')))
+    return targets
+
+
+def retrieve_targets(github_client: Github, targets: List[BatchTarget]
+                     ) -> Tuple[List[Repository.Repository], Dict[str, List[BatchTarget]]]:
+    """
+    Enumerate the repositories of every target.
+
+    A repository listed by several targets is crawled once and written to
+    each of their outputs.
+
+    Returns:
+        The repositories to crawl, and the targets of each by full name
+    """
+    repos: Dict[str, Repository.Repository] = {}
+    targets_by_repo: Dict[str, List[BatchTarget]] = {}
+    for target in targets:
+        with tracing.span('enumerate_target', org=target.org):
+            found = []
+            for repository in target.repos or [None]:
+                found.extend(retrieve_repos(github_client, target.org, repository))
+        logger.info("Target '%s': %s repositories -> '%s'", target.org, len(found), target.output)
+        for repo in found:
+            repos.setdefault(repo.full_name, repo)
+            if target not in targets_by_repo.setdefault(repo.full_name, []):
+                targets_by_repo[repo.full_name].append(target)
+    duplicates = sum(1 for repo_targets in targets_by_repo.values() if len(repo_targets) > 1)
+    if duplicates:
+        logger.info("%s repositories are listed by several targets and crawled once", duplicates)
+    return list(repos.values()), targets_by_repo
+
+
+def target_repos(target: BatchTarget, targets_by_repo: Dict[str, List[BatchTarget]]) -> List[str]:
+    """The full names of the repositories of a target."""
+    return [full_name for full_name, repo_targets in targets_by_repo.items() if target in repo_targets]
+
+
+def start_outputs(targets: List[BatchTarget], headers: Optional[List[str]]):
+    """Create the output CSV file of every target with its header row."""
+    for output in dict.fromkeys(target.output for target in targets):
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output, 'w', newline='', encoding='utf-8') as csvfile:
+            if headers:
+                csv.writer(csvfile).writerow(headers)
+
+
+def batch_sink(targets_by_repo: Dict[str, List[BatchTarget]]):
+    """A process_repos sink appending each repository's rows to the outputs of its targets."""
+
+    def sink(repo: Repository.Repository, findings: List[Finding], branch_metadata: Dict[str, Any]):
+        rows = format_findings(repo, findings, branch_metadata)
+        outputs = dict.fromkeys(target.output for target in targets_by_repo.get(repo.full_name, []))
+        with tracing.span('write', repo=repo.full_name, findings=len(findings)):
+            for output in outputs:
+                with open(output, 'a', newline='', encoding='utf-8') as csvfile:
+                    csvfile.write(rows)
+        metrics.inc('repos_total', stage='written')
+        metrics.inc('findings_total', len(findings))
+
+    return sink
@@ -0,0 +1,120 @@
+"""Module providing a persistent parse result cache"""
+
+import os
+import pickle
+import sqlite3
+from typing import Any, Dict, Optional, Tuple
+
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_cache_path: Optional[str] = None
+_connection: Optional[sqlite3.Connection] = None
+_connection_pid: Optional[int] = None
+
+
+def init_cache(cache_path: Optional[str]):
+    """
+    Enable the parse result cache for the current process.
+
+    The connection itself is opened lazily, so this is safe to call in a parent
+    process before forking as well as in a Pool initializer.
+
+    Args:
+        cache_path: Path to the SQLite cache file. None disables the cache.
+    """
+    global _cache_path, _connection, _connection_pid  # pylint: disable=global-statement
+    _cache_path = cache_path
+    _connection = None
+    _connection_pid = None
+
+
+def _get_connection() -> Optional[sqlite3.Connection]:
+    """Return this process' connection, opening it on first use."""
+    global _connection, _connection_pid  # pylint: disable=global-statement
+    if not _cache_path:
+        return None
+    # never reuse a connection inherited from a forked parent
+    if _connection is None or _connection_pid != os.getpid():
+        cache_dir = os.path.dirname(_cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        _connection = sqlite3.connect(_cache_path, timeout=30)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("""CREATE TABLE IF NOT EXISTS parse_results (
+                                   parser TEXT NOT NULL,
+                                   version TEXT NOT NULL,
+                                   blob_sha TEXT NOT NULL,
+                                   result BLOB NOT NULL,
+                                   PRIMARY KEY (parser, version, blob_sha))""")
+        _connection.commit()
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def get_cached_result(parser: str, version: Any, blob_sha: str) -> Tuple[bool, Any]:
+    """
+    Look up the stored analysis result of a parser for a blob.
+
+    Args:
+        parser: Name of the parser, as registered in file_manager.PARSERS.
+        version: The parser's PARSER_VERSION.
+        blob_sha: Git blob SHA of the file content.
+
+    Returns:
+        A (hit, result) tuple. result is None on a miss.
+    """
+    try:
+        connection = _get_connection()
+        if connection is None:
+            return False, None
+        row = connection.execute(
+            "SELECT result FROM parse_results WHERE parser = ? AND version = ? AND blob_sha = ?",
+            (parser, str(version), blob_sha)).fetchone()
+        if row is None:
+            return False, None
+        return True, pickle.loads(row[0])
+    except (sqlite3.Error, pickle.UnpicklingError, EOFError) as e:
+        logger.warning("Failed reading parse cache for %s %s: %s", parser, blob_sha, e)
+        return False, None
+
+
+def store_result(parser: str, version: Any, blob_sha: str, result: Any):
+    """
+    Store the analysis result of a parser for a blob.
+
+    Args:
+        parser: Name of the parser, as registered in file_manager.PARSERS.
+        version: The parser's PARSER_VERSION.
+        blob_sha: Git blob SHA of the file content.
+        result: The analysis result returned by the parser.
+    """
+    try:
+        connection = _get_connection()
+        if connection is None:
+            return
+        connection.execute("INSERT OR REPLACE INTO parse_results VALUES (?, ?, ?, ?)",
+                           (parser, str(version), blob_sha, pickle.dumps(result)))
+        connection.commit()
+    except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+        logger.warning("Failed writing parse cache for %s %s: %s", parser, blob_sha, e)
+
+
+def prune_stale_results(parser_versions: Dict[str, Any]):
+    """
+    Drop cached results written by other versions of the registered parsers.
+
+    Args:
+        parser_versions: Mapping of parser name to its current PARSER_VERSION.
+    """
+    try:
+        connection = _get_connection()
+        if connection is None:
+            return
+        for parser, version in parser_versions.items():
+            connection.execute("DELETE FROM parse_results WHERE parser = ? AND version != ?",
+                               (parser, str(version)))
+        connection.commit()
+    except sqlite3.Error as e:
+        logger.warning("Failed pruning parse cache: %s", e)
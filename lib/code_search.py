@@ -0,0 +1,188 @@
+"""Module discovering candidate files with GitHub code search instead of walking repository trees"""
+
+import fnmatch
+import posixpath
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from github import ContentFile, Github, GithubException, RateLimitExceededException, Repository
+
+from lib import metrics, tracing
+from lib.logger import setup_logger
+from lib.path_filter import PathPruner, repo_pruner
+
+logger = setup_logger(__name__)
+
+# Results per search page, the most GitHub serves
+SEARCH_PAGE_SIZE = 100
+
+# GitHub serves at most this many results of a query
+MAX_SEARCH_RESULTS = 1000
+
+# The code search rate limit of an authenticated user
+DEFAULT_SEARCHES_PER_MINUTE = 10
+
+# Seconds waited for the search budget when a rate limited response has no reset time
+DEFAULT_RATE_LIMIT_WAIT = 60.0
+
+
+class SearchQuery(NamedTuple):
+    """A code search query for one content_match of an asset."""
+    query: str
+    asset_type: str
+    # glob the hits must match; search qualifiers cannot express every glob
+    file_match: str
+
+
+class SearchThrottle:
+    """Spaces code search requests to stay within the search rate limit, apart from the core one."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+
+    def wait(self):
+        """Block until the next search request may be sent."""
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval
+
+
+def file_qualifier(file_match: str) -> Optional[str]:
+    """
+    The search qualifier of a file_match glob: filename: for a plain name,
+    extension: for *.ext, None when search cannot express it.
+    """
+    name = posixpath.basename(file_match)
+    if not any(char in name for char in '*?['):
+        return f'filename:{name}'
+    extension = name[2:]
+    if name.startswith('*.') and extension and not any(char in extension for char in '*?[.'):
+        return f'extension:{extension}'
+    return None
+
+
+def search_scope(user_or_org: str, repository: Optional[str] = None) -> str:
+    """The org: or repo: qualifier restricting queries to the crawled repositories."""
+    # same owner formats as retrieve_repos
+    owner = user_or_org.split('/')[-1]
+    return f'repo:{owner}/{repository}' if repository else f'org:{owner}'
+
+
+def build_queries(assets: List[Dict[str, Any]], scope: str) -> List[SearchQuery]:
+    """
+    Turns every content_match of the content-matched assets into a code search query.
+
+    Assets matched on file names alone cannot be searched and are left out.
+    """
+    queries: Dict[str, SearchQuery] = {}
+    unsearchable = []
+    for asset in assets:
+        if asset.get('matchType') != 'content' or not asset.get('content_match'):
+            unsearchable.append(asset.get('type'))
+            continue
+        file_match = asset.get('file_match') or '*'
+        qualifier = file_qualifier(file_match)
+        for term in asset['content_match']:
+            # search has no escape for quotes inside a phrase
+            phrase = '"' + str(term).replace('"', ' ').strip() + '"'
+            query = ' '.join(part for part in (phrase, qualifier, scope) if part)
+            queries.setdefault(query, SearchQuery(query, asset.get('type'), file_match))
+    if unsearchable:
+        logger.warning("Discovery skips the assets matched by file name only: %s",
+                       ', '.join(sorted({str(asset_type) for asset_type in unsearchable})))
+    return list(queries.values())
+
+
+def _rate_limit_wait(e: RateLimitExceededException) -> float:
+    headers = e.headers or {}
+    if headers.get('retry-after'):
+        return float(headers['retry-after'])
+    if headers.get('x-ratelimit-reset'):
+        return max(1.0, float(headers['x-ratelimit-reset']) - time.time())
+    return DEFAULT_RATE_LIMIT_WAIT
+
+
+def search_hits(github_client: Github, query: SearchQuery,
+                throttle: SearchThrottle) -> Iterator[ContentFile.ContentFile]:
+    """Pages through the results of a query, waiting out the search rate limit."""
+    results = github_client.search_code(query.query)
+    page = 0
+    while page * SEARCH_PAGE_SIZE < MAX_SEARCH_RESULTS:
+        throttle.wait()
+        try:
+            with tracing.span('search', query=query.query, page=page):
+                items = results.get_page(page)
+        except RateLimitExceededException as e:
+            wait = _rate_limit_wait(e)
+            logger.warning("Search rate limit reached, waiting %.0fs", wait)
+            metrics.inc('search_requests_total', outcome='rate_limited')
+            time.sleep(wait)
+            continue
+        metrics.inc('search_requests_total', outcome='ok')
+        if page == 0:
+            logger.info("Search '%s': %s hits", query.query, results.totalCount)
+            if results.totalCount > MAX_SEARCH_RESULTS:
+                logger.warning("Search '%s' has %s hits; only the first %s are served, narrow it with --repo",
+                               query.query, results.totalCount, MAX_SEARCH_RESULTS)
+            if results.incomplete_results:
+                logger.warning("Search '%s' timed out with incomplete results", query.query)
+        yield from items
+        page += 1
+        if len(items) < SEARCH_PAGE_SIZE or page * SEARCH_PAGE_SIZE >= results.totalCount:
+            break
+
+
+def discover_files(github_client: Github, assets: List[Dict[str, Any]], user_or_org: str,
+                   repository: Optional[str] = None, discovery: Optional[Dict[str, Any]] = None
+                   ) -> Tuple[List[Repository.Repository], Dict[str, List[ContentFile.ContentFile]]]:
+    """
+    Locates the candidate files of the content-matched assets with code search.
+
+    Hits are checked against their asset's file_match and the prune rules,
+    then crawled like listed files: process_repos applies the repositories'
+    .crawlerignore files, and content matching and parsing confirm them.
+
+    Args:
+        github_client: An authenticated Github client instance.
+        assets: The assets of config.yaml.
+        user_or_org: The organization to search.
+        repository: Restrict the search to this repository of the organization.
+        discovery: The discovery section of config.yaml.
+
+    Returns:
+        The repositories with hits, and the hit files by repository full name
+    """
+    discovery = discovery or {}
+    throttle = SearchThrottle(discovery.get('searches_per_minute', DEFAULT_SEARCHES_PER_MINUTE))
+    queries = build_queries(assets, search_scope(user_or_org, repository))
+    logger.info("Discovering candidate files with %s code search queries", len(queries))
+
+    repos: Dict[str, Repository.Repository] = {}
+    files: Dict[str, Dict[str, ContentFile.ContentFile]] = {}
+    pruners: Dict[str, PathPruner] = {}
+    per_page = github_client.per_page
+    github_client.per_page = SEARCH_PAGE_SIZE
+    try:
+        for query in queries:
+            try:
+                for hit in search_hits(github_client, query, throttle):
+                    if not fnmatch.fnmatch(hit.name, posixpath.basename(query.file_match)):
+                        continue
+                    full_name = hit.repository.full_name
+                    pruner = pruners.setdefault(full_name, repo_pruner())
+                    if hit.path in files.get(full_name, {}) or pruner.skip_path(hit.path):
+                        continue
+                    repos.setdefault(full_name, hit.repository)
+                    files.setdefault(full_name, {})[hit.path] = hit
+                    metrics.inc('search_hits_total', asset_type=query.asset_type)
+            except GithubException as e:
+                logger.error("Search '%s' failed: %s", query.query, e)
+                metrics.inc('errors_total', stage='search')
+    finally:
+        github_client.per_page = per_page
+
+    logger.info("Discovered %s candidate files in %s repositories",
+                sum(len(paths) for paths in files.values()), len(repos))
+    return list(repos.values()), {full_name: list(paths.values()) for full_name, paths in files.items()}
@@ -0,0 +1,174 @@
+"""Module fetching file contents, large files through the git blobs API, under byte budgets"""
+
+import base64
+import contextlib
+import threading
+from typing import Any, Dict, Optional
+
+from github import ContentFile, GithubException
+
+from lib import metrics, tracing
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# The contents API inlines files up to 1 MB; larger ones come back without content
+DEFAULT_LARGE_FILE_BYTES = 1_000_000
+
+# base64 characters decoded at a time; a multiple of 4
+DECODE_CHUNK_CHARS = 1 << 20
+
+_limits: Dict[str, Any] = {}
+_local = threading.local()
+
+
+class FetchBudgetExceeded(Exception):
+    """Raised when a blob turns out larger than the byte budget it was fetched under."""
+
+
+class ByteBudget:
+    """Content bytes fetched for one repository, shared by the threads fetching its files."""
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> bool:
+        """Count size bytes about to be fetched, if they stay within the budget."""
+        with self._lock:
+            if self.limit and self.spent + size > self.limit:
+                return False
+            self.spent += size
+            return True
+
+    def charge(self, size: int):
+        """Count size fetched bytes, or give back bytes reserved for a failed fetch if negative."""
+        with self._lock:
+            self.spent += size
+
+
+def init_fetch_limits(fetch_limits: Optional[Dict[str, Any]]):
+    """
+    Configure the content byte budgets of the current process.
+
+    Args:
+        fetch_limits: The fetch_limits section of config.yaml. None or empty
+            fetches large files through the blobs API without any budget.
+    """
+    global _limits  # pylint: disable=global-statement
+    _limits = fetch_limits or {}
+
+
+def repo_budget() -> ByteBudget:
+    """A budget of max_repo_bytes for the content fetched from one repository."""
+    return ByteBudget(_limits.get('max_repo_bytes'))
+
+
+@contextlib.contextmanager
+def charging(budget: ByteBudget):
+    """Count the content fetched by the calling thread's with block against a repository's budget."""
+    _local.budget = budget
+    try:
+        yield
+    finally:
+        _local.budget = None
+        # do not hold on to a large content past the batch
+        _local.last = None
+
+
+def decode_base64(content: str, limit: Optional[int] = None) -> bytes:
+    """
+    Decode base64 content in chunks, skipping the line breaks GitHub inserts.
+
+    Decoding in chunks spares a full copy of the content without its line
+    breaks; the content itself is already in memory.
+
+    Raises:
+        FetchBudgetExceeded: As soon as the decoded bytes exceed limit.
+    """
+    decoded = bytearray()
+    pending = ''
+    for start in range(0, len(content), DECODE_CHUNK_CHARS):
+        pending += content[start:start + DECODE_CHUNK_CHARS].replace('\n', '')
+        usable = len(pending) - len(pending) % 4
+        decoded += base64.b64decode(pending[:usable])
+        pending = pending[usable:]
+        if limit and len(decoded) > limit:
+            raise FetchBudgetExceeded(f"more than {limit} bytes")
+    if pending:
+        decoded += base64.b64decode(pending)
+    return bytes(decoded)
+
+
+def fetch_blob(file_content: ContentFile.ContentFile, limit: Optional[int] = None) -> bytes:
+    """
+    Fetch a file's content from the git blobs API, which serves files up to 100 MB.
+
+    The blob comes base64 encoded in a JSON body that PyGithub reads and
+    decodes whole, so this does not stream: the fetch holds a few times the
+    blob's size at its peak. Memory stays bounded because fetch_content never
+    requests a file whose listed size exceeds max_file_bytes; limit only
+    catches a blob larger than its listing said.
+    """
+    with tracing.span('fetch_blob', file=file_content.html_url, size=file_content.size):
+        _, blob = file_content.requester.requestJsonAndCheck('GET', file_content.git_url)
+    if blob.get('encoding') != 'base64':
+        return (blob.get('content') or '').encode()
+    return decode_base64(blob.get('content') or '', limit)
+
+
+def fetch_content(file_content: ContentFile.ContentFile) -> Optional[bytes]:
+    """
+    The content of a file, fetched at most once per thread.
+
+    Files up to large_file_bytes come from the contents API. Larger ones come
+    from the git blobs API, unless they exceed max_file_bytes or the remaining
+    max_repo_bytes of the repository being crawled on this thread, see charging.
+    Objects that are not ContentFiles, e.g. ParseJobs, carry their content.
+
+    Returns:
+        The content, or None for a file over its budget
+    """
+    if not isinstance(file_content, ContentFile.ContentFile):
+        return file_content.decoded_content
+    # matching, then packing the parse job, read the same file back to back
+    last = getattr(_local, 'last', None)
+    if last is not None and last[0] is file_content:
+        return last[1]
+
+    size = file_content.size or 0
+    budget: Optional[ByteBudget] = getattr(_local, 'budget', None)
+    max_file_bytes = _limits.get('max_file_bytes')
+    if size <= _limits.get('large_file_bytes', DEFAULT_LARGE_FILE_BYTES):
+        content = file_content.decoded_content
+        if budget is not None:
+            budget.charge(len(content))
+    elif max_file_bytes and size > max_file_bytes:
+        logger.warning("Not fetching %s: %s bytes exceeds the %s byte file budget",
+                       file_content.path, size, max_file_bytes)
+        metrics.inc('large_files_total', outcome='over_file_budget')
+        content = None
+    elif budget is not None and not budget.reserve(size):
+        logger.warning("Not fetching %s: %s bytes exceeds the %s bytes left of the repository budget",
+                       file_content.path, size, budget.limit - budget.spent)
+        metrics.inc('large_files_total', outcome='over_repo_budget')
+        content = None
+    else:
+        try:
+            content = fetch_blob(file_content, max_file_bytes)
+            metrics.inc('large_files_total', outcome='fetched')
+        except FetchBudgetExceeded as e:
+            logger.warning("Dropping %s: its blob holds %s", file_content.path, e)
+            metrics.inc('large_files_total', outcome='over_file_budget')
+            content = None
+        except GithubException as e:
+            logger.error("Failed to fetch the blob of %s: %s", file_content.path, e)
+            metrics.inc('errors_total', stage='fetch_blob')
+            content = None
+        if budget is not None:
+            budget.charge((len(content) if content is not None else 0) - size)
+
+    _local.last = (file_content, content)
+    return content
+
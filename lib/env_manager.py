@@ -25,4 +25,32 @@ def load_env_var(var_name:str):
         logger.error(f'Environment variable {var_name} is required')
         raise ValueError(f'Environment variable {var_name} is required')
 
-    return var_value
\ No newline at end of file
+    return var_value
+
+
+def load_optional_env_var(var_name: str):
+    """
+    Load an optional environment variable.
+
+    Args:
+        var_name : Name of environment variable to load.
+
+    Returns:
+        Environment variable value, None if it is not set.
+    """
+    load_dotenv()
+    return os.getenv(var_name) or None
+
+
+def load_env_list(var_name: str) -> list:
+    """
+    Load an optional comma separated environment variable.
+
+    Args:
+        var_name : Name of environment variable to load.
+
+    Returns:
+        The non-empty items of its value, an empty list if it is not set.
+    """
+    load_dotenv()
+    return [item.strip() for item in os.getenv(var_name, '').split(',') if item.strip()]
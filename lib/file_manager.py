@@ -2,13 +2,17 @@
 
 import csv
 import fnmatch
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
 # import chardet
 import yaml
 from github import ContentFile, Repository
 
+from lib.cache_manager import get_cached_result, store_result
+from lib.content_fetcher import fetch_content
+from lib import metrics
 from lib.logger import setup_logger
+from lib.sandbox import budget_exceeded, get_parse_limits, run_parser
 from lib.parsers import (
     ansible_parser,
     boto3_parser,
@@ -33,6 +37,28 @@ from lib.parsers import (
 
 logger = setup_logger(__name__)
 
+# parser name -> (parse function, parser version). The version is part of the
+# parse result cache key, so bumping a parser's PARSER_VERSION invalidates it.
+PARSERS = {
+    'ansible': (ansible_parser.parse_ansible_file, ansible_parser.PARSER_VERSION),
+    'boto3': (boto3_parser.parse_boto3_file, boto3_parser.PARSER_VERSION),
+    'cloudformation': (cloudformation_parser.parse_cloudformation_file, cloudformation_parser.PARSER_VERSION),
+    'powershell': (pshell_parser.parse_powershell_file, pshell_parser.PARSER_VERSION),
+    'shell': (shell_parser.parse_shell_file, shell_parser.PARSER_VERSION),
+    'terraform': (terraform_parser.parse_terraform_file, terraform_parser.PARSER_VERSION),
+    'javascript': (js_parser.parse_js_file, js_parser.PARSER_VERSION),
+    'java': (java_parser.parse_java_file, java_parser.PARSER_VERSION),
+    'ruby': (ruby_parser.parse_ruby_file, ruby_parser.PARSER_VERSION),
+    'chef': (chef_parser.parse_chef_file, chef_parser.PARSER_VERSION),
+    'csharp': (csharp_parser.parse_csharp_file, csharp_parser.PARSER_VERSION),
+    'springcloud': (springcloud_parser.parse_springcloud_file, springcloud_parser.PARSER_VERSION),
+    'groovy': (groovy_parser.parse_groovy_file, groovy_parser.PARSER_VERSION),
+    'dotnet': (dotnet_parser.parse_dotnet_file, dotnet_parser.PARSER_VERSION),
+    'manifest': (manifest_parser.parse_manifest_file, manifest_parser.PARSER_VERSION),
+    'javaproperty': (javaproperty_parser.parse_java_property_file, javaproperty_parser.PARSER_VERSION),
+    'jupyter': (jupyter_parser.parse_notebook_file, jupyter_parser.PARSER_VERSION),
+}
+
 
 def load_config(config_path: str):
     """
@@ -62,6 +88,32 @@ def create_csv_writer(file_path: str):
         return writer
 
 
+class Finding(NamedTuple):
+    '''
+    A parsed file of a repository. Exposes path and html_url like a ContentFile,
+    so it can be handed to format_row_data in place of one.
+    '''
+    path: str
+    html_url: str
+    sha: str
+    asset_type: str
+    analysis: Any
+
+
+class ParseJob(NamedTuple):
+    '''
+    A matched file as shipped to a parse worker. Exposes the ContentFile
+    attributes process_and_analyze_file reads, so it can stand in for one.
+    '''
+    path: str
+    html_url: str
+    sha: str
+    size: int
+    decoded_content: Optional[bytes]
+    # (parser, asset_type) of every matching asset, in config order
+    candidates: List[Tuple[str, str]]
+
+
 def format_row_data(a_repo: Repository.Repository,
                     a_type: str,
                     content: ContentFile,
@@ -124,10 +176,13 @@ def match_content(file_content: ContentFile.ContentFile, file_match: str, conten
     logger.debug("Content match patterns: %s", content_match)
     try:
         if fnmatch.fnmatch(file_content.name, file_match):
-            content = file_content.decoded_content.decode('utf-8')
+            # large files come from the blobs API; None when over the fetch budget
+            raw_content = fetch_content(file_content)
+            if raw_content is None:
+                return False
+            content = raw_content.decode('utf-8')
             logger.debug("content: %s", content)
-            if content is not None:
-                return any(match in content for match in content_match)
+            return any(match in content for match in content_match)
         return False
     except (UnicodeDecodeError, AttributeError):
         # Handle cases where decoding fails or encoding is not available
@@ -138,6 +193,14 @@ def match_content(file_content: ContentFile.ContentFile, file_match: str, conten
         return False
 
 
+def match_nothing(file_content: ContentFile.ContentFile) -> bool:  # pylint: disable=unused-argument
+    """
+    Match function for assets with an unsupported matchType. Defined at module
+    level, unlike a lambda, so match functions can be pickled into Pool workers.
+    """
+    return False
+
+
 def create_match_function(asset: dict):
     """
     Creates a match function for a given asset.
@@ -164,7 +227,7 @@ def create_match_function(asset: dict):
         logger.debug("match_content content_match_fn: %s", content_match_fn)
         return content_match_fn
 
-    return {'match_function': lambda file_content: False, 'args': (), 'parser': None, 'asset_type': None}
+    return {'match_function': match_nothing, 'args': (), 'parser': None, 'asset_type': None}
 
 
 def prepare_match_functions(config: List[Dict[str, Any]]) -> List[Callable[[ContentFile.ContentFile], bool]]:
@@ -206,28 +269,7 @@ def process_and_analyze_file(parser: str,
     """
     logger.debug("parser: %s, match_type: %s", parser, asset_type)
 
-    # Use a dictionary for parsers
-    parsers = {
-        'ansible': ansible_parser.parse_ansible_file,
-        'boto3': boto3_parser.parse_boto3_file,
-        'cloudformation': cloudformation_parser.parse_cloudformation_file,
-        'powershell': pshell_parser.parse_powershell_file,
-        'shell': shell_parser.parse_shell_file,
-        'terraform': terraform_parser.parse_terraform_file,
-        'javascript': js_parser.parse_js_file,
-        'java': java_parser.parse_java_file,
-        'ruby': ruby_parser.parse_ruby_file,
-        'chef': chef_parser.parse_chef_file,
-        'csharp': csharp_parser.parse_csharp_file,
-        'springcloud': springcloud_parser.parse_springcloud_file,
-        'groovy': groovy_parser.parse_groovy_file,
-        'dotnet': dotnet_parser.parse_dotnet_file,
-        'manifest': manifest_parser.parse_manifest_file,
-        'javaproperty': javaproperty_parser.parse_java_property_file,
-        'jupyter': jupyter_parser.parse_notebook_file,
-    }
-
-    parse_function = parsers.get(parser)
+    parse_function, parser_version = PARSERS.get(parser, (None, None))
     logger.debug("parse_function: %s", parse_function)
     if not parse_function:
         logger.warning('Invalid parse function specified for asset type: %s', asset_type)
@@ -237,9 +279,46 @@ def process_and_analyze_file(parser: str,
         logger.error('Parser for asset type %s is not callable', asset_type)
         return None  # Or raise an exception
 
+    # files over the byte budget are recorded without fetching their content
+    timeout, max_bytes = get_parse_limits(parser)
+    size = getattr(file_content, 'size', None)
+    if max_bytes and size and size > max_bytes:
+        logger.warning("Skipping %s: %s bytes exceeds the %s byte budget of the %s parser",
+                       file_content.path, size, max_bytes, parser)
+        metrics.inc('parse_budget_exceeded_total', parser=parser, budget='bytes')
+        return budget_exceeded(f"{size} bytes exceeds the {max_bytes} byte limit")
+
+    # identical blobs are parsed once across repos, branches and runs
+    blob_sha = getattr(file_content, 'sha', None)
+    if blob_sha:
+        hit, analysis_result = get_cached_result(parser, parser_version, blob_sha)
+        metrics.inc('parse_cache_total', parser=parser, result='hit' if hit else 'miss')
+        if hit:
+            logger.debug("cached analysis_result: %s", analysis_result)
+            return analysis_result
+
     # logger.debug("raw_content: %s", file_content)
-    decoded_content = file_content.decoded_content.decode()
-    analysis_result = parse_function(decoded_content)
+    raw_content = fetch_content(file_content)
+    if raw_content is None:
+        logger.warning("Skipping %s: its %s bytes were not fetched, over the fetch budget", file_content.path, size)
+        metrics.inc('parse_budget_exceeded_total', parser=parser, budget='fetch')
+        return budget_exceeded(f"{size} bytes exceeds the fetch byte budget")
+    if max_bytes and len(raw_content) > max_bytes:
+        logger.warning("Skipping %s: %s bytes exceeds the %s byte budget of the %s parser",
+                       file_content.path, len(raw_content), max_bytes, parser)
+        metrics.inc('parse_budget_exceeded_total', parser=parser, budget='bytes')
+        return budget_exceeded(f"{len(raw_content)} bytes exceeds the {max_bytes} byte limit")
+    decoded_content = raw_content.decode()
+    with metrics.timer('parse_seconds', parser=parser):
+        completed, analysis_result = run_parser(parser, parse_function, decoded_content)
+    if not completed:
+        logger.warning("Parsing %s with the %s parser did not finish within %ss",
+                       file_content.path, parser, timeout)
+        metrics.inc('parse_budget_exceeded_total', parser=parser, budget='time')
+        return budget_exceeded(f"no result within {timeout}s")
     logger.debug("analysis_result: %s", analysis_result)
 
+    if blob_sha:
+        store_result(parser, parser_version, blob_sha, analysis_result)
+
     return analysis_result
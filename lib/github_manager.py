@@ -1,45 +1,91 @@
 '''
 GitHub Repository analysis
 '''
+import base64
+import binascii
 import collections
 import csv
-import inspect
-from multiprocessing import Pool
-from typing import Any, Dict, List, Optional, Union
+import fnmatch
+import io
+import posixpath
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 
 from github import (Branch, ContentFile, Github,
                    GithubException, Repository, Organization)
 
-from lib.file_manager import (format_row_data,
+from lib.cache_manager import init_cache, prune_stale_results
+from lib.content_fetcher import charging, fetch_content, init_fetch_limits, repo_budget
+from lib.file_manager import (PARSERS,
+                             Finding,
+                             ParseJob,
+                             format_row_data,
                              prepare_match_functions,
                              process_and_analyze_file)
+from lib import metrics, rollups, tracing
 from lib.logger import setup_logger
+from lib.path_filter import PathPruner, init_prune_rules, repo_pruner, skip_minified
+from lib.pipeline import DEFAULT_IO_WORKERS, Pipeline
+from lib.profiler import init_profiling, profile_current_thread
+from lib.results_store import ResultsStore, fingerprint
+from lib.sandbox import get_parse_limits, init_sandbox
+from lib.token_pool import create_token_pool
 
 # pylint: disable=line-too-long
 
 logger = setup_logger(__name__)
 
+# Files per work item handed to a worker
+DEFAULT_BATCH_SIZE = 100
 
-def init_github(github_token: str, github_endpoint: str) -> Github:
+# The compare API lists at most this many changed files
+COMPARE_MAX_FILES = 300
+
+
+def init_github(github_token: Union[str, Sequence[str]], github_endpoint: str, pool_size: Optional[int] = None,
+                seconds_between_requests: Optional[float] = None, app_id: Optional[str] = None,
+                app_private_key: Optional[str] = None, installation_ids: Sequence[int] = ()) -> Github:
    """
    Initialize Github instance with the provided token and endpoint.
 
+   The instance is shared by all I/O threads. Its keep-alive connection pool
+   should hold a connection per thread, otherwise connections beyond the pool
+   size are dropped after every request and each new one pays a TLS handshake.
+
+   Several tokens, or GitHub App installations, are pooled: every request
+   goes out with the token with the most rate limit left, see lib/token_pool.py.
+
    Args:
-       github_token: The user's Github personal access token.
+       github_token: The user's Github personal access token, or several.
        github_endpoint: The endpoint of the Github Enterprise instance.
        Please replace hostname in https://hostname/api/v3/ with your
        GitHub Enterprise instance hostname.
+       pool_size: Number of keep-alive connections, the number of I/O threads.
+       seconds_between_requests: Minimum delay between any two requests of the
+       instance, across all threads and tokens. None keeps PyGithub's default of 0.25s.
+       app_id: Id of a GitHub App whose installation tokens join the pool.
+       app_private_key: The App's private key, or the path of its PEM file.
+       installation_ids: The App installations to request tokens for.
 
    Returns:
        Github instance.
    """
-   return Github(base_url=github_endpoint, login_or_token=github_token)
+   throttle = {} if seconds_between_requests is None else {'seconds_between_requests': seconds_between_requests}
+   tokens = [github_token] if isinstance(github_token, str) else list(github_token)
+   if len(tokens) == 1 and not (app_id and installation_ids):
+       return Github(base_url=github_endpoint, login_or_token=tokens[0], pool_size=pool_size, **throttle)
+   auth = create_token_pool(tokens, app_id, app_private_key, installation_ids)
+   return Github(base_url=github_endpoint, auth=auth, pool_size=pool_size, **throttle)
 
 
 def extract_files_from_repo(repo: Repository.Repository) -> List[ContentFile.ContentFile]:
    """
    Extracts the list of files from the repository.
 
+   Directories and files pruned by the prune rules of config.yaml, or by the
+   .crawlerignore files found on the way, are left out; pruned directories
+   are never listed.
+
    Args:
        repo: The Github Repository object
 
@@ -49,31 +95,45 @@ def extract_files_from_repo(repo: Repository.Repository) -> List[ContentFile.Con
    Raises:
        GithubException: If there's an error accessing the Github API
    """
+   pruner = repo_pruner()
    matched_files = []
    try:
        queue = collections.deque([repo.get_contents("")])
 
        while queue:
            file_content: Union[List[ContentFile.ContentFile], ContentFile.ContentFile] = queue.popleft()
+           # multiple 'content' items are received for a directory
+           listing = file_content if isinstance(file_content, list) else [file_content]
+           # an ignore file applies to its siblings too, so it is read first
+           for file in listing:
+               if file.type == "file" and pruner.ignore_file and file.name == pruner.ignore_file:
+                   load_ignore_file(repo, file, pruner)
 
-           if isinstance(file_content, list):  # multiple 'content' items are received
-               for file in file_content:
-                   if file.type == "dir":
-                       queue.extend(repo.get_contents(file.path))
-
-                   logger.debug('Adding file to all_files list: %s', f"{repo.full_name}/{file.path}")
-                   matched_files.append(file)
-           else:  # single 'content' item
-               if file_content.type == "dir":
-                   queue.extend(repo.get_contents(file_content.path))
+           for file in listing:
+               if file.type == "dir":
+                   if pruner.skip_directory(file.path):
+                       continue
+                   queue.append(repo.get_contents(file.path))
+               elif pruner.skip_file(file.path, file.size):
+                   continue
 
-               logger.debug('Adding file to all_files list: %s', f"{repo.full_name}/{file_content.path}")
-               matched_files.append(file_content)
+               logger.debug('Adding file to all_files list: %s', f"{repo.full_name}/{file.path}")
+               matched_files.append(file)
    except GithubException as e:
        logger.error("Error extracting files from repository '%s': %s", repo.full_name, e)
    return matched_files
 
 
+def load_ignore_file(repo: Repository.Repository, file: ContentFile.ContentFile, pruner: PathPruner):
+   """ Adds the patterns of a .crawlerignore file found in a repository to its pruner. """
+   try:
+       text = file.decoded_content.decode('utf-8')
+   except (GithubException, AssertionError, UnicodeDecodeError) as e:
+       logger.warning("Failed to read '%s': %s", f"{repo.full_name}/{file.path}", e)
+       return
+   pruner.add_ignore_file(posixpath.dirname(file.path), text)
+
+
 def get_repo_metadata(a_repo: Repository.Repository) -> dict[str, Any]:
    """
    Extracts selected metadata from a repository for further analysis.
@@ -160,17 +220,18 @@ def retrieve_repos(github_client: Github, user_or_org: Optional[str] = None, rep
     repos = []
 
     try:
-        if user_or_org:
-            if "/" in user_or_org:  # Handle organization format (username/org)
-                org_name = user_or_org.split("/")[1]
-                org = github_client.get_organization(org_name)
-                repos.extend(get_org_repos(org, repository))
+        with tracing.span('enumerate_repos', owner=user_or_org or '*'):
+            if user_or_org:
+                if "/" in user_or_org:  # Handle organization format (username/org)
+                    org_name = user_or_org.split("/")[1]
+                    org = github_client.get_organization(org_name)
+                    repos.extend(get_org_repos(org, repository))
+                else:
+                    org = github_client.get_organization(user_or_org)
+                    repos.extend(get_org_repos(org, repository))
             else:
-                org = github_client.get_organization(user_or_org)
-                repos.extend(get_org_repos(org, repository))
-        else:
-            for org in github_client.get_organizations():
-                repos.extend(get_org_repos(org, repository))
+                for org in github_client.get_organizations():
+                    repos.extend(get_org_repos(org, repository))
 
     except GithubException as e:
         logger.error("Error retrieving repos: %s", e)
@@ -226,94 +287,748 @@ def get_org_repos(org: Organization.Organization, repository: Optional[str] = No
 #    return repos
 
 
-def analyze_repo(repo: Repository.Repository, match_functions: list[dict, Any], output_file):
-   """ Analyzes a single Github repository based on provided match functions.
+def get_files_by_path(repo: Repository.Repository, paths: List[str]) -> List[ContentFile.ContentFile]:
+   """
+   Fetches specific files of a repository instead of walking its whole tree.
+
+   Args:
+       repo: The Github Repository object
+       paths: The paths of the files to fetch
 
-   This function iterates through all files in the repository and applies
-   the provided match functions to each file. If a match is found, it
-   processes and analyzes the file.
+   Returns:
+       A list of Github File Content objects, one per path that could be fetched
    """
+   files = []
+   for path in paths:
+       try:
+           file_content = repo.get_contents(path)
+       except GithubException as e:
+           logger.error("Error fetching '%s': %s", f"{repo.full_name}/{path}", e)
+           continue
+       if isinstance(file_content, list):
+           files.extend(file_content)
+       else:
+           files.append(file_content)
+   return files
+
 
-   # logger.info("-----------------------------------------")
-   logger.info("Processing repo: %s", repo.full_name)
-   # logger.info("-----------------------------------------")
+def get_repo_metadata_or_empty(repo: Repository.Repository) -> dict[str, Any]:
+   """ get_repo_metadata, logging errors and falling back to empty metadata. """
+   try:
+       return get_repo_metadata(a_repo=repo)
+   except GithubException as e:
+       logger.error("Error getting GitHub metadata. Repository '%s'. Error: %s", repo.full_name, e)
+       return {}
 
-   logger.debug("match_function: %s", match_functions)
 
+def list_repo_files(repo: Repository.Repository) -> Optional[Tuple[dict[str, Any], List[ContentFile.ContentFile]]]:
+   """ Lists the files of a repository and retrieves its metadata.
+
+   Returns:
+       A (branch_metadata, files) tuple, or None if the repository is empty or inaccessible
+   """
+   logger.info("Listing repo: %s", repo.full_name)
    try:
        contents = repo.get_contents("")
        if not contents:
            logger.warning("Repository '%s' is empty. Skipping analysis.", repo.full_name)
-           return
+           metrics.inc('repos_total', stage='empty')
+           return None
    except GithubException as e:
        logger.error("Error accessing repository '%s': %s", repo.full_name, e)
-       return
+       metrics.inc('errors_total', stage='listing')
+       return None
 
-   # Extract metadata
-   branch_metadata: dict[str, Any]
-   try:
-       branch_metadata = get_repo_metadata(a_repo=repo)
-   except GithubException as e:
-       logger.error("Error getting GitHub metadata. Repository '%s'. Error: %s", repo.full_name, e)
-       branch_metadata = {}
+   with metrics.timer('stage_seconds', stage='metadata'), tracing.span('metadata', repo=repo.full_name):
+       branch_metadata = get_repo_metadata_or_empty(repo)
+   with metrics.timer('stage_seconds', stage='listing'), tracing.span('tree_listing', repo=repo.full_name):
+       files = extract_files_from_repo(repo)
+   metrics.inc('repos_total', stage='listed')
+   metrics.inc('files_total', len(files), stage='listed')
+   return branch_metadata, files
 
-   # Open CSV file (modify based on your CSV handling logic)
-   with open(output_file, 'a', newline='', encoding='utf-8') as csvfile:
-       writer = csv.writer(csvfile)
 
-       # Loop over fetched files and configurations
-       for file_content in extract_files_from_repo(repo):
+def match_candidates(file_content: ContentFile.ContentFile, match_functions: list[dict, Any]) -> List[Tuple[str, str]]:
+   """ Applies the match functions to a file.
+
+   Returns:
+       The (parser, asset_type) of every matching asset, in config order
+   """
+   candidates = []
+   for function in match_functions:
+       logger.debug("single match function: %s", function)
+
+       match_function: dict = function['match_function']
+       args = function.get('args', ())  # Get optional arguments
+       parser = function.get('parser', None)
+       asset_type = function.get('asset_type', None)
+
+       # if the file matches the file_type, process its contents for content matches
+       matched = match_function(file_content, *args)
+       logger.debug("Truthy - match_function(file_content, *args): %s", matched)
+       if matched:
+           # even though there was a match, without a defined parser, can't analyze
+           if parser is None:
+               logger.error("Error analyzing matched file '%s'. No '%s' parser defined.",
+                            file_content.path, asset_type)
+               continue
+           candidates.append((parser, asset_type))
+   if candidates:
+       metrics.inc('files_total', stage='matched')
+   return candidates
+
+
+def analyze_file(file_content: Union[ContentFile.ContentFile, ParseJob],
+                 candidates: List[Tuple[str, str]]) -> Optional[Finding]:
+   """ Parses a matched file with the parsers of its matching assets.
+
+   Returns:
+       A finding for the first parser that produced an analysis result, or None
+   """
+   for parser, asset_type in candidates:
+       try:
+           analysis_result = process_and_analyze_file(
+               parser, asset_type, file_content)
+           if analysis_result is not None and analysis_result:
+               logger.info("Got Analysis Result for '%s' (%s): %s",
+                           file_content.path, asset_type, analysis_result)
+               # since the file was matched and parsed, skip any remaining candidates
+               metrics.inc('files_total', stage='found')
+               return Finding(file_content.path, file_content.html_url,
+                              file_content.sha, asset_type, analysis_result)
+
+       except Exception as e:  # pylint: disable=broad-exception-caught
+           logger.error("Failed to process file %s: %s", file_content.path, e)
+           metrics.inc('parse_errors_total', parser=parser)
+           continue
+   return None
+
+
+def analyze_parse_job(job: ParseJob) -> Tuple[Optional[Finding], metrics.MetricsSnapshot,
+                                               List[tracing.TraceEvent]]:
+   """ Parse stage entry point: analyze_file for a job shipped to a parse worker.
+
+   Returns:
+       The finding, and the metrics and trace events the worker recorded for the job
+   """
+   with tracing.span('parse', file=job.html_url, parsers=[parser for parser, _ in job.candidates]):
+       finding = analyze_file(job, job.candidates)
+   return finding, metrics.drain(), tracing.drain()
+
+
+def create_parse_job(file_content: ContentFile.ContentFile, candidates: List[Tuple[str, str]]) -> Optional[ParseJob]:
+   """ Fetches a matched file's content and packs it for a parse worker.
+
+   Content over the byte budget of every candidate parser is not fetched,
+   nor content over the fetch budgets; the parse worker records the overrun
+   from the size alone.
+
+   Returns:
+       The job, or None for minified content, which is not worth parsing
+   """
+   size = getattr(file_content, 'size', None)
+   budgets = [get_parse_limits(parser)[1] for parser, _ in candidates]
+   over_budget = bool(size) and all(budget and size > budget for budget in budgets)
+   with tracing.span('fetch', file=file_content.html_url, size=size, skipped=over_budget):
+       decoded_content = None if over_budget else fetch_content(file_content)
+   if skip_minified(file_content.path, decoded_content):
+       return None
+   return ParseJob(file_content.path, file_content.html_url, file_content.sha, size,
+                   decoded_content, candidates)
+
+
+def analyze_files(repo: Repository.Repository, files: List[ContentFile.ContentFile],
+                  match_functions: list[dict, Any]) -> List[Finding]:
+   """ Applies the match functions to files of a repository and parses the matches.
+
+   Returns:
+       One finding per file that was matched and produced an analysis result
+   """
+   findings: List[Finding] = []
+
+   # Loop over fetched files and configurations
+   with charging(repo_budget()):
+       for file_content in files:
            # logger.info("-----------------------------------------")
            logger.info("Analyzing file --> %s", f"{repo.full_name}/{file_content.path}")
            # logger.info("-----------------------------------------")
-           for function in match_functions:
-               logger.debug("single match function: %s", function)
-
-               match_function: dict = function['match_function']
-               args = function.get('args', ())  # Get optional arguments
-               parser = function.get('parser', None)
-               asset_type = function.get('asset_type', None)
-
-               logger.debug("inspect match_function: %s", inspect.getsource(function['match_function']))
-               logger.debug("Truthy - match_function(file_content, *args): %s", match_function(file_content, *args))
-
-               # if the file matches the file_type, process its contents for content matches
-               if match_function(file_content, *args):
-                   # even though there was a match, without a defined parser, can't analyze
-                   if parser is None:
-                       logger.error("Error analyzing matched file '%s'. No '%s' parser defined.",
-                                    f"{repo.full_name}/{file_content.path}", asset_type)
-                       continue
+           candidates = match_candidates(file_content, match_functions)
+           if candidates and skip_minified(file_content.path, fetch_content(file_content)):
+               continue
+           finding = analyze_file(file_content, candidates) if candidates else None
+           if finding is not None:
+               findings.append(finding)
 
-                   try:
-                       analysis_result = process_and_analyze_file(
-                           parser, asset_type, file_content)
-                       if analysis_result is not None and analysis_result:
-                           logger.info("Got Analysis Result for '%s' (%s): %s",
-                                       f"{repo.full_name}/{file_content.path}", asset_type, analysis_result)
-                           row_data = format_row_data(
-                               repo, asset_type, file_content, branch_metadata, analysis_result)
-                           writer.writerow(row_data)
-
-                           # since the file was matched and parsed, stop looping through
-                           # any remaining potential match functions
-                           break
-
-                   except Exception as e:  # pylint: disable=broad-exception-caught
-                       logger.error("Failed to process file %s: %s", file_content.path, e)
-                       continue
+   return findings
+
+
+def format_findings(repo: Repository.Repository, findings: List[Finding], branch_metadata: dict[str, Any]) -> str:
+   """ Renders the rows of a repository's findings as CSV text. """
+   rows = io.StringIO(newline='')
+   writer = csv.writer(rows)
+   for finding in findings:
+       writer.writerow(format_row_data(repo, finding.asset_type, finding, branch_metadata, finding.analysis))
+   return rows.getvalue()
+
+
+def write_findings(output_file, repo: Repository.Repository, findings: List[Finding], branch_metadata: dict[str, Any]):
+   """ Appends the rows of a repository's findings to the output CSV file. """
+   # Open CSV file (modify based on your CSV handling logic)
+   with open(output_file, 'a', newline='', encoding='utf-8') as csvfile, \
+           tracing.span('write', repo=repo.full_name, findings=len(findings)):
+       csvfile.write(format_findings(repo, findings, branch_metadata))
+   metrics.inc('repos_total', stage='written')
+   metrics.inc('findings_total', len(findings))
+
+
+def get_tree_sha(repo: Repository.Repository) -> Optional[str]:
+   """ Returns the SHA of the root tree of the repository's default branch. """
+   try:
+       with tracing.span('metadata', repo=repo.full_name, call='branch'):
+           return repo.get_branch(repo.default_branch).commit.commit.tree.sha
+   except (GithubException, AttributeError) as e:
+       logger.warning("Failed to retrieve the default branch tree of '%s': %s", repo.full_name, e)
+       return None
+
+
+def get_blob_shas(repo: Repository.Repository, tree_sha: str) -> Optional[Dict[str, str]]:
+   """
+   Lists every blob of a tree in a single recursive git trees call.
+
+   Returns:
+       A mapping of path -> blob SHA, or None if the listing failed or was truncated
+   """
+   try:
+       with tracing.span('tree_listing', repo=repo.full_name, call='git_tree'):
+           tree = repo.get_git_tree(tree_sha, recursive=True)
+   except GithubException as e:
+       logger.warning("Failed to list the tree of '%s': %s", repo.full_name, e)
+       return None
+   if tree.raw_data.get('truncated'):
+       logger.warning("Tree listing of '%s' was truncated.", repo.full_name)
+       return None
+   return {element.path: element.sha for element in tree.tree if element.type == 'blob'}
+
+
+def get_head_sha(repo: Repository.Repository) -> Optional[str]:
+   """ Returns the SHA of the head commit of the repository's default branch. """
+   try:
+       with tracing.span('metadata', repo=repo.full_name, call='branch'):
+           return repo.get_branch(repo.default_branch).commit.sha
+   except (GithubException, AttributeError) as e:
+       logger.warning("Failed to retrieve the default branch head of '%s': %s", repo.full_name, e)
+       return None
+
+
+def candidate_paths(paths: List[str], match_functions: list[dict, Any], pruner: Optional[PathPruner] = None) -> List[str]:
+   """ The paths that could match an asset, and that pruner, the configured prune rules by default, would not prune. """
+   file_matches = [function['args'][0] for function in match_functions if function.get('args') and function['args'][0]]
+   pruner = pruner or repo_pruner()
+   return [path for path in paths
+           if any(fnmatch.fnmatch(posixpath.basename(path), file_match) for file_match in file_matches)
+           and not pruner.skip_path(path)]
+
+
+def ignore_pruner(repo: Repository.Repository, ref: str, paths: List[str],
+                  blobs: Optional[Dict[str, str]] = None) -> Optional[PathPruner]:
+   """ A pruner with the prune rules and the .crawlerignore files that a walk of
+   ref would read on the way to paths: those of every directory holding them.
+
+   Args:
+       repo: The Github Repository object
+       ref: The commit or tree the paths are at.
+       paths: Paths of files at ref.
+       blobs: path -> blob SHA of the tree of ref, when already listed; listed
+       with one recursive git trees call otherwise.
+
+   Returns:
+       The pruner, or None when the ignore files could not be listed or read
+       and the paths cannot be pruned like in a walk
+   """
+   pruner = repo_pruner()
+   if not pruner.ignore_file or not paths:
+       return pruner
+   if blobs is None:
+       blobs = get_blob_shas(repo, ref)
+       if blobs is None:
+           return None
+   directories = {''}
+   for path in paths:
+       parts = path.split('/')[:-1]
+       directories.update('/'.join(parts[:depth]) for depth in range(1, len(parts) + 1))
+   for directory in sorted(directories):
+       ignore_path = posixpath.join(directory, pruner.ignore_file)
+       if ignore_path not in blobs:
+           continue
+       try:
+           with tracing.span('fetch', file=f"{repo.full_name}/{ignore_path}"):
+               blob = repo.get_git_blob(blobs[ignore_path])
+           text = base64.b64decode(blob.content).decode('utf-8')
+       except (GithubException, binascii.Error, UnicodeDecodeError) as e:
+           logger.warning("Failed to read '%s': %s", f"{repo.full_name}/{ignore_path}", e)
+           return None
+       pruner.add_ignore_file(directory, text)
+   return pruner
+
+
+def changed_candidates(repo: Repository.Repository, ref: str, paths: List[str],
+                       match_functions: list[dict, Any]) -> Optional[List[str]]:
+   """ candidate_paths of files changed at ref, pruned with the .crawlerignore
+   files of ref like a walk would prune them.
+
+   Returns:
+       The candidates, or None when the ignore files could not be read and
+       the repository has to be crawled in full
+   """
+   candidates = candidate_paths(paths, match_functions)
+   pruner = ignore_pruner(repo, ref, candidates)
+   if pruner is None:
+       return None
+   return candidate_paths(candidates, match_functions, pruner)
+
+
+def split_forks(repos: List[Repository.Repository]) -> Tuple[List[Repository.Repository],
+                                                              List[Tuple[Repository.Repository, Repository.Repository]]]:
+   """
+   Separates the forks whose parent is part of the same crawl.
+
+   Args:
+       repos: The repositories to analyze.
+
+   Returns:
+       The repositories to crawl normally, and (fork, parent) pairs whose
+       parent findings can be reused.
+   """
+   by_name = {repo.full_name: repo for repo in repos}
+   sources: List[Repository.Repository] = []
+   forks: List[Tuple[Repository.Repository, Repository.Repository]] = []
+   for repo in repos:
+       parent = None
+       # the listing already says whether a repo is a fork; only forks pay for the parent lookup
+       if repo.fork:
+           try:
+               parent = by_name.get(repo.parent.full_name)
+           except (GithubException, AttributeError) as e:
+               logger.warning("Failed to retrieve the parent of fork '%s': %s", repo.full_name, e)
+       if parent is not None and not parent.fork:
+           forks.append((repo, parent))
+       else:
+           sources.append(repo)
+   return sources, forks
+
+
+def plan_fork(fork: Repository.Repository, parent: Repository.Repository, parent_findings: List[Finding],
+              match_functions: list[dict, Any]) -> Optional[Tuple[List[Finding], List[str]]]:
+   """ Works out which findings of a fork's parent still hold for the fork.
+
+   A fork whose default branch tree is identical to its parent's keeps all of
+   the parent's findings. Otherwise findings are kept for unchanged blobs, and
+   the paths whose blobs differ from the parent's, and could match an asset,
+   are left to be analyzed.
+
+   Returns:
+       A (reused findings, diverged paths) tuple, or None when the trees could
+       not be compared and the fork has to be crawled in full
+   """
+   fork_tree_sha = get_tree_sha(fork)
+   parent_tree_sha = get_tree_sha(parent)
+   if fork_tree_sha is None or parent_tree_sha is None:
+       metrics.inc('forks_total', mode='full_crawl')
+       return None
+
+   if fork_tree_sha == parent_tree_sha:
+       reused = parent_findings
+       diverged: List[str] = []
+       metrics.inc('forks_total', mode='identical')
+   else:
+       fork_blobs = get_blob_shas(fork, fork_tree_sha)
+       parent_blobs = get_blob_shas(parent, parent_tree_sha)
+       if fork_blobs is None or parent_blobs is None:
+           metrics.inc('forks_total', mode='full_crawl')
+           return None
+       ignore_file = repo_pruner().ignore_file
+       if ignore_file and any(posixpath.basename(path) == ignore_file and fork_blobs.get(path) != parent_blobs.get(path)
+                              for path in set(fork_blobs) | set(parent_blobs)):
+           # the parent's findings were pruned by other ignore files
+           logger.info("Fork '%s': %s differs from its parent's, crawling in full", fork.full_name, ignore_file)
+           metrics.inc('forks_total', mode='full_crawl')
+           return None
+       changed = [path for path, sha in fork_blobs.items() if parent_blobs.get(path) != sha]
+       pruner = ignore_pruner(fork, fork_tree_sha, changed, fork_blobs)
+       if pruner is None:
+           metrics.inc('forks_total', mode='full_crawl')
+           return None
+       metrics.inc('forks_total', mode='diverged')
+
+       reused = [finding for finding in parent_findings if fork_blobs.get(finding.path) == finding.sha]
+       diverged = candidate_paths(changed, match_functions, pruner)
+
+   logger.info("Fork '%s': reusing %s findings, scanning %s diverged paths",
+               fork.full_name, len(reused), len(diverged))
+   metrics.inc('findings_reused_total', len(reused))
+
+   reused = [finding._replace(html_url=f"{fork.html_url}/blob/{fork.default_branch}/{finding.path}")
+             for finding in reused]
+   return reused, diverged
+
+
+def plan_delta(repo: Repository.Repository, base_sha: str, head_sha: str,
+               previous_findings: List[Finding], match_functions: list[dict, Any]
+               ) -> Optional[Tuple[List[Finding], List[str]]]:
+   """ Works out which findings recorded at base_sha still hold at head_sha.
+
+   The compare API lists the files changed in between: findings of removed,
+   renamed and modified files are dropped, the other findings are carried
+   over, and the added or modified paths that could match an asset are left
+   to be analyzed.
+
+   Returns:
+       A (carried over findings, changed paths) tuple, or None when the commits
+       cannot be compared file by file and the repository has to be crawled in full
+   """
+   if base_sha == head_sha:
+       metrics.inc('delta_total', mode='unchanged')
+       metrics.inc('findings_reused_total', len(previous_findings))
+       return previous_findings, []
+
+   try:
+       with tracing.span('compare', repo=repo.full_name):
+           comparison = repo.compare(base_sha, head_sha)
+           files = comparison.files
+   except GithubException as e:
+       # e.g. the recorded head was force-pushed away
+       logger.warning("Failed to compare '%s' %s...%s: %s", repo.full_name, base_sha, head_sha, e)
+       metrics.inc('delta_total', mode='full_crawl')
+       return None
+   if comparison.status != 'ahead':
+       # a diverged history lists the changes since the merge base, not since base_sha
+       logger.info("Repo '%s': head is %s of the recorded one, crawling in full", repo.full_name, comparison.status)
+       metrics.inc('delta_total', mode='full_crawl')
+       return None
+   if len(files) >= COMPARE_MAX_FILES:
+       logger.info("Repo '%s': %s or more changed files, crawling in full", repo.full_name, COMPARE_MAX_FILES)
+       metrics.inc('delta_total', mode='full_crawl')
+       return None
+
+   touched = set()
+   changed = []
+   for file in files:
+       touched.add(file.filename)
+       if file.previous_filename:
+           touched.add(file.previous_filename)
+       if file.status != 'removed':
+           changed.append(file.filename)
+   ignore_file = repo_pruner().ignore_file
+   if ignore_file and any(posixpath.basename(path) == ignore_file for path in touched):
+       logger.info("Repo '%s': %s changed, crawling in full", repo.full_name, ignore_file)
+       metrics.inc('delta_total', mode='full_crawl')
+       return None
+
+   changed = changed_candidates(repo, head_sha, changed, match_functions)
+   if changed is None:
+       metrics.inc('delta_total', mode='full_crawl')
+       return None
+   reused = [finding for finding in previous_findings if finding.path not in touched]
+   logger.info("Repo '%s': %s changed files since %s, carrying over %s findings, scanning %s paths",
+               repo.full_name, len(files), base_sha[:7], len(reused), len(changed))
+   metrics.inc('delta_total', mode='delta')
+   metrics.inc('findings_reused_total', len(reused))
+   return reused, changed
+
+
+def results_fingerprint(config: List[Dict[str, Any]], prune: Optional[Dict[str, Any]]) -> str:
+   """ Fingerprint of the findings recorded in a results store: findings recorded
+   with other assets, prune rules or parser versions are not carried over. """
+   return fingerprint(config, prune, {parser: version for parser, (_, version) in PARSERS.items()})
+
+
+def init_worker(cache_path: Optional[str], parse_limits: Optional[Dict[str, Any]],
+                profile_dir: Optional[str] = None, trace: bool = False):
+   """Initializes the per-process parse result cache, parse sandbox, profiler and tracer of a worker."""
+   init_cache(cache_path)
+   init_sandbox(parse_limits)
+   tracing.init_tracing(trace)
+   init_profiling(profile_dir)
+   profile_current_thread()
+
+
+def split_batches(files: List[ContentFile.ContentFile], batch_size: int) -> List[List[ContentFile.ContentFile]]:
+   """ Splits a repository's files into work items of at most batch_size files. """
+   batch_size = max(1, batch_size)
+   return [files[start:start + batch_size] for start in range(0, len(files), batch_size)]
+
+
+class RepoCrawl:
+   """ Progress of one repository through the pipeline. """
+
+   def __init__(self, repo: Repository.Repository, branch_metadata: dict[str, Any],
+                reused: List[Finding], file_count: int, head_sha: Optional[str] = None, listed: bool = True):
+       self.repo = repo
+       # False when the listing failed: there are no findings for forks to reuse
+       self.listed = listed
+       # the commit the findings hold for; None if they are not to be recorded
+       self.head_sha = head_sha
+       self.branch_metadata = branch_metadata
+       self.reused = reused
+       # one slot per listed file, so the output keeps listing order
+       self.results: List[Optional[Finding]] = [None] * file_count
+       self.remaining = file_count
+       # content bytes fetched by all of the repository's batches
+       self.fetch_budget = repo_budget()
+
+   def findings(self) -> List[Finding]:
+       """ The reused findings followed by the new ones in listing order. """
+       return self.reused + [finding for finding in self.results if finding is not None]
+
+
+class CrawlSettings(NamedTuple):
+   """ The settings of a crawl's stages, read from config.yaml by crawl_settings. """
+   # the asset configurations
+   assets: List[Dict[str, Any]]
+   # path of the persistent parse result cache
+   cache_path: Optional[str] = None
+   # per-parser time and byte budgets, see lib/sandbox.py
+   parse_limits: Optional[Dict[str, Any]] = None
+   # per-file and per-repository content byte budgets, see lib/content_fetcher.py
+   fetch_limits: Optional[Dict[str, Any]] = None
+   # directory, file and depth rules pruning the walk of every repository, see lib/path_filter.py
+   prune: Optional[Dict[str, Any]] = None
+   # files per I/O work item
+   batch_size: int = DEFAULT_BATCH_SIZE
+   io_workers: int = DEFAULT_IO_WORKERS
+   # parse processes, the number of cores by default
+   cpu_workers: Optional[int] = None
+   # bound on the files waiting for a parse worker
+   max_pending_parses: Optional[int] = None
+   # profile every I/O thread and worker process into this directory, see lib/profiler.py
+   profile_dir: Optional[str] = None
+   # record spans in worker processes too, see lib/tracing.py
+   trace: bool = False
+
+
+def crawl_settings(config: Dict[str, Any], profile_dir: Optional[str] = None, trace: bool = False) -> CrawlSettings:
+   """ The crawl settings of a loaded config.yaml. """
+   crawler_config = config.get('crawler') or {}
+   return CrawlSettings(assets=config.get('assets'),
+                        cache_path=(config.get('cache') or {}).get('path'),
+                        parse_limits=config.get('parse_limits'),
+                        fetch_limits=config.get('fetch_limits'),
+                        prune=config.get('prune'),
+                        batch_size=crawler_config.get('batch_size', DEFAULT_BATCH_SIZE),
+                        io_workers=crawler_config.get('io_workers') or DEFAULT_IO_WORKERS,
+                        cpu_workers=crawler_config.get('cpu_workers'),
+                        max_pending_parses=crawler_config.get('max_pending_parses'),
+                        profile_dir=profile_dir,
+                        trace=trace)
+
+
+def process_repos(repos: List[Repository.Repository], settings: CrawlSettings, output_file,
+                  sink: Optional[Callable[[Repository.Repository, List[Finding], dict[str, Any]], None]] = None,
+                  files_by_repo: Optional[Dict[str, List[ContentFile.ContentFile]]] = None,
+                  results_store: Optional[ResultsStore] = None, delta: bool = False):
+   """Processes repositories in a staged pipeline.
+
+   Listing, matching and content fetches run on a pool of I/O threads, in
+   work items of batch_size files. Every matched file is shipped to a process
+   pool sized to the cores for parsing. At most max_pending_parses files wait
+   for a parse worker; beyond that the I/O threads block, so fetching never
+   runs far ahead of parsing and network and CPU work overlap.
+
+   A repository's rows are written and its findings rolled up, see
+   lib/rollups.py, once all of its files are done, then its forks are scheduled.
+
+   Args:
+       repos: The repositories to analyze.
+       settings: The assets, budgets, prune rules and pool sizes of the crawl.
+       output_file: The CSV file the results are appended to.
+       sink: Called with each repository's findings and metadata instead of
+       appending them to output_file, e.g. lib/work_queue.py's results table.
+       files_by_repo: Analyze only these files of each repository, by full
+       name, instead of listing it, e.g. code search hits, see lib/code_search.py.
+       They are pruned with the .crawlerignore files of the default branch.
+       results_store: Record the head commit and findings of every fully
+       listed repository, see lib/results_store.py.
+       delta: Scan only the files changed since the head recorded in
+       results_store and carry the other findings over, see plan_delta.
+   """
+
+   match_functions = prepare_match_functions(settings.assets)
+   batch_size = settings.batch_size
+
+   init_cache(settings.cache_path)
+   prune_stale_results({parser: version for parser, (_, version) in PARSERS.items()})
+   # the I/O stage reads the byte budgets to skip fetching oversized files
+   init_sandbox(settings.parse_limits)
+   init_fetch_limits(settings.fetch_limits)
+   init_prune_rules(settings.prune)
+
+   current = results_fingerprint(settings.assets, settings.prune)
+
+   sources, forks = split_forks(repos)
+   forks_by_parent: Dict[str, List[Repository.Repository]] = collections.defaultdict(list)
+   for fork, parent in forks:
+       forks_by_parent[parent.full_name].append(fork)
+
+   lock = threading.Lock()
+
+   with Pipeline(settings.io_workers, settings.cpu_workers, settings.max_pending_parses,
+                 initializer=init_worker,
+                 initargs=(settings.cache_path, settings.parse_limits, settings.profile_dir, settings.trace),
+                 io_initializer=profile_current_thread) as pipeline:
+
+       def finish_repo(crawl: RepoCrawl):
+           findings = crawl.findings()
+           rollups.record_findings(crawl.repo, findings)
+           if results_store is not None and crawl.head_sha:
+               results_store.save(crawl.repo.full_name, crawl.head_sha, current, crawl.branch_metadata, findings)
+           with lock:
+               if sink is not None:
+                   sink(crawl.repo, findings, crawl.branch_metadata)
+               else:
+                   write_findings(output_file, crawl.repo, findings, crawl.branch_metadata)
+           tracing.end('repo', crawl.repo.full_name)
+           # forks of crawled repos reuse their parent's findings instead of a full crawl
+           for fork in forks_by_parent.pop(crawl.repo.full_name, []):
+               tracing.begin('repo', fork.full_name, fork=True)
+               if not crawl.listed:
+                   logger.warning("Parent '%s' of fork '%s' could not be listed, crawling the fork in full",
+                                  crawl.repo.full_name, fork.full_name)
+                   metrics.inc('forks_total', mode='full_crawl')
+                   start_fork(fork, None)
+                   continue
+               pipeline.submit_io(plan_fork, fork, crawl.repo, findings, match_functions,
+                                  callback=lambda plan, fork=fork: start_fork(fork, plan))
+
+       def file_done(crawl: RepoCrawl, index: int, finding: Optional[Finding]):
+           metrics.inc('files_total', stage='done')
+           with lock:
+               crawl.results[index] = finding
+               crawl.remaining -= 1
+               finished = crawl.remaining == 0
+           if finished:
+               finish_repo(crawl)
+
+       def job_done(crawl: RepoCrawl, index: int, outcome):
+           if outcome is None:
+               # the parse worker died or raised; Pipeline logged it
+               metrics.inc('errors_total', stage='parse_worker')
+               file_done(crawl, index, None)
+               return
+           finding, worker_metrics, worker_events = outcome
+           metrics.merge(worker_metrics)
+           tracing.merge(worker_events)
+           file_done(crawl, index, finding)
+
+       def match_batch(crawl: RepoCrawl, batch: List[ContentFile.ContentFile], offset: int):
+           with charging(crawl.fetch_budget):
+               match_files(crawl, batch, offset)
+
+       def match_files(crawl: RepoCrawl, batch: List[ContentFile.ContentFile], offset: int):
+           for index, file_content in enumerate(batch, start=offset):
+               logger.info("Analyzing file --> %s", f"{crawl.repo.full_name}/{file_content.path}")
+               try:
+                   # content matching already downloads most of the files
+                   with metrics.timer('stage_seconds', stage='fetch_and_match'):
+                       # content matchers fetch the content lazily, inside this span
+                       with tracing.span('match', file=file_content.html_url):
+                           candidates = match_candidates(file_content, match_functions)
+                       job = create_parse_job(file_content, candidates) if candidates else None
+               except Exception as e:  # pylint: disable=broad-exception-caught
+                   logger.error("Failed to process file %s: %s", file_content.path, e)
+                   metrics.inc('errors_total', stage='match')
+                   job = None
+               if job is None:
+                   file_done(crawl, index, None)
+                   continue
+               try:
+                   pipeline.submit_cpu(analyze_parse_job, job,
+                                       callback=lambda outcome, index=index: job_done(crawl, index, outcome))
+               except Exception as e:  # pylint: disable=broad-exception-caught
+                   # e.g. BrokenProcessPool once a parse worker died; the rest of the batch cannot be parsed
+                   # either, and the repository is only written once every file is done
+                   logger.error("Failed to submit %s for parsing: %s", f"{crawl.repo.full_name}/{file_content.path}", e)
+                   unsubmitted = range(index, offset + len(batch))
+                   metrics.inc('errors_total', len(unsubmitted), stage='parse_submit')
+                   for unsubmitted_index in unsubmitted:
+                       file_done(crawl, unsubmitted_index, None)
+                   return
+
+       def start_crawl(repo: Repository.Repository, branch_metadata: dict[str, Any],
+                       files: List[ContentFile.ContentFile], reused: List[Finding], head_sha: Optional[str] = None,
+                       listed: bool = True):
+           crawl = RepoCrawl(repo, branch_metadata, reused, len(files), head_sha, listed)
+           metrics.inc('files_total', len(files), stage='queued')
+           if not files:
+               finish_repo(crawl)
+               return
+           for batch_index, batch in enumerate(split_batches(files, batch_size)):
+               pipeline.submit_io(match_batch, crawl, batch, batch_index * batch_size)
+
+       def start_repo(repo: Repository.Repository, listing):
+           if listing is None:
+               start_crawl(repo, {}, [], [], listed=False)
+               return
+           branch_metadata, files, reused, head_sha = listing
+           logger.info("Repo '%s': %s files", repo.full_name, len(files))
+           start_crawl(repo, branch_metadata, files, reused, head_sha)
+
+       def start_fork(fork: Repository.Repository, plan):
+           if plan is None:
+               # no usable tree information, crawl the fork like any other repository
+               pipeline.submit_io(list_repo, fork, callback=lambda listing: start_repo(fork, listing))
+               return
+           reused, diverged = plan
+           pipeline.submit_io(fetch_paths, fork, diverged, reused,
+                              callback=lambda fetched: start_repo(fork, fetched or ({}, [], reused, None)))
 
+       def fetch_paths(repo: Repository.Repository, paths: List[str], reused: List[Finding]):
+           head_sha = get_head_sha(repo) if results_store is not None else None
+           files = get_files_by_path(repo, paths)
+           if len(files) < len(paths):
+               # the findings of the missing paths would be lost until they change again
+               head_sha = None
+           return get_repo_metadata_or_empty(repo), files, reused, head_sha
 
-def process_repos(repos: List[Repository.Repository], config: Dict[str, Any], output_file):
-   """Processes repositories in parallel."""
+       def list_repo(repo: Repository.Repository):
+           # the head is read first: whatever is pushed while listing is rescanned next time
+           head_sha = get_head_sha(repo) if results_store is not None else None
+           base_sha = results_store.head(repo.full_name, current) if delta and head_sha else None
+           plan = None
+           if base_sha:
+               with tracing.span('delta', repo=repo.full_name):
+                   plan = plan_delta(repo, base_sha, head_sha, results_store.findings(repo.full_name), match_functions)
+           elif delta:
+               metrics.inc('delta_total', mode='new')
+           if plan is not None:
+               reused, changed = plan
+               return fetch_paths(repo, changed, reused)
+           listing = list_repo_files(repo)
+           if listing is None:
+               return None
+           branch_metadata, files = listing
+           return branch_metadata, files, [], head_sha
 
-   match_functions = prepare_match_functions(config)
-   # Use a context manager for Pool
-   with Pool() as pool:
-       pool.starmap(analyze_repo, [(repo, match_functions, output_file) for repo in repos])
+       def list_given_files(repo: Repository.Repository):
+           files = files_by_repo.get(repo.full_name, [])
+           with metrics.timer('stage_seconds', stage='metadata'), tracing.span('metadata', repo=repo.full_name):
+               branch_metadata = get_repo_metadata_or_empty(repo)
+               # code search indexes the default branch; prune the hits like a walk of it
+               pruner = ignore_pruner(repo, repo.default_branch, [file.path for file in files])
+           if pruner is None:
+               logger.warning("Repo '%s': keeping the search hits its .crawlerignore files may prune",
+                              repo.full_name)
+           else:
+               files = [file for file in files if not pruner.skip_path(file.path)]
+           metrics.inc('repos_total', stage='listed')
+           metrics.inc('files_total', len(files), stage='listed')
+           # hits alone are not a full listing and are never recorded
+           return branch_metadata, files, [], None
 
-       ## Uncomment the line below to test with a single repo (e.g. 'test-78') and comment the line above
+       for repo in sources:
+           tracing.begin('repo', repo.full_name)
+           pipeline.submit_io(list_repo if files_by_repo is None else list_given_files, repo,
+                              callback=lambda listing, repo=repo: start_repo(repo, listing))
 
-       #pool.starmap(analyze_repo, [(repo, match_functions, output_file) for repo in repos if repo.name == 'aws-chef'])
+       pipeline.wait()
 
    logger.info("Completed process_repos")
@@ -0,0 +1,271 @@
+"""Module collecting crawler metrics and exporting them as Prometheus text or JSON"""
+
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PREFIX = 'crawler_'
+
+# (metric name, sorted (label, value) pairs)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+# {'counters': {key: value}, 'gauges': {key: value}, 'histograms': {key: [bucket counts..., sum, count]}}
+MetricsSnapshot = Dict[str, Dict[MetricKey, Any]]
+
+# GitHub REST paths -> endpoint label, owner and repository names stripped
+API_ENDPOINTS = [
+    (re.compile(r'^/repos/[^/]+/[^/]+/contents(/.*)?$'), 'contents'),
+    (re.compile(r'^/repos/[^/]+/[^/]+/branches/.+$'), 'branch'),
+    (re.compile(r'^/repos/[^/]+/[^/]+/git/trees/.+$'), 'git_tree'),
+    (re.compile(r'^/repos/[^/]+/[^/]+/git/blobs/.+$'), 'git_blob'),
+    (re.compile(r'^/repos/[^/]+/[^/]+/compare/.+$'), 'compare'),
+    (re.compile(r'^/repos/[^/]+/[^/]+/(languages|labels|commits|forks)$'), None),
+    (re.compile(r'^/repos/[^/]+/[^/]+$'), 'repo'),
+    (re.compile(r'^/orgs/[^/]+/repos$'), 'org_repos'),
+    (re.compile(r'^/orgs/[^/]+$'), 'org'),
+    (re.compile(r'^/search/(\w+)$'), None),
+    (re.compile(r'^/rate_limit$'), 'rate_limit'),
+]
+
+_lock = threading.Lock()
+_counters: Dict[MetricKey, float] = {}
+_gauges: Dict[MetricKey, float] = {}
+_histograms: Dict[MetricKey, list] = {}
+
+
+def _key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Add amount to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a gauge to value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record one observation in a latency histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+    """Observe the duration of the with block in a latency histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def counter_total(name: str, **labels) -> float:
+    """The sum of a counter over every label set containing labels."""
+    wanted = set(_key(name, labels)[1])
+    with _lock:
+        return sum(value for (metric, metric_labels), value in _counters.items()
+                   if metric == name and wanted.issubset(metric_labels))
+
+
+def gauge_value(name: str, **labels) -> Optional[float]:
+    """The value of a gauge, None if it was never set."""
+    with _lock:
+        return _gauges.get(_key(name, labels))
+
+
+def snapshot() -> MetricsSnapshot:
+    """A copy of every metric of this process."""
+    with _lock:
+        return {'counters': dict(_counters), 'gauges': dict(_gauges),
+                'histograms': {key: list(values) for key, values in _histograms.items()}}
+
+
+def drain() -> MetricsSnapshot:
+    """
+    Take the metrics of this process and reset them.
+
+    Worker processes return the drained metrics with every task, so the
+    parent aggregates them with merge() without double counting.
+    """
+    with _lock:
+        drained = {'counters': dict(_counters), 'gauges': dict(_gauges), 'histograms': dict(_histograms)}
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+    return drained
+
+
+def merge(other: Optional[MetricsSnapshot]):
+    """Add the metrics drained from a worker to those of this process."""
+    if not other:
+        return
+    with _lock:
+        for key, value in other.get('counters', {}).items():
+            _counters[key] = _counters.get(key, 0) + value
+        _gauges.update(other.get('gauges', {}))
+        for key, values in other.get('histograms', {}).items():
+            histogram = _histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for index, value in enumerate(values):
+                histogram[index] += value
+
+
+def api_endpoint(path: str) -> str:
+    """The endpoint label of a GitHub REST API path."""
+    path = urlpath(path)
+    for pattern, endpoint in API_ENDPOINTS:
+        match = pattern.match(path)
+        if match:
+            return endpoint or match.group(1)
+    return 'other'
+
+
+def urlpath(url: str) -> str:
+    """The path of a request URL, without query string and Enterprise /api/v3 prefix."""
+    path = re.sub(r'^\w+://[^/]+', '', url).split('?', 1)[0]
+    return path[len('/api/v3'):] if path.startswith('/api/v3') else path
+
+
+class ApiCallHandler(logging.Handler):
+    """
+    Counts GitHub API calls, response bytes and the remaining rate limit and its reset time.
+
+    PyGithub logs every request it sends at DEBUG level on the
+    github.Requester logger, with the URL, status, response headers and body
+    as arguments; this handler reads them from the log record.
+    """
+
+    def emit(self, record: logging.LogRecord):
+        args = record.args
+        if not isinstance(args, tuple) or len(args) != 9:
+            return
+        _, _, _, url, _, _, status, headers, output = args
+        endpoint = api_endpoint(str(url))
+        inc('github_api_calls_total', endpoint=endpoint, status=status)
+        # streamed responses are logged as the string "stream"
+        if isinstance(output, (str, bytes)) and output != 'stream':
+            inc('github_api_bytes_total', len(output), endpoint=endpoint)
+        headers = headers or {}
+        # search and other resources have budgets of their own
+        resource = headers.get('x-ratelimit-resource', 'core')
+        prefix = 'github_rate_limit' if resource == 'core' else f'github_{resource}_rate_limit'
+        remaining = headers.get('x-ratelimit-remaining')
+        if remaining is not None:
+            set_gauge(f'{prefix}_remaining', float(remaining))
+        reset = headers.get('x-ratelimit-reset')
+        if reset is not None:
+            set_gauge(f'{prefix}_reset_timestamp_seconds', float(reset))
+
+
+def track_api_calls():
+    """Count the GitHub API calls of this process, see ApiCallHandler."""
+    requester_logger = logging.getLogger('github.Requester')
+    if any(isinstance(handler, ApiCallHandler) for handler in requester_logger.handlers):
+        return
+    requester_logger.addHandler(ApiCallHandler(logging.DEBUG))
+    requester_logger.setLevel(logging.DEBUG)
+    # the request dumps are for this handler only
+    requester_logger.propagate = False
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+
+def to_prometheus(metrics: MetricsSnapshot) -> str:
+    """Render metrics in the Prometheus text exposition format."""
+    lines = []
+    for kind, metric_type in (('counters', 'counter'), ('gauges', 'gauge')):
+        for name in sorted({key[0] for key in metrics[kind]}):
+            lines.append(f'# TYPE {PREFIX}{name} {metric_type}')
+            for (metric, labels), value in sorted(metrics[kind].items()):
+                if metric == name:
+                    lines.append(f'{PREFIX}{name}{_labels(labels)} {value}')
+    for name in sorted({key[0] for key in metrics['histograms']}):
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for (metric, labels), values in sorted(metrics['histograms'].items()):
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, values):
+                lines.append(f'{PREFIX}{name}_bucket{_labels(labels, (("le", str(bound)),))} {count}')
+            lines.append(f'{PREFIX}{name}_bucket{_labels(labels, (("le", "+Inf"),))} {values[-1]}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {values[-2]}')
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(metrics: MetricsSnapshot) -> str:
+    """Render metrics as a JSON summary, one entry per metric and label set."""
+    summary: Dict[str, list] = {'counters': [], 'gauges': [], 'histograms': []}
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in sorted(metrics[kind].items()):
+            summary[kind].append({'name': PREFIX + name, 'labels': dict(labels), 'value': value})
+    for (name, labels), values in sorted(metrics['histograms'].items()):
+        summary['histograms'].append({
+            'name': PREFIX + name, 'labels': dict(labels), 'count': values[-1], 'sum': round(values[-2], 6),
+            'buckets': {str(bound): count for bound, count in zip(LATENCY_BUCKETS, values)}})
+    return json.dumps(summary, indent=2) + '\n'
+
+
+def write_atomic(path: str, text: str):
+    """
+    Write text to path through a temporary file renamed over it, so readers
+    never see a partly written file. Creates the missing directories.
+
+    Raises:
+        OSError: If the file cannot be written; path is left as it was.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'w', encoding='utf-8') as stream:
+            stream.write(text)
+        os.replace(temporary, path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+
+
+def write_metrics(path: str):
+    """
+    Write the metrics of this process to path: JSON for a .json path,
+    Prometheus text otherwise. The file is replaced atomically, as the
+    node_exporter textfile collector expects.
+    """
+    metrics = snapshot()
+    content = to_json(metrics) if path.endswith('.json') else to_prometheus(metrics)
+    try:
+        write_atomic(path, content)
+        logger.info("Metrics written to '%s'", path)
+    except OSError as e:
+        logger.error("Failed writing metrics to '%s': %s", path, e)
@@ -5,15 +5,18 @@ import re
 from collections import defaultdict
 import yaml  # type: ignore
 from lib.logger import setup_logger
+from lib.parsers.shared import load_yaml
 
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 
 def parse_ansible_file(file_content):
     ''' parse the ansible file '''
     # Load the Ansible YAML playbook
     try:
-        parsed_yaml = yaml.safe_load(file_content)
+        parsed_yaml = load_yaml(file_content)
     except yaml.YAMLError as e:
         logger.error("Error parsing Ansible yaml file:%s", str(e))
         return {}
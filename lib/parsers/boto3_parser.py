@@ -6,6 +6,8 @@ from lib.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 # pylint: disable=invalid-name,line-too-long
 
 
@@ -2,16 +2,16 @@
 chef parser
 '''
 
-import re
 import os
 from lib.logger import setup_logger
+from lib.parsers.shared import find_method_calls
 
 logger = setup_logger(__name__)
-def parse_chef_file(file_content):
-    # Regex pattern to initially capture potential AWS SDK calls
-    pattern = re.compile(r'\b(\w+)\.(\w+)\(')
-    #pattern = re.compile(r'\b(?:aws_|AWS::)?\w+\.(?:\w+_)?\w+')
 
+PARSER_VERSION = 1
+
+
+def parse_chef_file(file_content):
     # List of known non-AWS calls to exclude from results
     non_aws_methods = {
         'Log.debug', 'Log.info', 'Timeout.timeout', 'URI.unescape', 'end.run_action', 'new_resource.snapshot_id'
@@ -22,8 +22,9 @@ def parse_chef_file(file_content):
 
     # Find all matches and filter non-AWS calls
     try:
-        for _match in re.finditer(pattern, file_content):
-            key = f"{_match.group(1)}.{_match.group(2)}"
+        # Potential AWS SDK calls, shared with the ruby parser
+        for receiver, method in find_method_calls(file_content):
+            key = f"{receiver}.{method}"
             if key not in non_aws_methods:
                 if key not in resources_used:
                     resources_used[key] = 0
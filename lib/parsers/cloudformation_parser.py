@@ -3,38 +3,93 @@ Cloudformation parser
 '''
 import json
 from collections import defaultdict
-from cfn_flip import to_json  # type: ignore
+from typing import List
+import yaml  # type: ignore
 from lib.logger import setup_logger
+from lib.parsers.shared import compose_yaml
 
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 # pylint: disable=invalid-name
 
 
+def _is_json(file_content: str) -> bool:
+    return file_content.lstrip()[:1] == '{'
+
+
+def _mapping_value(node, key: str):
+    ''' return the value node stored under a scalar key of a mapping node '''
+    if not isinstance(node, yaml.MappingNode):
+        return None
+    for key_node, value_node in node.value:
+        if isinstance(key_node, yaml.ScalarNode) and key_node.value == key:
+            return value_node
+    return None
+
+
+def load_resource_types_from_node(root) -> List[str]:
+    '''
+    Reads Resources[*].Type out of a composed YAML node graph without
+    constructing any of the other template sections.
+
+    Args:
+        root: The composed root node of the template
+
+    Returns:
+        list: The type of every declared resource
+    '''
+    resource_types = []
+    resources = _mapping_value(root, 'Resources')
+    if isinstance(resources, yaml.MappingNode):
+        for _, resource in resources.value:
+            type_node = _mapping_value(resource, 'Type')
+            if isinstance(type_node, yaml.ScalarNode):
+                resource_types.append(type_node.value)
+    return resource_types
+
+
+def load_resource_types(file_content: str) -> List[str]:
+    '''
+    Extracts the type of every resource declared in a template.
+
+    JSON templates are decoded directly. YAML templates are only composed,
+    so Parameters, Outputs and resource Properties never become Python objects.
+
+    Args:
+        file_content (str): The template to be parsed
+
+    Returns:
+        list: The type of every declared resource
+    '''
+    if _is_json(file_content):
+        try:
+            parsed_content = json.loads(file_content)
+        except ValueError:
+            parsed_content = None
+        if isinstance(parsed_content, dict):
+            resources = parsed_content.get('Resources') or {}
+            return [resource['Type'] for resource in resources.values()
+                    if isinstance(resource, dict) and 'Type' in resource]
+
+    return load_resource_types_from_node(compose_yaml(file_content))
+
+
 def parse_cloudformation_file(file_content: str):
     ''' parse cloudformation files '''
     logger.debug("type file_contents: %s", type(file_content))
     logger.debug("file_contents: %s", file_content)
     try:
-        # Convert CloudFormation YAML to JSON with cfn_flip
-        try:
-            json_content = to_json(file_content)
-        except Exception as e:   # pylint: disable=broad-exception-caught
-            json_content = file_content
-        # load JSON formatted CloudFormation files
-        parsed_content = json.loads(json_content)
+        resource_types = load_resource_types(file_content)
     except Exception as e:   # pylint: disable=broad-exception-caught
         logger.error("Error parsing CloudFormation file: %s", str(e))
         return {}
-        # raise Exception("Error parsing CloudFormation file: %s", str(e))
 
     # Initialize a dictionary to count the types of resources
     resource_counts = defaultdict(int)
-    # Traverse the parsed content for resource declarations
-    if 'Resources' in parsed_content:
-        for resource in parsed_content['Resources']:
-            resource_type = parsed_content['Resources'][resource]['Type']
-            resource_counts[resource_type] += 1
+    for resource_type in resource_types:
+        resource_counts[resource_type] += 1
 
     # Convert the defaultdict to a regular dict for return
     resource_counts = dict(resource_counts)
@@ -8,6 +8,8 @@ from lib.logger import setup_logger
 # Set up logging
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 # Regular expression patterns
 AWS_PATTERN = r'(?:aws|AWS|Amazon|com\.amazonaws)\S*'
 AWS_CLI_PATTERN = r'aws\s+(\w+\s+[\w-]+)'
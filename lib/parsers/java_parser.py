@@ -7,6 +7,8 @@ from lib.logger import setup_logger
 # Set up logging
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 # Regular expression patterns
 SERVICE_PATTERN = r'(\w+)\s+(\w+)\s*=\s*(\w+)\.(\w+)\(\);'
 FUNCTION_PATTERN = r'%s\.(\w+)\('
@@ -1,3 +1,6 @@
+PARSER_VERSION = 1
+
+
 def parse_java_property_file(content):
     keys = []
     for line in content.split('\n'):
@@ -6,6 +6,8 @@ from lib.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 SERVICE_PATTERN = r'(?:const|let|var)\s+(\w+)\s*=\s*new\s+AWS\.(\w+)\('
 FUNCTION_PATTERN = r'%s\.(\w+)\('
 
@@ -2,39 +2,100 @@
 Jupyter Notebook parser
 '''
 
-import nbformat
-from nbconvert import PythonExporter
-from nbconvert.preprocessors import Preprocessor
+import json
+import re
 
-from lib.parsers.boto3_parser import parse_boto3_file
+from lib.parsers.boto3_parser import PARSER_VERSION as BOTO3_PARSER_VERSION, parse_boto3_file
 
+# The result is produced by the boto3 parser, so its version is part of ours
+PARSER_VERSION = f'2.{BOTO3_PARSER_VERSION}'
 
-class HandleMagicCommands(Preprocessor):
-    def preprocess_cell(self, cell, resources, cell_index):
-        if cell.cell_type == 'code':
-            lines = cell.source.split('\n')
-            processed_lines = []
-            for line in lines:
-                if line.startswith('%'):
-                    processed_lines.append('# ' + line)
-                else:
-                    processed_lines.append(line)
-            cell.source = '\n'.join(processed_lines)
-        return cell, resources
+# IPython line magics (%) and shell escapes (!) are not valid Python
+MAGIC_PREFIXES = ('%', '!')
 
+# A cell magic (%%bash, %%writefile ...) makes the whole cell its input
+CELL_MAGIC_PREFIX = '%%'
 
-def parse_notebook_file(notebook_content):
-    nb = nbformat.reads(notebook_content, as_version=4)
+# files = !ls, elapsed = %timeit -o f(): the output of a magic is assigned
+ASSIGNED_MAGIC = re.compile(r'^(\s*[A-Za-z_][\w.]*(?:\s*,\s*[A-Za-z_][\w.]*)*\s*=\s*)([%!].*)$')
+
+
+def _notebook_cells(notebook: dict) -> list:
+    ''' return the cells of a v4 notebook or of the worksheets of a v3 notebook '''
+    if 'cells' in notebook:
+        return notebook['cells']
+    cells = []
+    for worksheet in notebook.get('worksheets', []):
+        cells.extend(worksheet.get('cells', []))
+    return cells
+
+
+def _cell_source(cell: dict) -> str:
+    ''' cell sources are stored either as one string or as a list of lines '''
+    source = cell.get('source', cell.get('input', ''))
+    if isinstance(source, list):
+        return ''.join(source)
+    return source
+
+
+def comment_magics(source: str) -> str:
+    '''
+    Turns the IPython syntax of a cell into valid Python of the same shape.
+
+    A cell magic comments out the whole cell, its body is not Python. A line
+    magic or shell escape becomes a pass statement at its own indentation,
+    so a block holding only magics stays a block, and an assigned one
+    assigns None; the magic itself is kept as a comment.
+    '''
+    if source.lstrip().startswith(CELL_MAGIC_PREFIX):
+        return '\n'.join('# ' + line for line in source.split('\n'))
 
-    exporter = PythonExporter()
-    exporter.register_preprocessor(HandleMagicCommands(), enabled=True)
+    processed_lines = []
+    continued = False
+    for line in source.split('\n'):
+        if continued:
+            # the backslash continuation of a magic
+            processed_lines.append('# ' + line)
+        elif line.lstrip().startswith(MAGIC_PREFIXES):
+            indent = line[:len(line) - len(line.lstrip())]
+            processed_lines.append(f'{indent}pass  # {line.lstrip()}')
+        elif (assigned := ASSIGNED_MAGIC.match(line)) is not None:
+            target, magic = assigned.groups()
+            processed_lines.append(f'{target}None  # {magic}')
+        else:
+            processed_lines.append(line)
+            continue
+        continued = line.endswith('\\')
+    return '\n'.join(processed_lines)
 
-    source, _ = exporter.from_notebook_node(nb)
-    return parse_boto3_file(source)
+
+def extract_code(notebook_content: str) -> str:
+    '''
+    Joins the code cells of a notebook into a single Python source.
+
+    Cell outputs are never looked at, so embedded images and other output
+    payloads cost nothing beyond the JSON decode.
+
+    Args:
+        notebook_content (str): The raw .ipynb JSON document
+
+    Returns:
+        str: The code cells, magics turned into pass statements, separated by blank lines
+    '''
+    notebook = json.loads(notebook_content)
+    code_cells = [comment_magics(_cell_source(cell))
+                  for cell in _notebook_cells(notebook)
+                  if cell.get('cell_type') == 'code']
+    return '\n\n'.join(code_cells)
+
+
+def parse_notebook_file(notebook_content):
+    ''' parse the code cells of a notebook with the boto3 parser '''
+    return parse_boto3_file(extract_code(notebook_content))
 
 
 if __name__ == '__main__':
-    notebook_path = 'resources\\02.08-Sorting.ipynb'
+    notebook_path = 'resources/magics.ipynb'
     with open(notebook_path) as f:
         nb = f.read()
     print(parse_notebook_file(nb))
@@ -1,5 +1,7 @@
 import yaml
 
+PARSER_VERSION = 1
+
 
 def parse_manifest_file(content):
     data = yaml.safe_load(content)
@@ -4,6 +4,8 @@ Powershell parser
 import boto3
 import re
 
+PARSER_VERSION = 1
+
 def get_aws_service_names():
     session = boto3.Session()
     available_services = session.get_available_services()
@@ -3,16 +3,19 @@ ruby parser
 '''
 
 import os
-import re
+from lib.parsers.shared import find_method_calls
+
+PARSER_VERSION = 1
+
+
 def parse_ruby_file(content):
-    # Pattern to find AWS SDK calls
-    pattern = re.compile(r"(\w+)\.(\w+)\(")
     service_mapping = {
         'get_bucket_location': 's3_client',  # Example mapping for S3-specific methods
     }
 
     try:
-        aws_calls = set(re.findall(pattern, content))
+        # AWS SDK calls, shared with the chef parser
+        aws_calls = set(find_method_calls(content))
         # Filter and format the results
         formatted_calls = set()
         for client, method in aws_calls:
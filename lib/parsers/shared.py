@@ -0,0 +1,121 @@
+'''
+Parse once helpers for detectors that target the same file format
+
+config.yaml routes *.yml/*.yaml files to both the CloudFormation and the
+Ansible detector, and *.rb files to both the Ruby and the Chef detector.
+The helpers below cache the expensive part of parsing (composing the YAML
+document, scanning for method calls) keyed by the file content, so every
+detector that looks at the same file reuses a single parse.
+
+When a helper's output changes, bump PARSER_VERSION of every parser using it
+so that cached parse results are invalidated.
+'''
+import re
+from functools import lru_cache
+from typing import Any, Tuple
+import yaml  # type: ignore
+
+# pylint: disable=invalid-name,too-many-ancestors
+
+# Only the last few files are kept; detectors for a file run back to back
+CACHE_SIZE = 4
+
+METHOD_CALL_PATTERN = re.compile(r'(\w+)\.(\w+)\(')
+
+# Use the libyaml backed loader when PyYAML was built with it
+_BaseLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class CfnYamlLoader(_BaseLoader):
+    ''' Safe YAML loader that understands the CloudFormation short form intrinsic tags '''
+
+
+def _construct_node_value(loader, node):
+    ''' construct the value of a tagged node regardless of its kind '''
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_mapping(node, deep=True)
+
+
+def _construct_intrinsic(loader, tag_suffix, node):
+    ''' !Sub, !Join, !If ... -> {"Fn::Sub": ...} '''
+    key = tag_suffix if tag_suffix in ('Ref', 'Condition') else f'Fn::{tag_suffix}'
+    value = _construct_node_value(loader, node)
+    # !GetAtt accepts the dotted scalar form "Resource.Attribute"
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.', 1)
+    return {key: value}
+
+
+CfnYamlLoader.add_multi_constructor('!', _construct_intrinsic)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compose_yaml(file_content: str):
+    ''' compose once and remember the outcome, failures included '''
+    try:
+        return yaml.compose(file_content, Loader=CfnYamlLoader), None
+    except yaml.YAMLError as e:
+        return None, e
+
+
+def compose_yaml(file_content: str):
+    '''
+    Composes a YAML document into a node graph, once per distinct content.
+
+    Args:
+        file_content (str): The YAML document
+
+    Returns:
+        The root node, or None for an empty document
+
+    Raises:
+        yaml.YAMLError: If the document is not valid YAML
+    '''
+    node, error = _compose_yaml(file_content)
+    if error is not None:
+        raise error
+    return node
+
+
+def load_yaml(file_content: str) -> Any:
+    '''
+    Constructs Python objects from the shared node graph of a YAML document.
+
+    Every call returns fresh objects, so callers are free to mutate them.
+
+    Args:
+        file_content (str): The YAML document
+
+    Returns:
+        The document as dicts and lists
+
+    Raises:
+        yaml.YAMLError: If the document is not valid YAML
+    '''
+    node = compose_yaml(file_content)
+    if node is None:
+        return None
+    return CfnYamlLoader('').construct_document(node)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def find_method_calls(file_content: str) -> Tuple[Tuple[str, str], ...]:
+    '''
+    Scans a source file for receiver.method( calls, once per distinct content.
+
+    Args:
+        file_content (str): The source file
+
+    Returns:
+        tuple: (receiver, method) pairs in the order they appear
+    '''
+    return tuple(METHOD_CALL_PATTERN.findall(file_content))
+
+
+def clear_caches():
+    ''' forget every cached parse, e.g. to time parsing the same content again '''
+    _compose_yaml.cache_clear()
+    find_method_calls.cache_clear()
@@ -3,6 +3,8 @@ Shell parser
 '''
 import re
 
+PARSER_VERSION = 1
+
 def parse_shell_file(file_content: str):
     resource_creations = []
 
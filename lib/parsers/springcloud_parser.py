@@ -8,6 +8,8 @@ from lib.logger import setup_logger
 # Set up logging
 logger = setup_logger(__name__)
 
+PARSER_VERSION = 1
+
 # Regular expression patterns
 AWS_SERVICE_PATTERN = r'(?:\bAmazonAWS|\bAmazon|\bAWS|\bcom\.amazonaws\.services)\.\w+\.\w+'
 AWS_FUNCTION_PATTERN = r'\.(?:run|create|delete|put|modify|register|update|describe|list|get|start|stop|terminate|enable|disable|invoke|send|publish|import|export|grant|revoke)\w*'
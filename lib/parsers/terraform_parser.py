@@ -6,6 +6,8 @@ from collections import defaultdict
 import hcl2
 import hcl  # type: ignore
 
+PARSER_VERSION = 1
+
 # pylint: disable=invalid-name
 
 def parse_with_hcl2(file_content: str):
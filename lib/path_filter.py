@@ -0,0 +1,174 @@
+"""Module pruning vendored, generated and minified paths from repository walks"""
+
+import fnmatch
+import posixpath
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib import metrics
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Bytes of a content sampled to tell minified code from hand-written code
+MINIFIED_SAMPLE_BYTES = 65536
+
+# Average line length above which sampled content counts as minified
+MINIFIED_LINE_LENGTH = 300
+
+_rules: Dict[str, Any] = {}
+
+
+def init_prune_rules(prune: Optional[Dict[str, Any]]):
+    """
+    Configure the prune rules of the current process.
+
+    Args:
+        prune: The prune section of config.yaml. None or empty walks every
+            directory and keeps every file.
+    """
+    global _rules  # pylint: disable=global-statement
+    _rules = prune or {}
+
+
+def _matches(path: str, patterns: List[str]) -> Optional[str]:
+    """The first pattern matching the path or its last component."""
+    name = posixpath.basename(path)
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+            return pattern
+    return None
+
+
+def _depth(path: str) -> int:
+    return path.count('/') + 1
+
+
+def parse_ignore_file(text: str) -> List[Tuple[str, bool, bool]]:
+    """
+    Reads the patterns of a .crawlerignore file, a subset of .gitignore:
+    blank lines and # comments are skipped, a trailing / only matches
+    directories, and a pattern containing a / is anchored to the directory
+    of the ignore file. Negations are not supported.
+
+    Returns:
+        (pattern, anchored, directories only) tuples
+    """
+    patterns = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('!'):
+            logger.warning("Negated ignore pattern '%s' is not supported, skipping it", line)
+            continue
+        directories_only = line.endswith('/')
+        line = line.rstrip('/')
+        if line.startswith('**/'):
+            line = line[3:]
+        anchored = '/' in line
+        patterns.append((line.lstrip('/'), anchored, directories_only))
+    return patterns
+
+
+class PathPruner:
+    """
+    The prune rules applied to one repository: directory and file globs,
+    a maximum depth, size ceilings of generated files, and the patterns of
+    the .crawlerignore files found on the way.
+    """
+
+    def __init__(self, rules: Dict[str, Any]):
+        self.directories: List[str] = rules.get('directories') or []
+        self.files: List[str] = rules.get('files') or []
+        self.max_depth: Optional[int] = rules.get('max_depth')
+        self.ignore_file: Optional[str] = rules.get('ignore_file')
+        # file glob -> size above which such a file is taken for generated
+        self.generated_bytes: Dict[str, int] = rules.get('generated_bytes') or {}
+        # (directory of the ignore file, pattern, anchored, directories only)
+        self.ignored: List[Tuple[str, str, bool, bool]] = []
+        # directory -> pruned, so directories met again through tree paths count once
+        self._directories: Dict[str, bool] = {}
+
+    def add_ignore_file(self, directory: str, text: str):
+        """Apply the patterns of an ignore file to the directory it was found in."""
+        for pattern, anchored, directories_only in parse_ignore_file(text):
+            self.ignored.append((directory, pattern, anchored, directories_only))
+
+    def _ignored(self, path: str, is_directory: bool) -> bool:
+        for directory, pattern, anchored, directories_only in self.ignored:
+            if directories_only and not is_directory:
+                continue
+            if directory:
+                if not path.startswith(directory + '/'):
+                    continue
+                relative = path[len(directory) + 1:]
+            else:
+                relative = path
+            if fnmatch.fnmatch(relative if anchored else posixpath.basename(relative), pattern):
+                return True
+        return False
+
+    def skip_directory(self, path: str) -> bool:
+        """Whether the walk should not descend into a directory."""
+        if path not in self._directories:
+            self._directories[path] = self._skip_directory(path)
+        return self._directories[path]
+
+    def _skip_directory(self, path: str) -> bool:
+        if _matches(path, self.directories):
+            rule = 'directories'
+        elif self.max_depth is not None and _depth(path) > self.max_depth:
+            rule = 'max_depth'
+        elif self._ignored(path, True):
+            rule = 'ignore_file'
+        else:
+            return False
+        logger.debug("Pruning directory %s (%s)", path, rule)
+        metrics.inc('pruned_total', kind='directory', rule=rule)
+        return True
+
+    def skip_file(self, path: str, size: Optional[int] = None) -> bool:
+        """Whether a file is vendored or generated, from its path and size alone."""
+        size_pattern = _matches(path, list(self.generated_bytes))
+        if _matches(path, self.files):
+            rule = 'files'
+        elif self._ignored(path, False):
+            rule = 'ignore_file'
+        elif size_pattern and size and size > self.generated_bytes[size_pattern]:
+            rule = 'generated_bytes'
+        else:
+            return False
+        logger.debug("Pruning file %s (%s)", path, rule)
+        metrics.inc('pruned_total', kind='file', rule=rule)
+        return True
+
+    def skip_path(self, path: str, size: Optional[int] = None, is_directory: bool = False) -> bool:
+        """
+        skip_directory or skip_file for a path of a recursive tree listing,
+        whose parent directories were not walked.
+        """
+        parts = path.split('/')
+        for depth in range(1, len(parts)):
+            if self.skip_directory('/'.join(parts[:depth])):
+                return True
+        return self.skip_directory(path) if is_directory else self.skip_file(path, size)
+
+
+def repo_pruner() -> PathPruner:
+    """A pruner with the configured rules, for one repository."""
+    return PathPruner(_rules)
+
+
+def skip_minified(path: str, content: Optional[bytes]) -> bool:
+    """
+    Whether fetched content is minified, judged from the average line length
+    of its start, for files matching the minified_check globs.
+    """
+    if not content or not _matches(path, _rules.get('minified_check') or []):
+        return False
+    sample = content[:MINIFIED_SAMPLE_BYTES]
+    if len(sample) / (sample.count(b'\n') + 1) <= MINIFIED_LINE_LENGTH:
+        return False
+    logger.info("Skipping %s: minified content", path)
+    metrics.inc('pruned_total', kind='file', rule='minified')
+    return True
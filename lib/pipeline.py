@@ -0,0 +1,126 @@
+"""Module providing a two stage I/O and CPU pipeline"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_IO_WORKERS = 16
+
+
+def _process_context():
+    """
+    Forking a process pool while I/O threads are running can deadlock the
+    children on locks held by those threads; use a fork server where available.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return None
+
+
+class Pipeline:
+    """
+    Runs I/O bound tasks on a thread pool and CPU bound tasks on a process pool.
+
+    The number of CPU tasks in flight is bounded: submit_cpu blocks the calling
+    I/O thread until the process pool catches up, so fetching never runs far
+    ahead of parsing. Every task may submit further tasks; wait() returns once
+    no task is left.
+    """
+
+    def __init__(self, io_workers: Optional[int] = None, cpu_workers: Optional[int] = None,
+                 max_pending_cpu: Optional[int] = None,
+                 initializer: Optional[Callable] = None, initargs: tuple = (),
+                 io_initializer: Optional[Callable] = None):
+        self.io_workers = io_workers or DEFAULT_IO_WORKERS
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self._io = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='io',
+                                      initializer=io_initializer)
+        self._cpu = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=_process_context(),
+                                        initializer=initializer, initargs=initargs)
+        self._cpu_slots = threading.BoundedSemaphore(max_pending_cpu or self.cpu_workers * 4)
+        self._outstanding = 0
+        self._idle = threading.Condition()
+
+    def _task_started(self):
+        with self._idle:
+            self._outstanding += 1
+
+    def _task_finished(self):
+        with self._idle:
+            self._outstanding -= 1
+            if self._outstanding == 0:
+                self._idle.notify_all()
+
+    def _run_callback(self, callback: Optional[Callable[[Any], None]], result: Any):
+        try:
+            if callback is not None:
+                callback(result)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Pipeline callback failed")
+        finally:
+            self._task_finished()
+
+    def submit_io(self, fn: Callable, *args, callback: Optional[Callable[[Any], None]] = None):
+        """
+        Run fn(*args) on the I/O thread pool, then callback(result).
+        result is None when fn raised.
+        """
+        self._task_started()
+
+        def run():
+            result = None
+            try:
+                result = fn(*args)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("I/O task %s failed", getattr(fn, '__name__', fn))
+            self._run_callback(callback, result)
+
+        self._io.submit(run)
+
+    def submit_cpu(self, fn: Callable, *args, callback: Optional[Callable[[Any], None]] = None):
+        """
+        Run fn(*args) on the process pool, then callback(result) on the pool's
+        result thread. result is None when fn raised. Blocks while the maximum
+        number of CPU tasks is in flight.
+        """
+        self._cpu_slots.acquire()  # pylint: disable=consider-using-with
+        self._task_started()
+
+        def done(future: Future):
+            self._cpu_slots.release()
+            result = None
+            try:
+                result = future.result()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("CPU task %s failed", getattr(fn, '__name__', fn))
+            self._run_callback(callback, result)
+
+        try:
+            self._cpu.submit(fn, *args).add_done_callback(done)
+        except Exception:  # pylint: disable=broad-exception-caught
+            self._cpu_slots.release()
+            self._task_finished()
+            raise
+
+    def wait(self):
+        """Block until every submitted task, and every task it submitted, is done."""
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait()
+
+    def shutdown(self):
+        """Stop both pools."""
+        self._io.shutdown(wait=True)
+        self._cpu.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,354 @@
+"""Module estimating the API cost and duration of a crawl before running it"""
+
+import fnmatch
+import math
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from github import Github, GithubException, Repository
+
+from lib.code_search import DEFAULT_SEARCHES_PER_MINUTE, MAX_SEARCH_RESULTS, SEARCH_PAGE_SIZE, build_queries
+from lib.content_fetcher import DEFAULT_LARGE_FILE_BYTES
+from lib.file_manager import prepare_match_functions
+from lib.github_manager import CrawlSettings, split_forks
+from lib.logger import setup_logger
+from lib.path_filter import repo_pruner
+from lib.token_pool import TokenPool
+
+logger = setup_logger(__name__)
+
+# PyGithub's default delay between two requests of a Github instance
+DEFAULT_SECONDS_BETWEEN_REQUESTS = 0.25
+
+# Approximate response sizes of the GitHub REST API, in bytes
+CONTENTS_ENTRY_BYTES = 700      # one entry of a contents API directory listing
+CONTENT_OVERHEAD_BYTES = 700    # a contents API file response without the content
+METADATA_BYTES = 6000           # languages, labels and branch of a repository
+BRANCH_BYTES = 4000
+TREE_ENTRY_BYTES = 150          # one entry of a recursive git trees listing
+
+# Calls a repository costs before its files: contents root in list_repo_files,
+# then languages, labels and branch in get_repo_metadata
+LISTING_CALLS = 1
+METADATA_CALLS = 3
+
+
+class RepoSurvey(NamedTuple):
+    """What a recursive git trees listing says about a repository's default branch."""
+    full_name: str
+    tree_sha: Optional[str]
+    directories: int
+    files: int
+    # path -> (blob sha, size) of the files whose name matches an asset's file_match
+    candidates: Dict[str, Tuple[str, int]]
+    truncated: bool
+    seconds: float
+
+
+class Cost(NamedTuple):
+    """API requests and response bytes."""
+    calls: int
+    bytes: int
+    # code search requests, under their own rate limit
+    searches: int = 0
+
+
+def total(costs: Iterable[Cost]) -> Cost:
+    """The sum of costs."""
+    costs = list(costs)
+    return Cost(sum(cost.calls for cost in costs), sum(cost.bytes for cost in costs),
+                sum(cost.searches for cost in costs))
+
+
+def file_patterns(match_functions: List[Dict[str, Any]]) -> List[str]:
+    """The file_match patterns of the prepared match functions."""
+    return [function['args'][0] for function in match_functions if function.get('args') and function['args'][0]]
+
+
+def survey_repo(repo: Repository.Repository, patterns: List[str]) -> RepoSurvey:
+    """
+    Lists the default branch of a repository with one recursive git trees call.
+
+    Empty and inaccessible repositories come back with no files. Paths the
+    prune rules of config.yaml leave out of the walk are not counted; the
+    .crawlerignore files of the repository are not read.
+    """
+    start = time.perf_counter()
+    try:
+        tree = repo.get_git_tree(repo.default_branch, recursive=True)
+        elements = tree.tree
+        tree_sha, truncated = tree.sha, bool(tree.raw_data.get('truncated'))
+    except GithubException as e:
+        logger.warning("Failed to list the tree of '%s': %s", repo.full_name, e)
+        elements, tree_sha, truncated = [], None, False
+
+    pruner = repo_pruner()
+    directories, files = 0, 0
+    candidates: Dict[str, Tuple[str, int]] = {}
+    for element in elements:
+        if pruner.skip_path(element.path, element.size, is_directory=element.type == 'tree'):
+            continue
+        if element.type == 'tree':
+            directories += 1
+        elif element.type == 'blob':
+            files += 1
+            name = posixpath.basename(element.path)
+            if any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                candidates[element.path] = (element.sha, element.size or 0)
+    return RepoSurvey(repo.full_name, tree_sha, directories, files, candidates, truncated,
+                      time.perf_counter() - start)
+
+
+def content_bytes(size: int) -> int:
+    """Response bytes of a contents API file: base64 content, one newline per 60 characters."""
+    encoded = 4 * math.ceil(size / 3)
+    return encoded + encoded // 60 + CONTENT_OVERHEAD_BYTES
+
+
+def fetch_cost(sizes: Iterable[int], fetch_limits: Optional[Dict[str, Any]]) -> Cost:
+    """
+    Content fetches of files of these sizes: one contents API call each, or
+    one git blobs API call above large_file_bytes, and none above max_file_bytes.
+    """
+    limits = fetch_limits or {}
+    large_file_bytes = limits.get('large_file_bytes', DEFAULT_LARGE_FILE_BYTES)
+    max_file_bytes = limits.get('max_file_bytes')
+    fetched = [size for size in sizes if size <= large_file_bytes or not max_file_bytes or size <= max_file_bytes]
+    return Cost(len(fetched), sum(content_bytes(size) for size in fetched))
+
+
+def contents_source_cost(survey: RepoSurvey, settings: CrawlSettings) -> Cost:
+    """
+    A repository crawled with the contents API: the walk lists every
+    directory, then every file an asset's file_match selects is fetched.
+    """
+    if survey.tree_sha is None:
+        # an empty repository stops at the contents root
+        return Cost(LISTING_CALLS, CONTENTS_ENTRY_BYTES)
+    entries = survey.files + survey.directories
+    fetches = fetch_cost((size for _, size in survey.candidates.values()), settings.fetch_limits)
+    return Cost(LISTING_CALLS + METADATA_CALLS + 1 + survey.directories + fetches.calls,
+                (LISTING_CALLS + 1) * CONTENTS_ENTRY_BYTES + METADATA_BYTES + entries * CONTENTS_ENTRY_BYTES
+                + fetches.bytes)
+
+
+def contents_fork_cost(fork: RepoSurvey, parent: RepoSurvey, settings: CrawlSettings) -> Cost:
+    """
+    A fork of a crawled repository: the branch of both is compared, then the
+    trees if they differ, and only the candidates whose blobs differ from the
+    parent's are fetched.
+    """
+    calls, size = 2, 2 * BRANCH_BYTES
+    diverged: List[int] = []
+    if fork.tree_sha != parent.tree_sha:
+        calls += 2
+        size += (fork.files + fork.directories + parent.files + parent.directories) * TREE_ENTRY_BYTES
+        diverged = [blob_size for path, (sha, blob_size) in fork.candidates.items()
+                    if parent.candidates.get(path, (None, 0))[0] != sha]
+    fetches = fetch_cost(diverged, settings.fetch_limits)
+    return Cost(calls + METADATA_CALLS + fetches.calls, size + METADATA_BYTES + fetches.bytes)
+
+
+def contents_cost(sources: List[RepoSurvey], forks: List[Tuple[RepoSurvey, RepoSurvey]],
+                  settings: CrawlSettings) -> Cost:
+    """The default crawl: every repository walked with the contents API, forks planned against their parent."""
+    return total([contents_source_cost(survey, settings) for survey in sources]
+                 + [contents_fork_cost(fork, parent, settings) for fork, parent in forks])
+
+
+def search_cost(sources: List[RepoSurvey], forks: List[Tuple[RepoSurvey, RepoSurvey]],
+                settings: CrawlSettings) -> Cost:
+    """
+    A crawl with --discover: code search pages through the hits of every
+    content_match, then only the repositories with hits are crawled, their
+    hits fetched. Search only serves files holding the searched term, so the
+    candidates of the searched assets bound the hits from above.
+    """
+    queries = build_queries(settings.assets or [], '')
+    surveys = sources + [fork for fork, _ in forks]
+
+    def hits(survey: RepoSurvey) -> Dict[str, int]:
+        return {path: size for path, (_, size) in survey.candidates.items()
+                if any(fnmatch.fnmatch(posixpath.basename(path), posixpath.basename(query.file_match))
+                       for query in queries)}
+
+    hits_by_repo = {survey.full_name: hits(survey) for survey in surveys}
+    searches = 0
+    for query in queries:
+        query_hits = sum(1 for survey in surveys for path in hits_by_repo[survey.full_name]
+                         if fnmatch.fnmatch(posixpath.basename(path), posixpath.basename(query.file_match)))
+        searches += max(1, math.ceil(min(query_hits, MAX_SEARCH_RESULTS) / SEARCH_PAGE_SIZE))
+
+    costs = [Cost(0, 0, searches)]
+    for survey in sources:
+        if hits_by_repo[survey.full_name]:
+            fetches = fetch_cost(hits_by_repo[survey.full_name].values(), settings.fetch_limits)
+            costs.append(Cost(METADATA_CALLS + fetches.calls, METADATA_BYTES + fetches.bytes))
+    for fork, parent in forks:
+        if not hits_by_repo[fork.full_name]:
+            continue
+        if hits_by_repo[parent.full_name]:
+            # planned against its parent like in a walk
+            costs.append(contents_fork_cost(fork, parent, settings))
+        else:
+            fetches = fetch_cost(hits_by_repo[fork.full_name].values(), settings.fetch_limits)
+            costs.append(Cost(METADATA_CALLS + fetches.calls, METADATA_BYTES + fetches.bytes))
+    return total(costs)
+
+
+# fetch strategy -> cost of crawling the surveyed repositories, and forks with their parent, with it
+STRATEGIES: Dict[str, Callable[[List[RepoSurvey], List[Tuple[RepoSurvey, RepoSurvey]], CrawlSettings], Cost]] = {
+    'contents': contents_cost,
+    'search': search_cost,
+}
+
+
+def get_rate_limit(github_client: Github) -> Optional[Dict[str, Any]]:
+    """
+    The core rate limit: limit, remaining and seconds until reset; None if
+    unavailable. For a token pool, the sum over its tokens and the first reset.
+    """
+    auth = github_client.requester.auth
+    if not isinstance(auth, TokenPool):
+        return _core_rate_limit(github_client)
+    rate_limits = []
+    for token in auth.tokens:
+        with auth.pin(token):
+            rate_limits.append(_core_rate_limit(github_client))
+    rate_limits = [rate_limit for rate_limit in rate_limits if rate_limit]
+    if not rate_limits:
+        return None
+    return {'limit': sum(rate_limit['limit'] for rate_limit in rate_limits),
+            'remaining': sum(rate_limit['remaining'] for rate_limit in rate_limits),
+            'reset_in_seconds': min(rate_limit['reset_in_seconds'] for rate_limit in rate_limits),
+            'tokens': len(rate_limits)}
+
+
+def _core_rate_limit(github_client: Github) -> Optional[Dict[str, Any]]:
+    try:
+        core = github_client.get_rate_limit().resources.core
+    except (GithubException, AttributeError) as e:
+        logger.warning("Failed to retrieve the rate limit: %s", e)
+        return None
+    reset_in = max(0.0, core.reset.timestamp() - time.time())
+    return {'limit': core.limit, 'remaining': core.remaining, 'reset_in_seconds': round(reset_in)}
+
+
+def schedule(calls: int, seconds: float, rate_limit: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fit a crawl of `calls` requests, taking `seconds` when never throttled,
+    into the rate limit of the configured tokens.
+
+    Returns:
+        Whether it fits the remaining budget, the hours it takes with the
+        configured tokens including waits for resets, and the tokens of the
+        same budget that avoid any wait
+    """
+    hours = seconds / 3600
+    if not rate_limit or not rate_limit['limit']:
+        return {'fits_remaining_budget': None, 'hours_with_current_tokens': round(hours, 2), 'tokens_needed': None}
+
+    limit, remaining = rate_limit['limit'], rate_limit['remaining']
+    current_tokens = rate_limit.get('tokens', 1)
+    fits = calls <= remaining
+    if not fits:
+        # the remaining budget, then a full budget at the reset and every hour after it
+        resets = math.ceil((calls - remaining) / limit)
+        last_calls = calls - remaining - (resets - 1) * limit
+        last_reset = rate_limit['reset_in_seconds'] / 3600 + resets - 1
+        hours = max(hours, last_reset + last_calls * seconds / calls / 3600)
+    # every token adds a full hourly budget
+    tokens = max(1, math.ceil(calls / (limit / current_tokens * max(1.0, seconds / 3600))))
+    return {'fits_remaining_budget': fits, 'hours_with_current_tokens': round(hours, 2), 'tokens_needed': tokens}
+
+
+def plan_crawl(github_client: Github, repos: List[Repository.Repository], settings: CrawlSettings,
+               seconds_between_requests: Optional[float] = None,
+               discovery: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Estimates the requests, bytes and time a crawl of repos would take under
+    each fetch strategy, and how it fits the rate limit.
+
+    Every repository is surveyed with one recursive git trees call, forks
+    included, so forks are costed with their actual divergence from the parent.
+    Wall-clock time is bound by the request throttle and by the latency of the
+    survey calls spread over the I/O threads; code search requests are
+    spaced by their own rate limit and run before the crawl.
+
+    Args:
+        github_client: The Github instance of the crawl.
+        repos: The repositories to crawl.
+        settings: The assets, fetch budgets and I/O threads of the crawl.
+        seconds_between_requests: The crawl's request throttle, None for PyGithub's default.
+        discovery: The discovery section of config.yaml, for the code search rate.
+
+    Returns:
+        The plan, JSON serializable
+    """
+    io_workers = settings.io_workers
+    throttle = DEFAULT_SECONDS_BETWEEN_REQUESTS if seconds_between_requests is None else seconds_between_requests
+    searches_per_minute = (discovery or {}).get('searches_per_minute', DEFAULT_SEARCHES_PER_MINUTE)
+    patterns = file_patterns(prepare_match_functions(settings.assets))
+
+    sources, forks = split_forks(repos)
+    with ThreadPoolExecutor(io_workers, thread_name_prefix='plan') as executor:
+        surveys = dict(zip([repo.full_name for repo in repos],
+                           executor.map(lambda repo: survey_repo(repo, patterns), repos)))
+
+    latency = sum(survey.seconds for survey in surveys.values()) / max(len(surveys), 1)
+    seconds_per_call = max(throttle, latency / io_workers)
+    rate_limit = get_rate_limit(github_client)
+    truncated = [name for name, survey in surveys.items() if survey.truncated]
+    if truncated:
+        logger.warning("Tree listings truncated, their estimates are low: %s", ', '.join(truncated))
+
+    strategies = {}
+    for name, strategy_cost in STRATEGIES.items():
+        cost = strategy_cost([surveys[repo.full_name] for repo in sources],
+                             [(surveys[fork.full_name], surveys[parent.full_name]) for fork, parent in forks],
+                             settings)
+        seconds = cost.calls * seconds_per_call
+        if cost.searches and searches_per_minute:
+            seconds += cost.searches * 60 / searches_per_minute
+        strategies[name] = {
+            'api_calls': cost.calls,
+            'search_requests': cost.searches,
+            'bytes': cost.bytes,
+            'seconds': round(seconds),
+            'hours': round(seconds / 3600, 2),
+            # search requests have their own rate limit
+            'schedule': schedule(cost.calls, seconds, rate_limit),
+        }
+
+    return {
+        'repos': len(repos),
+        'forks_reusing_parent': len(forks),
+        'files': sum(survey.files for survey in surveys.values()),
+        'candidate_files': sum(len(survey.candidates) for survey in surveys.values()),
+        'candidate_bytes': sum(size for survey in surveys.values() for _, size in survey.candidates.values()),
+        'truncated_trees': truncated,
+        'seconds_per_call': round(seconds_per_call, 4),
+        'rate_limit': rate_limit,
+        'strategies': strategies,
+    }
+
+
+def log_plan(plan: Dict[str, Any]):
+    """Logs a readable summary of a plan."""
+    logger.info("Plan: %s repos (%s forks reusing their parent), %s files, %s candidate files (%.1f MB)",
+                plan['repos'], plan['forks_reusing_parent'], plan['files'], plan['candidate_files'],
+                plan['candidate_bytes'] / 1e6)
+    if plan['rate_limit']:
+        logger.info("Rate limit: %s of %s left over %s tokens, resets in %s min", plan['rate_limit']['remaining'],
+                    plan['rate_limit']['limit'], plan['rate_limit'].get('tokens', 1),
+                    plan['rate_limit']['reset_in_seconds'] // 60)
+    for name, strategy in plan['strategies'].items():
+        fits = strategy['schedule']['fits_remaining_budget']
+        logger.info("Strategy '%s': %s API calls, %s search requests, %.1f MB, %.2f h unthrottled; %s; %.2f h with the current tokens, "
+                    "%s tokens to avoid waiting for resets", name, strategy['api_calls'], strategy['search_requests'],
+                    strategy['bytes'] / 1e6,
+                    strategy['hours'],
+                    'unknown fit' if fits is None else 'fits the remaining budget' if fits else 'exceeds the remaining budget',
+                    strategy['schedule']['hours_with_current_tokens'], strategy['schedule']['tokens_needed'] or '?')
@@ -0,0 +1,161 @@
+"""Module profiling the crawler across threads and worker processes with cProfile"""
+
+import collections
+import cProfile
+import glob
+import os
+import pstats
+import threading
+import multiprocessing
+from multiprocessing import util
+from typing import Dict, List, Optional, Tuple
+
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Stacks whose time is below this share of the total are left out of the collapsed output
+MIN_STACK_SHARE = 1e-5
+
+_profile_dir: Optional[str] = None
+_profiles: List[Tuple[str, cProfile.Profile]] = []
+_profiles_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def init_profiling(profile_dir: Optional[str], fresh: bool = False):
+    """
+    Enable profiling for the current process. None disables it.
+
+    Every thread that calls profile_current_thread afterwards gets its own
+    profiler; the stats go to profile_dir, one file per thread and process.
+
+    Args:
+        profile_dir: Directory of the profiles.
+        fresh: Remove the profiles of an earlier run from profile_dir.
+    """
+    global _profile_dir  # pylint: disable=global-statement
+    _profile_dir = profile_dir
+    if not profile_dir:
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    if fresh:
+        for path in glob.glob(os.path.join(profile_dir, '*.prof')):
+            os.remove(path)
+
+
+def profile_dir() -> Optional[str]:
+    """The directory profiles are written to, None when profiling is off."""
+    return _profile_dir
+
+
+def profile_current_thread():
+    """
+    Start profiling the calling thread, if profiling is enabled.
+
+    In a worker process the stats are dumped when the process exits; in the
+    main process by dump_profiles.
+    """
+    global _profiles, _profiles_pid  # pylint: disable=global-statement
+    if not _profile_dir:
+        return
+    with _lock:
+        # never dump profilers inherited from a forked parent
+        if _profiles_pid != os.getpid():
+            _profiles = []
+            _profiles_pid = os.getpid()
+            if multiprocessing.current_process().name != 'MainProcess':
+                util.Finalize(None, dump_profiles, exitpriority=10)
+        profile = cProfile.Profile()
+        _profiles.append((f'{os.getpid()}-{threading.current_thread().name}', profile))
+    profile.enable()
+
+
+def dump_profiles():
+    """Write the stats of every profiler of this process to the profile directory."""
+    with _lock:
+        profiles = list(_profiles) if _profiles_pid == os.getpid() else []
+        _profiles.clear()
+    # disabling a profiler also unhooks the calling thread, so its own goes first
+    current = threading.current_thread().name
+    profiles.sort(key=lambda named: not named[0].endswith(f'-{current}'))
+    for name, profile in profiles:
+        try:
+            # pids are reused, e.g. by recycled sandbox processes
+            profile.dump_stats(os.path.join(_profile_dir, f'{name}-{os.urandom(3).hex()}.prof'))
+        except (OSError, TypeError) as e:
+            logger.warning("Failed writing profile %s: %s", name, e)
+
+
+def _label(function: Tuple[str, int, str]) -> str:
+    filename, line, name = function
+    if filename == '~':
+        # built-in functions
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapsed_stacks(stats: pstats.Stats) -> Dict[str, int]:
+    """
+    Reconstruct call stacks from pstats caller edges, in the collapsed format
+    of flamegraph.pl and speedscope: "outer;inner;leaf" -> microseconds.
+
+    cProfile only records caller -> callee edges, so the time of a function
+    reached through several stacks is split in proportion to the cumulative
+    time of each edge.
+    """
+    entries = stats.stats  # type: ignore[attr-defined]
+    callees: Dict[tuple, Dict[tuple, tuple]] = collections.defaultdict(dict)
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees[caller][function] = edge
+
+    total = sum(tt for _, _, tt, _, _ in entries.values()) or 1.0
+    stacks: Dict[str, int] = collections.Counter()
+
+    def walk(function, stack: Tuple[str, ...], seen: frozenset, self_time: float, cumulative_time: float):
+        stack = stack + (_label(function),)
+        stacks[';'.join(stack)] += int(self_time * 1e6)
+        function_cumulative = entries[function][3]
+        share = cumulative_time / function_cumulative if function_cumulative else 0.0
+        for callee, (_, _, tt, ct) in callees.get(function, {}).items():
+            if callee in seen or ct * share < total * MIN_STACK_SHARE:
+                continue
+            walk(callee, stack, seen | {callee}, tt * share, ct * share)
+
+    for function, (_, _, tt, ct, callers) in entries.items():
+        if not callers:
+            walk(function, (), frozenset([function]), tt, ct)
+    return {stack: time for stack, time in stacks.items() if time > 0}
+
+
+def merge_profiles(directory: str) -> Optional[Tuple[str, str]]:
+    """
+    Merge the per thread and process profiles of a run.
+
+    Returns:
+        The paths of the merged pstats file and of the collapsed stacks, or
+        None when there was nothing to merge
+    """
+    files = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    if not files:
+        logger.warning("No profiles found in '%s'", directory)
+        return None
+
+    stats = pstats.Stats(files[0])
+    for path in files[1:]:
+        try:
+            stats.add(path)
+        except (OSError, EOFError, TypeError) as e:
+            logger.warning("Skipping unreadable profile %s: %s", path, e)
+
+    merged_path = os.path.join(directory, 'merged.pstats')
+    stats.dump_stats(merged_path)
+
+    collapsed_path = os.path.join(directory, 'merged.collapsed')
+    with open(collapsed_path, 'w', encoding='utf-8') as stream:
+        for stack, microseconds in sorted(collapsed_stacks(stats).items()):
+            stream.write(f'{stack} {microseconds}\n')
+
+    logger.info("Merged %s profiles into '%s' and '%s'", len(files), merged_path, collapsed_path)
+    return merged_path, collapsed_path
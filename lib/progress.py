@@ -0,0 +1,169 @@
+"""Module reporting live crawl progress, throughput, rate limit headroom and ETA"""
+
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, TextIO
+
+from lib import metrics
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Seconds between two summaries logged when stderr is not a terminal
+DEFAULT_INTERVAL = 30.0
+
+# Seconds between two redraws of the live line on a terminal
+TTY_REFRESH = 1.0
+
+# Weight of the latest interval in the smoothed throughput
+SMOOTHING = 0.3
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Render seconds as 1h02m, 3m05s or 12s; '?' when unknown."""
+    if seconds is None:
+        return '?'
+    seconds = int(max(0, seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f'{hours}h{minutes:02d}m'
+    if minutes:
+        return f'{minutes}m{seconds:02d}s'
+    return f'{seconds}s'
+
+
+def estimate(status: Dict[str, Any]) -> Optional[float]:
+    """
+    Seconds until the crawl completes, from the repository throughput so far.
+
+    When the API calls still needed exceed the remaining rate limit and the
+    limit runs out before it resets, the wait for the reset is added.
+
+    Returns:
+        The estimate, or None before the first repository completed
+    """
+    repos_left = status['repos_total'] - status['repos_done']
+    if repos_left <= 0:
+        return 0.0
+    if not status['repos_done']:
+        return None
+    eta = repos_left * status['elapsed'] / status['repos_done']
+
+    remaining, reset_in, api_rate = status['rate_limit_remaining'], status['rate_limit_reset_in'], status['api_rate']
+    if remaining is not None and reset_in is not None and api_rate:
+        calls_needed = status['api_calls'] / status['repos_done'] * repos_left
+        exhausted_in = remaining / api_rate
+        if calls_needed > remaining and exhausted_in < reset_in:
+            eta += reset_in - exhausted_in
+    return eta
+
+
+class ProgressReporter:
+    """
+    Reports crawl progress from the parent process' metrics while a crawl runs.
+
+    Repositories and files completed, API calls and the rate limit all land in
+    lib/metrics in the parent, parse workers included, so a background thread
+    only has to read them. On a terminal a single status line is redrawn every
+    second; otherwise a summary is logged every interval seconds.
+    """
+
+    def __init__(self, total_repos: int, interval: Optional[float] = None, stream: Optional[TextIO] = None):
+        self.total_repos = total_repos
+        self.interval = interval if interval is not None else DEFAULT_INTERVAL
+        self.stream = stream or sys.stderr
+        self.tty = self.stream.isatty()
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # (monotonic time, files done) of the previous report, and the smoothed files/s
+        self._last = (self._started, 0.0)
+        self._files_rate: Optional[float] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start reporting in a background thread; an interval of 0 reports nothing."""
+        if not self.interval or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop reporting, after a final report."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.report(final=True)
+
+    def _run(self):
+        while not self._stop.wait(TTY_REFRESH if self.tty else self.interval):
+            self.report()
+
+    def status(self) -> Dict[str, Any]:
+        """The progress figures of the crawl so far."""
+        now = time.monotonic()
+        elapsed = now - self._started
+        files_done = metrics.counter_total('files_total', stage='done')
+        last_time, last_files = self._last
+        if now > last_time:
+            rate = (files_done - last_files) / (now - last_time)
+            self._files_rate = rate if self._files_rate is None else \
+                SMOOTHING * rate + (1 - SMOOTHING) * self._files_rate
+        self._last = (now, files_done)
+
+        api_calls = metrics.counter_total('github_api_calls_total')
+        reset = metrics.gauge_value('github_rate_limit_reset_timestamp_seconds')
+        status = {
+            'elapsed': elapsed,
+            'repos_total': self.total_repos,
+            'repos_done': metrics.counter_total('repos_total', stage='written'),
+            # fork files whose blobs match the parent's are never queued
+            'files_queued': metrics.counter_total('files_total', stage='queued'),
+            'files_done': files_done,
+            'files_rate': self._files_rate or 0.0,
+            'api_calls': api_calls,
+            'api_rate': api_calls / elapsed if elapsed else 0.0,
+            'rate_limit_remaining': metrics.gauge_value('github_rate_limit_remaining'),
+            'rate_limit_reset_in': reset - time.time() if reset is not None else None,
+        }
+        status['eta'] = estimate(status)
+        return status
+
+    def report(self, final: bool = False):
+        """Render the status line on a terminal, log it otherwise."""
+        status = self.status()
+        line = (f"repos {status['repos_done']:.0f}/{status['repos_total']}"
+                f" | files {status['files_done']:.0f}/{status['files_queued']:.0f}"
+                f" | {status['files_rate']:.1f} files/s, {status['api_rate']:.1f} calls/s"
+                f" | rate limit {self._headroom(status)}"
+                f" | elapsed {format_duration(status['elapsed'])}, ETA {format_duration(status['eta'])}")
+        if self.tty:
+            # redraw in place; clear whatever a log line left behind
+            self.stream.write(f"\r\x1b[K{line}" + ('\n' if final else ''))
+            self.stream.flush()
+        else:
+            logger.info("Progress: %s", line)
+
+    @staticmethod
+    def _headroom(status: Dict[str, Any]) -> str:
+        remaining = status['rate_limit_remaining']
+        if remaining is None:
+            return '?'
+        headroom = f"{remaining:.0f} left"
+        if status['rate_limit_reset_in'] is not None:
+            headroom += f", resets in {format_duration(status['rate_limit_reset_in'])}"
+        if status['api_rate']:
+            exhausted_in = remaining / status['api_rate']
+            if status['rate_limit_reset_in'] is None or exhausted_in < status['rate_limit_reset_in']:
+                headroom += f", runs out in {format_duration(exhausted_in)}"
+        return headroom
@@ -0,0 +1,347 @@
+"""Module updating the results store from GitHub push events, replayed from a file or received by a webhook"""
+
+import collections
+import csv
+import hashlib
+import hmac
+import json
+import posixpath
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from github import Github, GithubException, Repository
+
+from lib import metrics, rollups
+from lib.cache_manager import init_cache
+from lib.content_fetcher import init_fetch_limits
+from lib.file_manager import Finding, prepare_match_functions
+from lib.github_manager import (analyze_files, changed_candidates, format_findings, get_files_by_path,
+                                get_head_sha, get_repo_metadata_or_empty, list_repo_files, plan_delta,
+                                results_fingerprint)
+from lib.logger import setup_logger
+from lib.path_filter import init_prune_rules, repo_pruner
+from lib.results_store import ResultsStore, StoredRepo
+from lib.sandbox import init_sandbox
+
+logger = setup_logger(__name__)
+
+# Seconds the webhook receiver gathers events before applying them
+DEFAULT_BATCH_SECONDS = 5.0
+
+# Port the webhook receiver listens on
+DEFAULT_WEBHOOK_PORT = 8080
+
+# Commits a push payload lists at most; larger pushes do not tell every touched path
+PAYLOAD_MAX_COMMITS = 20
+
+
+class PushEvent(NamedTuple):
+    """A push to the default branch of a repository."""
+    repo: str
+    before: str
+    after: str
+    # (added, removed, modified) paths of each commit, oldest first
+    commits: List[Tuple[List[str], List[str], List[str]]]
+    # the payload does not tell every touched path: forced, or too many commits
+    incomplete: bool
+
+
+def parse_push(payload: Dict[str, Any]) -> Optional[PushEvent]:
+    """
+    A push event of a webhook payload, None for pushes to other branches,
+    branch deletions and payloads that are not pushes.
+    """
+    repository = payload.get('repository') or {}
+    full_name = repository.get('full_name')
+    if not full_name or 'after' not in payload or 'before' not in payload:
+        return None
+    default_branch = repository.get('default_branch') or repository.get('master_branch')
+    if payload.get('ref') != f'refs/heads/{default_branch}' or payload.get('deleted'):
+        return None
+    commits = [(commit.get('added') or [], commit.get('removed') or [], commit.get('modified') or [])
+               for commit in payload.get('commits') or []]
+    incomplete = bool(payload.get('forced')) or len(commits) >= PAYLOAD_MAX_COMMITS
+    return PushEvent(full_name, payload['before'], payload['after'], commits, incomplete)
+
+
+def read_events(path: str) -> Iterator[PushEvent]:
+    """
+    The push events of a JSONL file, one webhook payload per line, or one
+    {"event": ..., "payload": ...} delivery per line; other events are skipped.
+    """
+    with open(path, encoding='utf-8') as events_file:
+        for number, line in enumerate(events_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping line %s of '%s': %s", number, path, e)
+                continue
+            if 'payload' in record:
+                if record.get('event', 'push') != 'push':
+                    continue
+                record = record['payload']
+            event = parse_push(record)
+            if event is not None:
+                yield event
+
+
+def touched_paths(events: List[PushEvent]) -> Tuple[Set[str], Set[str]]:
+    """
+    The paths the pushes leave changed and removed, applying their commits in order.
+
+    Returns:
+        (added or modified paths, removed paths)
+    """
+    changed: Set[str] = set()
+    removed: Set[str] = set()
+    for event in events:
+        for added, deleted, modified in event.commits:
+            for path in added + modified:
+                changed.add(path)
+                removed.discard(path)
+            for path in deleted:
+                removed.add(path)
+                changed.discard(path)
+    return changed, removed
+
+
+def events_since(events: List[PushEvent], base_sha: str, head_sha: str) -> Optional[List[PushEvent]]:
+    """
+    The events leading from base_sha to head_sha, one after the other, or
+    None when they do not, or do not tell every touched path. Events
+    already recorded, before base_sha, are left out.
+    """
+    starts = [index for index, event in enumerate(events) if event.before == base_sha]
+    if not starts:
+        return None
+    chain = events[starts[-1]:]
+    expected = base_sha
+    for event in chain:
+        if event.before != expected or event.incomplete:
+            return None
+        expected = event.after
+    return chain if expected == head_sha else None
+
+
+class PushUpdater:
+    """
+    Applies push events to the results store: only the paths the pushes
+    touched are fetched and parsed, with the assets and parsers of a crawl.
+
+    When the recorded head of a repository does not chain to its current
+    head through the events, e.g. events were missed, the update falls back
+    to a delta scan through the compare API, and repositories not recorded
+    yet are crawled in full.
+    """
+
+    def __init__(self, github_client: Github, results_store: ResultsStore, config: Dict[str, Any],
+                 output_file: Optional[str] = None):
+        self.github_client = github_client
+        self.results_store = results_store
+        self.output_file = output_file
+        self.headers = config.get('headers')
+        self.rollups_path = (config.get('rollups') or {}).get('path')
+        assets = config.get('assets')
+        self.match_functions = prepare_match_functions(assets)
+        self.fingerprint = results_fingerprint(assets, config.get('prune'))
+        parse_limits = config.get('parse_limits')
+        init_cache((config.get('cache') or {}).get('path'))
+        init_sandbox(parse_limits)
+        init_fetch_limits(config.get('fetch_limits'))
+        init_prune_rules(config.get('prune'))
+        self._lock = threading.Lock()
+
+    def plan(self, repo: Repository.Repository, events: List[PushEvent], base_sha: str,
+             head_sha: str) -> Optional[Tuple[List[Finding], List[str]]]:
+        """
+        The (carried over findings, paths to scan) of a repository, from the
+        events when they chain from base_sha to head_sha, else from plan_delta.
+        """
+        previous = self.results_store.findings(repo.full_name)
+        chain = events_since(events, base_sha, head_sha)
+        if chain is None:
+            metrics.inc('push_updates_total', mode='compare')
+            return plan_delta(repo, base_sha, head_sha, previous, self.match_functions)
+
+        changed, removed = touched_paths(chain)
+        touched = changed | removed
+        ignore_file = repo_pruner().ignore_file
+        if ignore_file and any(posixpath.basename(path) == ignore_file for path in touched):
+            # the prune rules changed with it
+            return None
+        candidates = changed_candidates(repo, head_sha, sorted(changed), self.match_functions)
+        if candidates is None:
+            return None
+        metrics.inc('push_updates_total', mode='events')
+        reused = [finding for finding in previous if finding.path not in touched]
+        metrics.inc('findings_reused_total', len(reused))
+        return reused, candidates
+
+    def update_repo(self, full_name: str, events: List[PushEvent]) -> bool:
+        """
+        Bring the recorded findings of a repository up to its current head.
+
+        Returns:
+            Whether the results store was updated
+        """
+        try:
+            repo = self.github_client.get_repo(full_name)
+        except GithubException as e:
+            logger.error("Error retrieving repository '%s': %s", full_name, e)
+            metrics.inc('errors_total', stage='push_update')
+            return False
+        head_sha = get_head_sha(repo)
+        if head_sha is None:
+            return False
+        base_sha = self.results_store.head(full_name, self.fingerprint)
+        if base_sha == head_sha:
+            logger.info("Repo '%s' is up to date at %s", full_name, head_sha[:7])
+            metrics.inc('push_updates_total', mode='up_to_date')
+            return False
+
+        plan = self.plan(repo, events, base_sha, head_sha) if base_sha else None
+        if plan is None:
+            metrics.inc('push_updates_total', mode='full_crawl')
+            listing = list_repo_files(repo)
+            if listing is None:
+                return False
+            branch_metadata, files = listing
+            reused: List[Finding] = []
+        else:
+            reused, paths = plan
+            files = get_files_by_path(repo, paths)
+            if len(files) < len(paths):
+                # recording the head would lose the findings of the missing paths
+                logger.error("Repo '%s': %s of %s changed paths could not be fetched, not updating it",
+                             full_name, len(paths) - len(files), len(paths))
+                metrics.inc('errors_total', stage='push_update')
+                return False
+            branch_metadata = get_repo_metadata_or_empty(repo)
+        logger.info("Repo '%s': scanning %s files pushed up to %s", full_name, len(files), head_sha[:7])
+        findings = reused + analyze_files(repo, files, self.match_functions)
+        self.results_store.save(full_name, head_sha, self.fingerprint, branch_metadata, findings)
+        return True
+
+    def apply(self, events: List[PushEvent]) -> int:
+        """
+        Update every repository the events pushed to, once, then rewrite the
+        outputs from the results store.
+
+        Returns:
+            The number of repositories updated
+        """
+        by_repo: Dict[str, List[PushEvent]] = collections.defaultdict(list)
+        for event in events:
+            by_repo[event.repo].append(event)
+        metrics.inc('push_events_total', len(events))
+        # one update at a time: a batch may arrive while the previous one is applied
+        with self._lock:
+            updated = sum(self.update_repo(full_name, repo_events) for full_name, repo_events in by_repo.items())
+            if updated:
+                self.write_outputs()
+        logger.info("Applied %s push events: %s of %s repositories updated", len(events), updated, len(by_repo))
+        return updated
+
+    def write_outputs(self):
+        """Write the CSV inventory and the rollups of every recorded repository."""
+        names = self.results_store.repos()
+        if self.output_file:
+            with open(self.output_file, 'w', newline='', encoding='utf-8') as csvfile:
+                if self.headers:
+                    csv.writer(csvfile).writerow(self.headers)
+                for name in names:
+                    csvfile.write(format_findings(StoredRepo(name), self.results_store.findings(name),
+                                                  self.results_store.metadata(name)))
+        if self.rollups_path:
+            for name in names:
+                rollups.record(name, [], rollups.repo_rollup(self.results_store.findings(name)))
+            rollups.write_rollups(self.rollups_path)
+
+
+def replay(updater: PushUpdater, path: str) -> int:
+    """Apply the push events of a JSONL file, one update per repository."""
+    events = list(read_events(path))
+    logger.info("Replaying %s push events from '%s'", len(events), path)
+    return updater.apply(events)
+
+
+def verify_signature(secret: Optional[str], body: bytes, signature: Optional[str]) -> bool:
+    """Check the X-Hub-Signature-256 header of a delivery; anything goes without a secret."""
+    if not secret:
+        return True
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+def webhook_server(port: int, secret: Optional[str], events: 'queue.Queue[PushEvent]') -> ThreadingHTTPServer:
+    """An HTTP server queueing the push events delivered to it; other events are acknowledged and dropped."""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Handles webhook deliveries."""
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if not verify_signature(secret, body, self.headers.get('X-Hub-Signature-256')):
+                metrics.inc('webhook_deliveries_total', outcome='bad_signature')
+                self.send_response(401)
+                self.end_headers()
+                return
+            event = None
+            if self.headers.get('X-GitHub-Event', 'push') == 'push':
+                try:
+                    event = parse_push(json.loads(body))
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    metrics.inc('webhook_deliveries_total', outcome='malformed')
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+            if event is not None:
+                events.put(event)
+            metrics.inc('webhook_deliveries_total', outcome='queued' if event else 'ignored')
+            # GitHub expects an answer within 10 seconds; the update runs later
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            logger.debug("Webhook: " + format, *args)
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def listen(updater: PushUpdater, port: int = DEFAULT_WEBHOOK_PORT, secret: Optional[str] = None,
+           batch_seconds: float = DEFAULT_BATCH_SECONDS, stop: Optional[threading.Event] = None):
+    """
+    Receive push events on port and apply them in batches: after the first
+    event, the events of the next batch_seconds are gathered, so a burst of
+    pushes to a repository costs one update. Runs until stop is set.
+    """
+    events: 'queue.Queue[PushEvent]' = queue.Queue()
+    server = webhook_server(port, secret, events)
+    if not secret:
+        logger.warning("No webhook secret set, deliveries are not authenticated")
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    logger.info("Receiving push events on port %s", server.server_address[1])
+    stop = stop or threading.Event()
+    try:
+        while not stop.is_set():
+            try:
+                batch = [events.get(timeout=1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + batch_seconds
+            while time.monotonic() < deadline:
+                try:
+                    batch.append(events.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            updater.apply(batch)
+    finally:
+        server.shutdown()
+        server.server_close()
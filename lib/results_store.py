@@ -0,0 +1,114 @@
+"""Module recording the head SHA and findings of every crawled repository, for delta scans"""
+
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from lib.file_manager import Finding
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def fingerprint(*settings: Any) -> str:
+    """
+    A digest of the settings findings depend on: the assets, prune rules and
+    parser versions. Findings recorded under another fingerprint are stale.
+    """
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StoredRepo(NamedTuple):
+    """
+    A recorded repository. Exposes full_name like a Repository, so its
+    findings can be rendered by format_row_data without an API call.
+    """
+    full_name: str
+
+
+class ResultsStore:
+    """
+    The findings of every repository as of a head commit, in a SQLite file.
+
+    A delta scan compares the recorded head with the current one and only
+    fetches what changed in between; every write replaces a repository's
+    head and findings as a whole, so a failed scan leaves the previous ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3 connections stay on the thread that opened them
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS repos (
+                                      repo TEXT PRIMARY KEY,
+                                      head_sha TEXT,
+                                      fingerprint TEXT NOT NULL,
+                                      metadata TEXT NOT NULL,
+                                      scanned REAL NOT NULL)""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS findings (
+                                      repo TEXT NOT NULL,
+                                      path TEXT NOT NULL,
+                                      finding BLOB NOT NULL,
+                                      PRIMARY KEY (repo, path))""")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def head(self, repo: str, current: str) -> Optional[str]:
+        """The recorded head SHA of a repository, unless it is missing or was recorded under another fingerprint."""
+        row = self._connection().execute("SELECT head_sha, fingerprint FROM repos WHERE repo = ?",
+                                          (repo,)).fetchone()
+        if row is None or row[1] != current:
+            return None
+        return row[0]
+
+    def metadata(self, repo: str) -> Dict[str, Any]:
+        """The branch metadata recorded with a repository's findings."""
+        row = self._connection().execute("SELECT metadata FROM repos WHERE repo = ?", (repo,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def repos(self) -> List[str]:
+        """The full names of the recorded repositories."""
+        return [repo for (repo,) in self._connection().execute("SELECT repo FROM repos ORDER BY repo")]
+
+    def findings(self, repo: str) -> List[Finding]:
+        """The recorded findings of a repository, in path order."""
+        rows = self._connection().execute("SELECT finding FROM findings WHERE repo = ? ORDER BY path", (repo,))
+        return [Finding(*pickle.loads(finding)) for (finding,) in rows]
+
+    def save(self, repo: str, head_sha: Optional[str], current: str, metadata: Dict[str, Any],
+             findings: List[Finding]):
+        """Replace the head, branch metadata and findings of a repository."""
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?)",
+                               (repo, head_sha, current, json.dumps(metadata, default=str), time.time()))
+            connection.execute("DELETE FROM findings WHERE repo = ?", (repo,))
+            connection.executemany("INSERT OR REPLACE INTO findings VALUES (?, ?, ?)",
+                                   [(repo, finding.path, pickle.dumps(tuple(finding))) for finding in findings])
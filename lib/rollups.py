@@ -0,0 +1,270 @@
+"""Module rolling findings up into counts per org, team and repository while the crawl runs"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from github import GithubException, Repository
+
+from lib import metrics
+from lib.file_manager import Finding
+from lib.logger import setup_logger
+from lib.sandbox import BUDGET_EXCEEDED
+
+logger = setup_logger(__name__)
+
+# The counts rolled up, by dimension
+DIMENSIONS = ('asset_types', 'resource_types', 'services', 'api_calls')
+
+# dimension -> name -> count, the rollup of one repository or of a group of them
+Rollup = Dict[str, Dict[str, int]]
+
+# (dimension, name, count)
+Count = Tuple[str, str, int]
+
+_lock = threading.Lock()
+_settings: Dict[str, Any] = {}
+# asset type -> parse function of config.yaml
+_parsers: Dict[str, str] = {}
+# repository full name -> (teams, rollup); a recrawled repository replaces its entry
+_repos: Dict[str, Tuple[List[str], Rollup]] = {}
+
+
+def init_rollups(assets: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None):
+    """
+    Configure the rollups of the current process and clear them.
+
+    Args:
+        assets: The assets of config.yaml, telling the parser of each asset type.
+        settings: The rollups section of config.yaml.
+    """
+    global _settings, _parsers  # pylint: disable=global-statement
+    _settings = settings or {}
+    _parsers = {}
+    for asset in assets or []:
+        _parsers.setdefault(asset.get('type'), asset.get('parse_function'))
+    with _lock:
+        _repos.clear()
+
+
+def service_of(name: str) -> Optional[str]:
+    """
+    The AWS service of a resource type, module or API call, e.g. s3 for
+    AWS::S3::Bucket, aws_s3_bucket, amazon.aws.s3_bucket and s3.list_buckets.
+    """
+    name = name.strip('"')
+    if '::' in name:
+        parts = name.split('::')
+        return parts[1].lower() if len(parts) > 2 and parts[0] == 'AWS' else None
+    if name.startswith(('amazon.aws.', 'community.aws.')):
+        module = name.split('.')[-1]
+        if module.startswith('aws_'):
+            module = module[4:]
+        return module.split('_')[0]
+    if '.' in name:
+        return name.split('.')[0].lower()
+    if name.startswith('aws_'):
+        return name.split('_')[1]
+    return None
+
+
+def _resources(counts: Dict[str, Any]) -> Iterator[Count]:
+    for name, count in counts.items():
+        if not isinstance(count, int) or isinstance(count, bool):
+            continue
+        name = str(name).strip('"')
+        yield 'resource_types', name, count
+        service = service_of(name)
+        if service:
+            yield 'services', service, count
+
+
+def resource_counts(analysis: Any) -> Iterator[Count]:
+    """Counts of resource types or modules, as cloudformation, ansible and chef report them."""
+    if isinstance(analysis, dict):
+        yield from _resources(analysis)
+
+
+def terraform_counts(analysis: Any) -> Iterator[Count]:
+    """Counts of the resource types of a terraform file; data sources count as data.<type>."""
+    if not isinstance(analysis, dict):
+        return
+    yield from _resources(analysis.get('Resource Types and Counts') or {})
+    for name, count in (analysis.get('Data Source Types and Counts') or {}).items():
+        name = str(name).strip('"')
+        yield 'resource_types', f'data.{name}', count
+        service = service_of(name)
+        if service:
+            yield 'services', service, count
+
+
+def _calls(calls: Any) -> Iterator[Count]:
+    for call in calls:
+        call = str(call)
+        yield 'api_calls', call, 1
+        service = service_of(call)
+        if service:
+            yield 'services', service, 1
+
+
+def call_counts(analysis: Any) -> Iterator[Count]:
+    """API calls listed as client.method strings, as boto3, shell, ruby and jupyter report them."""
+    if isinstance(analysis, (list, set, tuple)):
+        yield from _calls(analysis)
+
+
+def cmdlet_counts(analysis: Any) -> Iterator[Count]:
+    """PowerShell cmdlets; their services are not spelled out."""
+    if isinstance(analysis, (list, set, tuple)):
+        for cmdlet in analysis:
+            yield 'api_calls', str(cmdlet), 1
+
+
+def method_counts(analysis: Any) -> Iterator[Count]:
+    """
+    Methods by service, as the javascript, java, csharp, springcloud and
+    dotnet parsers report them. Their AWS_* entries hold annotations,
+    configurations and imports rather than calls and are left out.
+    """
+    if not isinstance(analysis, dict):
+        return
+    for service, methods in analysis.items():
+        if str(service).startswith('AWS_') or not isinstance(methods, (list, set, tuple)):
+            continue
+        service = str(service).lower()
+        for method in methods:
+            yield 'api_calls', f'{service}.{method}', 1
+            yield 'services', service, 1
+
+
+def groovy_counts(analysis: Any) -> Iterator[Count]:
+    """The AWS CLI commands of a Jenkins pipeline, reported as service.command."""
+    if isinstance(analysis, dict):
+        yield from _calls(analysis.get('AWS_CLI_Commands') or [])
+
+
+# parse function -> counts of its structured output; the others only count as files
+EXTRACTORS: Dict[str, Callable[[Any], Iterator[Count]]] = {
+    'ansible': resource_counts,
+    'boto3': call_counts,
+    'chef': resource_counts,
+    'cloudformation': resource_counts,
+    'csharp': method_counts,
+    'dotnet': method_counts,
+    'groovy': groovy_counts,
+    'java': method_counts,
+    'javascript': method_counts,
+    'jupyter': call_counts,
+    'powershell': cmdlet_counts,
+    'ruby': call_counts,
+    'shell': call_counts,
+    'springcloud': method_counts,
+    'terraform': terraform_counts,
+}
+
+
+def _add(rollup: Rollup, other: Rollup):
+    for dimension, counts in other.items():
+        totals = rollup.setdefault(dimension, {})
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+
+
+def repo_rollup(findings: List[Finding]) -> Rollup:
+    """Counts the findings of a repository by asset type, and their parsed output by dimension."""
+    rollup: Rollup = {dimension: {} for dimension in DIMENSIONS}
+    for finding in findings:
+        asset_types = rollup['asset_types']
+        asset_types[finding.asset_type] = asset_types.get(finding.asset_type, 0) + 1
+        analysis = finding.analysis
+        if isinstance(analysis, dict) and BUDGET_EXCEEDED in analysis:
+            continue
+        extractor = EXTRACTORS.get(_parsers.get(finding.asset_type))
+        if extractor is None:
+            continue
+        try:
+            for dimension, name, count in extractor(analysis):
+                counts = rollup[dimension]
+                counts[name] = counts.get(name, 0) + count
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning("Cannot roll up the analysis of %s: %s", finding.path, e)
+            metrics.inc('errors_total', stage='rollup')
+    return rollup
+
+
+def repo_teams(repo: Repository.Repository) -> List[str]:
+    """The slugs of the teams with access to a repository, when rollups by team are on; one API call."""
+    if not _settings.get('teams'):
+        return []
+    try:
+        return sorted(team.slug for team in repo.get_teams())
+    except GithubException as e:
+        logger.warning("Cannot list the teams of '%s': %s", repo.full_name, e)
+        return []
+
+
+def record(repo: str, teams: List[str], rollup: Rollup):
+    """Set the rollup of a repository, replacing the one of an earlier attempt."""
+    with _lock:
+        _repos[repo] = (teams, rollup)
+
+
+def record_findings(repo: Repository.Repository, findings: List[Finding]) -> Tuple[List[str], Rollup]:
+    """Roll up a repository's findings and record them."""
+    teams = repo_teams(repo)
+    rollup = repo_rollup(findings)
+    record(repo.full_name, teams, rollup)
+    return teams, rollup
+
+
+def recorded(repo: str) -> Optional[Tuple[List[str], Rollup]]:
+    """The (teams, rollup) recorded for a repository."""
+    with _lock:
+        return _repos.get(repo)
+
+
+def _sorted(rollup: Rollup) -> Rollup:
+    return {dimension: dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+            for dimension, counts in rollup.items()}
+
+
+def summary(names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    The recorded rollups summed per org and team, next to those of every
+    repository and the totals; counts are sorted from the largest.
+
+    Args:
+        names: Only sum up these repositories, by full name; all by default.
+    """
+    with _lock:
+        repos = dict(_repos)
+    if names is not None:
+        repos = {full_name: repos[full_name] for full_name in names if full_name in repos}
+    totals: Rollup = {}
+    orgs: Dict[str, Rollup] = {}
+    teams: Dict[str, Rollup] = {}
+    for full_name, (slugs, rollup) in repos.items():
+        _add(totals, rollup)
+        _add(orgs.setdefault(full_name.split('/')[0], {}), rollup)
+        for team in slugs:
+            _add(teams.setdefault(team, {}), rollup)
+    report = {
+        'repos_total': len(repos),
+        'findings_total': sum(totals.get('asset_types', {}).values()),
+        'totals': _sorted(totals),
+        'orgs': {org: _sorted(rollup) for org, rollup in sorted(orgs.items())},
+        'repos': {full_name: _sorted(rollup) for full_name, (_, rollup) in sorted(repos.items())},
+    }
+    if _settings.get('teams'):
+        report['teams'] = {team: _sorted(rollup) for team, rollup in sorted(teams.items())}
+    return report
+
+
+def write_rollups(path: str, names: Optional[Iterable[str]] = None):
+    """Write the summary report of the recorded rollups, or of those of names, to path as JSON, replacing it atomically."""
+    content = json.dumps(summary(names), indent=2) + '\n'
+    try:
+        metrics.write_atomic(path, content)
+        logger.info("Rollups written to '%s'", path)
+    except OSError as e:
+        logger.error("Failed writing rollups to '%s': %s", path, e)
@@ -0,0 +1,180 @@
+"""Module running parsers in killable, recyclable sandbox processes"""
+
+import multiprocessing
+import os
+from multiprocessing import util
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from lib.logger import setup_logger
+from lib.profiler import init_profiling, profile_current_thread, profile_dir
+
+logger = setup_logger(__name__)
+
+# Key of the analysis result recorded for a file that ran over its budget
+BUDGET_EXCEEDED = 'Parse Budget Exceeded'
+
+# A sandbox process is replaced after this many parses to bound memory growth
+DEFAULT_MAX_TASKS = 500
+
+# Seconds an idle sandbox process gets to exit on its own before it is killed
+EXIT_GRACE = 5.0
+
+_limits: Dict[str, Any] = {}
+_sandbox: Optional['ParseSandbox'] = None
+_sandbox_pid: Optional[int] = None
+
+
+class ParserError(Exception):
+    """Raised when a parser fails inside the sandbox."""
+
+
+def _sandbox_worker(conn, profile_to: Optional[str] = None):
+    """Parse requests sent over conn until the parent closes it."""
+    # a sandbox killed on timeout leaves no profile behind
+    init_profiling(profile_to)
+    profile_current_thread()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        parse_function, content = request
+        try:
+            result = parse_function(content)
+            conn.send(('ok', result))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class ParseSandbox:
+    """
+    A child process that runs parse functions under a time budget.
+
+    A parse that overruns its budget gets the process killed; the next parse
+    starts a fresh one. The process is also recycled after max_tasks parses.
+    """
+
+    def __init__(self, max_tasks: int = DEFAULT_MAX_TASKS):
+        self.max_tasks = max_tasks
+        self._process: Optional[multiprocessing.Process] = None
+        self._conn = None
+        self._tasks = 0
+
+    def _start(self):
+        # never busy here: a parse that overran its budget already killed it
+        self.close(grace=EXIT_GRACE)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_sandbox_worker, args=(child_conn, profile_dir()), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self._tasks = 0
+
+    def close(self, grace: float = 0.0):
+        """
+        Stop the sandbox process, killing it if it is still busy.
+
+        Args:
+            grace: Seconds to wait for the process to exit on its own, letting
+                it run its exit handlers, e.g. to write its profile.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._process is not None:
+            if grace:
+                self._process.join(grace)
+            if self._process.is_alive():
+                self._process.kill()
+            self._process.join()
+            self._process = None
+
+    def run(self, parse_function: Callable[[str], Any], content: str, timeout: Optional[float]) -> Tuple[bool, Any]:
+        """
+        Run a parse function on content in the sandbox process.
+
+        Args:
+            parse_function: A module level parse function.
+            content: The decoded file content.
+            timeout: Seconds to wait for the result. None waits forever.
+
+        Returns:
+            A (completed, result) tuple. completed is False when the time budget ran out.
+
+        Raises:
+            ParserError: If the parser raised or the sandbox process died.
+        """
+        if self._process is None or not self._process.is_alive() or self._tasks >= self.max_tasks:
+            self._start()
+
+        self._tasks += 1
+        try:
+            self._conn.send((parse_function, content))
+        except OSError as e:
+            self.close()
+            raise ParserError("sandbox process exited before parsing") from e
+        if not self._conn.poll(timeout):
+            self.close()
+            return False, None
+
+        try:
+            status, result = self._conn.recv()
+        except EOFError as e:
+            self.close()
+            raise ParserError("sandbox process exited while parsing") from e
+        if status == 'error':
+            raise ParserError(result)
+        return True, result
+
+
+def init_sandbox(parse_limits: Optional[Dict[str, Any]]):
+    """
+    Configure per-parser budgets for the current process.
+
+    Args:
+        parse_limits: The parse_limits section of config.yaml. None or empty
+            runs parsers inline without any budget.
+    """
+    global _limits, _sandbox, _sandbox_pid  # pylint: disable=global-statement
+    _limits = parse_limits or {}
+    _sandbox = None
+    _sandbox_pid = None
+
+
+def get_parse_limits(parser: str) -> Tuple[Optional[float], Optional[int]]:
+    """
+    Returns the (timeout, max_bytes) budget of a parser; None means unlimited.
+    """
+    overrides = (_limits.get('parsers') or {}).get(parser) or {}
+    return (overrides.get('timeout', _limits.get('timeout')),
+            overrides.get('max_bytes', _limits.get('max_bytes')))
+
+
+def budget_exceeded(reason: str) -> Dict[str, str]:
+    """Returns the analysis result recorded for a file that ran over its budget."""
+    return {BUDGET_EXCEEDED: reason}
+
+
+def run_parser(parser: str, parse_function: Callable[[str], Any], content: str) -> Tuple[bool, Any]:
+    """
+    Run a parser under its time budget.
+
+    Parsers run inline when no parse_limits are configured, otherwise in this
+    process' sandbox.
+
+    Returns:
+        A (completed, result) tuple. completed is False when the time budget ran out.
+    """
+    global _sandbox, _sandbox_pid  # pylint: disable=global-statement
+    if not _limits:
+        return True, parse_function(content)
+
+    # never reuse a sandbox inherited from a forked parent
+    if _sandbox is None or _sandbox_pid != os.getpid():
+        _sandbox = ParseSandbox(_limits.get('max_tasks', DEFAULT_MAX_TASKS))
+        _sandbox_pid = os.getpid()
+        # stop the sandbox before multiprocessing terminates daemonic children at exit
+        util.Finalize(_sandbox, _sandbox.close, kwargs={'grace': EXIT_GRACE}, exitpriority=20)
+
+    timeout, _ = get_parse_limits(parser)
+    return _sandbox.run(parse_function, content, timeout)
@@ -0,0 +1,209 @@
+"""Module spreading GitHub API requests over a pool of tokens by their remaining rate limit"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from github import Auth
+from github.Requester import Requester, WithRequester
+
+from lib import metrics
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# A token with this many requests left or fewer is parked until its reset
+PARK_THRESHOLD = 10
+
+# Seconds a parked token waits when its reset time is unknown
+DEFAULT_PARK_SECONDS = 60.0
+
+
+class PooledToken:
+    """One credential of the pool and the rate limit budget last reported for it."""
+
+    def __init__(self, label: str, auth: Auth.Auth):
+        self.label = label
+        self.auth = auth
+        # None until a response reported them
+        self.remaining: Optional[int] = None
+        self.limit: Optional[int] = None
+        self.reset: Optional[float] = None
+
+    def available(self, now: float) -> bool:
+        """Whether the token has budget left, or its reset has passed."""
+        return self.remaining is None or self.remaining > PARK_THRESHOLD or (self.reset is not None and now >= self.reset)
+
+    def headroom(self, now: float) -> float:
+        """Requests the token can still make; unknown budgets come first so they get probed."""
+        if self.remaining is None or (self.reset is not None and now >= self.reset):
+            return float('inf')
+        return self.remaining
+
+
+class TokenPool(Auth.Auth, WithRequester['TokenPool']):
+    """
+    Authentication method of a Github instance spreading its requests over
+    personal access tokens and GitHub App installations.
+
+    PyGithub asks the authentication for the Authorization header of every
+    request; the pool answers with the token with the most remaining budget.
+    The rate limit headers of the response, read from PyGithub's request log
+    by TokenBudgetHandler, update that token's budget. Tokens at their limit
+    are parked until their reset; when all are, requests wait for the first
+    reset. Installation tokens are refreshed by PyGithub before they expire.
+    """
+
+    def __init__(self, tokens: Sequence[PooledToken]):
+        super().__init__()
+        if not tokens:
+            raise ValueError("A token pool needs at least one token")
+        self.tokens: List[PooledToken] = list(tokens)
+        self._lock = threading.Lock()
+        # the token of the request in flight on each thread
+        self._local = threading.local()
+        # reset time all threads are waiting for, so the wait is logged once
+        self._waiting_until: Optional[float] = None
+
+    def withRequester(self, requester: Requester) -> 'TokenPool':
+        super().withRequester(requester)
+        # installation tokens are requested with the instance's connection settings
+        for token in self.tokens:
+            if isinstance(token.auth, WithRequester):
+                token.auth.withRequester(requester)
+        return self
+
+    @property
+    def token_type(self) -> str:
+        return 'token'
+
+    @property
+    def token(self) -> str:
+        return self._choose().auth.token
+
+    def authentication(self, headers: dict) -> None:
+        pinned = getattr(self._local, 'pinned', None)
+        token = pinned if pinned is not None else self._choose()
+        # an installation token refresh is a request of its own; keep its budget apart
+        self._local.current = None
+        headers['Authorization'] = f'{token.auth.token_type} {token.auth.token}'
+        self._local.current = token
+
+    def mask_authentication(self, headers: dict) -> None:
+        current = getattr(self._local, 'current', None)
+        headers['Authorization'] = f"token ({current.label if current else 'pool'} removed)"
+
+    @property
+    def _masked_token(self) -> str:
+        return 'token (pool removed)'
+
+    def _choose(self) -> PooledToken:
+        while True:
+            with self._lock:
+                now = time.time()
+                available = [token for token in self.tokens if token.available(now)]
+                if available:
+                    token = max(available, key=lambda token: token.headroom(now))
+                    if token.remaining is not None and token.reset is not None and now >= token.reset:
+                        token.remaining = token.limit
+                    if token.remaining is not None:
+                        # spread concurrent requests before their responses arrive
+                        token.remaining -= 1
+                    return token
+                wake = min((token.reset for token in self.tokens if token.reset is not None),
+                           default=now + DEFAULT_PARK_SECONDS)
+                first = self._waiting_until != wake
+                self._waiting_until = wake
+            if first:
+                logger.warning("All %s tokens are out of requests, waiting %.0fs for a rate limit reset",
+                               len(self.tokens), wake - now)
+            time.sleep(max(1.0, wake - now))
+
+    @contextlib.contextmanager
+    def pin(self, token: PooledToken):
+        """Send the requests of the calling thread's with block with one token."""
+        self._local.pinned = token
+        try:
+            yield
+        finally:
+            self._local.pinned = None
+
+    def record(self, remaining: int, limit: Optional[int], reset: Optional[float]):
+        """Update the budget of the token that sent the calling thread's last request."""
+        token = getattr(self._local, 'current', None)
+        if token is None:
+            return
+        with self._lock:
+            token.remaining, token.reset = remaining, reset if reset is not None else token.reset
+            token.limit = limit if limit is not None else token.limit
+            known = [pooled for pooled in self.tokens if pooled.remaining is not None]
+            total = sum(pooled.remaining for pooled in known)
+            next_reset = min((pooled.reset for pooled in known if pooled.reset is not None), default=None)
+        metrics.set_gauge('github_token_rate_limit_remaining', remaining, token=token.label)
+        # the pool's budget, in place of the last response's
+        metrics.set_gauge('github_rate_limit_remaining', total)
+        if next_reset is not None:
+            metrics.set_gauge('github_rate_limit_reset_timestamp_seconds', next_reset)
+
+
+class TokenBudgetHandler(logging.Handler):
+    """Feeds the rate limit headers logged by PyGithub for every request to a TokenPool."""
+
+    def __init__(self, pool: TokenPool):
+        super().__init__(logging.DEBUG)
+        self.pool = pool
+
+    def emit(self, record: logging.LogRecord):
+        args = record.args
+        if not isinstance(args, tuple) or len(args) != 9:
+            return
+        headers = args[7] or {}
+        remaining = headers.get('x-ratelimit-remaining')
+        # the pool balances the core budget; search has a budget of its own
+        if remaining is None or headers.get('x-ratelimit-resource', 'core') != 'core':
+            return
+        limit, reset = headers.get('x-ratelimit-limit'), headers.get('x-ratelimit-reset')
+        self.pool.record(int(float(remaining)), int(float(limit)) if limit is not None else None,
+                         float(reset) if reset is not None else None)
+
+
+def read_private_key(private_key: str) -> str:
+    """A PEM private key given as is or as the path of a key file."""
+    if private_key.lstrip().startswith('-----BEGIN') or not os.path.isfile(private_key):
+        return private_key
+    with open(private_key, encoding='utf-8') as stream:
+        return stream.read()
+
+
+def create_token_pool(github_tokens: Sequence[str], app_id: Optional[str] = None, app_private_key: Optional[str] = None,
+                      installation_ids: Sequence[int] = ()) -> TokenPool:
+    """
+    Builds a pool of personal access tokens and GitHub App installations, and
+    starts tracking their budgets.
+
+    Args:
+        github_tokens: Personal access tokens.
+        app_id: Id of a GitHub App.
+        app_private_key: The App's private key, or the path of its PEM file.
+        installation_ids: Installations of the App to get tokens for.
+
+    Returns:
+        The pool, to pass as auth of a Github instance
+    """
+    tokens = [PooledToken(f'pat-{index}', Auth.Token(token)) for index, token in enumerate(github_tokens, start=1)]
+    if app_id and app_private_key:
+        app_auth = Auth.AppAuth(app_id, read_private_key(app_private_key))
+        tokens += [PooledToken(f'app-{app_id}-installation-{installation_id}',
+                               app_auth.get_installation_auth(int(installation_id)))
+                   for installation_id in installation_ids]
+    pool = TokenPool(tokens)
+
+    requester_logger = logging.getLogger('github.Requester')
+    requester_logger.addHandler(TokenBudgetHandler(pool))
+    requester_logger.setLevel(logging.DEBUG)
+    requester_logger.propagate = False
+    logger.info("Spreading requests over %s tokens: %s", len(tokens), ', '.join(token.label for token in tokens))
+    return pool
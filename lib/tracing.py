@@ -0,0 +1,126 @@
+"""Module recording crawl spans and exporting them in the Chrome trace-event format"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from lib.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# A trace event, see the Trace Event Format document of the Chromium project
+TraceEvent = Dict[str, Any]
+
+_enabled = False
+_lock = threading.Lock()
+_events: List[TraceEvent] = []
+# (pid, tid) of the threads whose name was recorded, (pid, None) for processes
+_named_threads: Set[Tuple[int, Optional[int]]] = set()
+
+
+def init_tracing(enabled: bool):
+    """Enable or disable span recording for the current process."""
+    global _enabled  # pylint: disable=global-statement
+    _enabled = enabled
+    with _lock:
+        _events.clear()
+        _named_threads.clear()
+
+
+def tracing_enabled() -> bool:
+    """Whether spans are recorded in this process."""
+    return _enabled
+
+
+def _now() -> float:
+    # CLOCK_MONOTONIC is shared by all processes, so worker spans line up with the parent's
+    return time.perf_counter_ns() / 1000
+
+
+def _record(event: TraceEvent):
+    pid, tid = os.getpid(), threading.get_ident()
+    event.update(pid=pid, tid=tid)
+    with _lock:
+        # trace viewers label the rows with these
+        if (pid, None) not in _named_threads:
+            _named_threads.add((pid, None))
+            _events.append({'ph': 'M', 'name': 'process_name', 'pid': pid, 'tid': tid,
+                            'args': {'name': multiprocessing.current_process().name}})
+        if (pid, tid) not in _named_threads:
+            _named_threads.add((pid, tid))
+            _events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid,
+                            'args': {'name': threading.current_thread().name}})
+        _events.append(event)
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'crawl', **args):
+    """Record the with block as a span of the calling thread."""
+    if not _enabled:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        _record({'ph': 'X', 'name': name, 'cat': category, 'ts': start, 'dur': _now() - start, 'args': args})
+
+
+def begin(name: str, key: str, **args):
+    """
+    Open a span that ends on another thread, see end.
+
+    Args:
+        name: The span name.
+        key: Identifies the span among the open ones of the same name.
+    """
+    if _enabled:
+        _record({'ph': 'b', 'name': name, 'cat': name, 'id': key, 'ts': _now(), 'args': args})
+
+
+def end(name: str, key: str):
+    """Close a span opened with begin."""
+    if _enabled:
+        _record({'ph': 'e', 'name': name, 'cat': name, 'id': key, 'ts': _now()})
+
+
+def drain() -> List[TraceEvent]:
+    """
+    Take the events of this process.
+
+    Worker processes return the drained events with every task, so the
+    parent collects them with merge().
+    """
+    with _lock:
+        drained = list(_events)
+        _events.clear()
+    return drained
+
+
+def merge(events: Optional[List[TraceEvent]]):
+    """Add events drained from a worker to those of this process."""
+    if events:
+        with _lock:
+            _events.extend(events)
+
+
+def write_trace(path: str):
+    """
+    Write the events of this process to path as Chrome trace-event JSON,
+    for chrome://tracing, Perfetto or speedscope.
+    """
+    with _lock:
+        events = sorted(_events, key=lambda event: event.get('ts', 0))
+    directory = os.path.dirname(path)
+    try:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, stream)
+        logger.info("Trace of %s events written to '%s'", len(events), path)
+    except OSError as e:
+        logger.error("Failed writing trace to '%s': %s", path, e)
@@ -0,0 +1,346 @@
+"""Module distributing a crawl over several nodes through a shared, lease-based work queue"""
+
+import contextlib
+import csv
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from github import Github, GithubException, Repository
+
+from lib import metrics, rollups
+from lib.file_manager import Finding
+from lib.github_manager import format_findings, split_forks
+from lib.logger import setup_logger
+from lib.rollups import Rollup
+
+logger = setup_logger(__name__)
+
+# Seconds a lease lasts without a heartbeat; a node renews its leases three times per period
+DEFAULT_LEASE_SECONDS = 300.0
+
+# Leases of a work item before it is given up as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Work items a node leases at a time
+DEFAULT_LEASE_BATCH = 10
+
+# Seconds an idle node waits before asking for work again
+DEFAULT_POLL_SECONDS = 5.0
+
+# (work item key, full names of its repositories)
+WorkItem = Tuple[str, List[str]]
+
+# The sink process_repos hands every repository's findings to
+Sink = Callable[[Repository.Repository, List[Finding], Dict[str, Any]], None]
+
+
+class WorkQueue:
+    """
+    A work queue in a SQLite file shared by the crawler nodes.
+
+    A work item is a repository together with its forks, which reuse its
+    findings. Nodes lease items, renew the leases while they work and mark
+    the items done; an item whose lease expired, because its node died or
+    hung, goes to the next node asking for work, up to max_attempts times.
+    Nodes store the CSV rows of every repository in the results table, and
+    its rollup in the rollups table, keyed by repository, so a retried item
+    overwrites rather than duplicates them.
+
+    SQLite needs working file locks: a local disk for several processes on
+    one machine, or a shared file system with reliable locking.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # sqlite3 connections stay on the thread that opened them
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS work (
+                                      key TEXT PRIMARY KEY,
+                                      repos TEXT NOT NULL,
+                                      state TEXT NOT NULL DEFAULT 'pending',
+                                      owner TEXT,
+                                      lease_expires REAL,
+                                      attempts INTEGER NOT NULL DEFAULT 0,
+                                      error TEXT)""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                      repo TEXT PRIMARY KEY,
+                                      rows TEXT NOT NULL,
+                                      findings INTEGER NOT NULL,
+                                      node TEXT NOT NULL,
+                                      written REAL NOT NULL)""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS rollups (
+                                      repo TEXT PRIMARY KEY,
+                                      teams TEXT NOT NULL,
+                                      counts TEXT NOT NULL)""")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # the write lock is taken up front, so two nodes never lease the same item
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def reset(self) -> int:
+        """
+        Drop the work items, results, rollups and seal of an earlier crawl,
+        so a new crawl neither skips its items nor exports its results.
+
+        Returns:
+            The number of work items dropped
+        """
+        with self._transaction() as connection:
+            dropped = connection.execute("SELECT COUNT(*) FROM work").fetchone()[0]
+            for table in ('work', 'results', 'rollups', 'meta'):
+                connection.execute(f"DELETE FROM {table}")
+        return dropped
+
+    def enqueue(self, items: List[WorkItem]) -> int:
+        """Add work items; items already queued, by the crawl being resumed too, are kept as they are."""
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO work (key, repos) VALUES (?, ?)",
+                                   [(key, json.dumps(repos)) for key, repos in items])
+            return connection.total_changes - before
+
+    def seal(self):
+        """Mark the queue complete, so nodes stop once it is drained."""
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('sealed', ?)", (str(time.time()),))
+
+    def sealed(self) -> bool:
+        """Whether the coordinator finished filling the queue."""
+        return self._connection().execute("SELECT 1 FROM meta WHERE name = 'sealed'").fetchone() is not None
+
+    def lease(self, owner: str, limit: int) -> List[WorkItem]:
+        """
+        Lease up to limit pending items, or items whose lease expired.
+
+        Expired items that used up their attempts are marked failed instead.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("""UPDATE work SET state = 'failed', error = 'lease expired ' || attempts || ' times'
+                                  WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                               (now, self.max_attempts))
+            rows = connection.execute("""SELECT key, repos FROM work
+                                         WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                                         ORDER BY rowid LIMIT ?""", (now, limit)).fetchall()
+            connection.executemany("""UPDATE work SET state = 'leased', owner = ?, lease_expires = ?,
+                                      attempts = attempts + 1 WHERE key = ?""",
+                                   [(owner, now + self.lease_seconds, key) for key, _ in rows])
+        return [(key, json.loads(repos)) for key, repos in rows]
+
+    def heartbeat(self, owner: str, keys: List[str]) -> List[str]:
+        """
+        Renew the leases of an owner.
+
+        Returns:
+            The keys whose lease was lost to another node
+        """
+        with self._transaction() as connection:
+            lost = []
+            for key in keys:
+                renewed = connection.execute("""UPDATE work SET lease_expires = ?
+                                                WHERE key = ? AND owner = ? AND state = 'leased'""",
+                                             (time.time() + self.lease_seconds, key, owner)).rowcount
+                if not renewed:
+                    lost.append(key)
+        return lost
+
+    def complete(self, keys: List[str]):
+        """Mark items done, whichever node holds their lease now; their results are stored."""
+        with self._transaction() as connection:
+            connection.executemany("UPDATE work SET state = 'done', error = NULL WHERE key = ?",
+                                   [(key,) for key in keys])
+
+    def release(self, owner: str, keys: List[str], error: str):
+        """Give leased items back to the queue after a failure; they count as an attempt."""
+        with self._transaction() as connection:
+            connection.executemany("""UPDATE work SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                      owner = NULL, lease_expires = NULL, error = ?
+                                      WHERE key = ? AND owner = ? AND state = 'leased'""",
+                                   [(self.max_attempts, error, key, owner) for key in keys])
+
+    def store(self, repo: str, rows: str, findings: int, node: str,
+              rollup: Optional[Tuple[List[str], Rollup]] = None):
+        """Store the CSV rows and the (teams, rollup) of a repository, replacing those of an earlier attempt."""
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                               (repo, rows, findings, node, time.time()))
+            if rollup is not None:
+                teams, counts = rollup
+                connection.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?)",
+                                   (repo, json.dumps(teams), json.dumps(counts)))
+
+    def counts(self) -> Dict[str, int]:
+        """Number of work items per state."""
+        rows = self._connection().execute("SELECT state, COUNT(*) FROM work GROUP BY state").fetchall()
+        return dict(rows)
+
+    def drained(self) -> bool:
+        """Whether the queue is sealed and every item is done or failed."""
+        counts = self.counts()
+        return self.sealed() and not counts.get('pending') and not counts.get('leased')
+
+    def failures(self) -> List[Tuple[str, str]]:
+        """(key, error) of the items given up."""
+        return self._connection().execute("SELECT key, error FROM work WHERE state = 'failed'").fetchall()
+
+    def export(self, output_file: str, headers: Optional[List[str]]):
+        """Write the stored rows of every repository to the output CSV file, header first."""
+        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+            if headers:
+                csv.writer(csvfile).writerow(headers)
+            for (rows,) in self._connection().execute("SELECT rows FROM results ORDER BY repo"):
+                csvfile.write(rows)
+
+    def rollups(self) -> Iterator[Tuple[str, List[str], Rollup]]:
+        """(repository, teams, rollup) of every repository stored by the nodes."""
+        for repo, teams, counts in self._connection().execute("SELECT repo, teams, counts FROM rollups ORDER BY repo"):
+            yield repo, json.loads(teams), json.loads(counts)
+
+
+def node_id() -> str:
+    """Identifies this crawler process among the nodes."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def work_items(repos: List[Repository.Repository]) -> List[WorkItem]:
+    """Groups repositories into work items: each repository with the forks reusing its findings."""
+    sources, forks = split_forks(repos)
+    families: Dict[str, List[str]] = {repo.full_name: [repo.full_name] for repo in sources}
+    for fork, parent in forks:
+        families[parent.full_name].append(fork.full_name)
+    return list(families.items())
+
+
+def results_sink(queue: WorkQueue, node: str) -> Sink:
+    """A process_repos sink storing each repository's rows in the queue's results table."""
+
+    def sink(repo: Repository.Repository, findings: List[Finding], branch_metadata: Dict[str, Any]):
+        # process_repos rolled the findings up just before
+        rollup = rollups.recorded(repo.full_name) or rollups.record_findings(repo, findings)
+        queue.store(repo.full_name, format_findings(repo, findings, branch_metadata), len(findings), node, rollup)
+        metrics.inc('repos_total', stage='written')
+        metrics.inc('findings_total', len(findings))
+
+    return sink
+
+
+class LeaseKeeper:
+    """Renews a node's leases in the background while it crawls them."""
+
+    def __init__(self, queue: WorkQueue, owner: str, keys: List[str]):
+        self.queue = queue
+        self.owner = owner
+        self.keys = keys
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                lost = self.queue.heartbeat(self.owner, self.keys)
+            except sqlite3.Error as e:
+                logger.warning("Failed renewing leases: %s", e)
+                continue
+            for key in lost:
+                # another node picked it up; whichever finishes stores the same rows
+                logger.warning("Lease of '%s' lost to another node", key)
+
+
+def run_node(queue: WorkQueue, github_client: Github, crawl: Callable[[List[Repository.Repository], Sink], None],
+             lease_batch: int = DEFAULT_LEASE_BATCH, poll_seconds: float = DEFAULT_POLL_SECONDS) -> int:
+    """
+    Crawl work items from the queue until it is drained.
+
+    Args:
+        queue: The shared work queue.
+        github_client: The node's Github instance.
+        crawl: Crawls repositories, handing their findings to the sink;
+            process_repos with everything but repos and sink bound.
+        lease_batch: Work items leased and crawled together.
+        poll_seconds: Wait between two requests for work when none is pending.
+
+    Returns:
+        The number of work items this node completed
+    """
+    owner = node_id()
+    sink = results_sink(queue, owner)
+    completed = 0
+    logger.info("Node '%s' pulling work from '%s'", owner, queue.path)
+    while True:
+        items = queue.lease(owner, lease_batch)
+        if not items:
+            if queue.drained():
+                break
+            # items are still being enqueued, or leased by nodes that may die
+            time.sleep(poll_seconds)
+            continue
+
+        keys = []
+        repos = []
+        unresolved = []
+        for key, names in items:
+            try:
+                item_repos = [github_client.get_repo(name) for name in names]
+            except GithubException as e:
+                # e.g. a 5xx or a secondary rate limit; another attempt may resolve it
+                logger.error("Error retrieving the repositories of '%s': %s", key, e)
+                unresolved.append((key, f"{type(e).__name__}: {e}"))
+                continue
+            keys.append(key)
+            repos.extend(item_repos)
+        for key, error in unresolved:
+            queue.release(owner, [key], error)
+        if not keys:
+            continue
+        try:
+            with LeaseKeeper(queue, owner, keys):
+                crawl(repos, sink)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Failed crawling %s work items, returning them to the queue: %s", len(keys), e)
+            queue.release(owner, keys, f"{type(e).__name__}: {e}")
+            continue
+        queue.complete(keys)
+        completed += len(keys)
+        counts = queue.counts()
+        logger.info("Queue: %s of %s work items done, %s leased, %s failed", counts.get('done', 0),
+                    sum(counts.values()), counts.get('leased', 0), counts.get('failed', 0))
+    logger.info("Node '%s' completed %s work items", owner, completed)
+    return completed
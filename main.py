@@ -3,39 +3,205 @@
 
 import argparse
 import csv
-from typing import Optional
+import json
+import time
+from typing import NamedTuple, Optional
 from github import GithubException, RateLimitExceededException
 
-from lib.github_manager import init_github, retrieve_repos, process_repos
-from lib.env_manager import load_env_var
+from lib.batch import batch_sink, load_manifest, retrieve_targets, start_outputs, target_repos
+from lib.code_search import discover_files
+from lib.github_manager import crawl_settings, init_github, retrieve_repos, process_repos
+from lib.env_manager import load_env_list, load_env_var, load_optional_env_var
 from lib.file_manager import load_config
+from lib import metrics, profiler, rollups, tracing
 from lib.logger import setup_logger
+from lib.path_filter import init_prune_rules
+from lib.planner import log_plan, plan_crawl
+from lib.progress import ProgressReporter
+from lib.push_updater import DEFAULT_BATCH_SECONDS, DEFAULT_WEBHOOK_PORT, PushUpdater, listen, replay
+from lib.results_store import ResultsStore
+from lib.work_queue import (DEFAULT_LEASE_BATCH, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS,
+                            DEFAULT_POLL_SECONDS, WorkQueue, run_node, work_items)
 
 # pylint: disable=line-too-long
 
 logger = setup_logger(__name__)
 
 
-def main(config_path: str, user_or_org: str, output_file: str, gh_endpoint: str, repository: Optional[str]):
-    """Run the script."""
+class RunOptions(NamedTuple):
+    """The command line options choosing how a run crawls, see main."""
+    profile_dir: Optional[str] = None
+    trace_path: Optional[str] = None
+    plan: bool = False
+    queue_path: Optional[str] = None
+    node: bool = False
+    discover: bool = False
+    delta: bool = False
+    events_path: Optional[str] = None
+    listen_port: Optional[int] = None
+    manifest_path: Optional[str] = None
+    resume: bool = False
 
-    try:
-        # Get Github token
-        gh_token = load_env_var("GH_TOKEN")
-        g = init_github(gh_token, gh_endpoint)
 
+def main(config_path: str, user_or_org: str, output_file: str, gh_endpoint: str, repository: Optional[str],
+         options: RunOptions = RunOptions()):
+    """Run the script. With plan, only estimate the crawl's cost and write the plan to output_file.
+
+    With discover, code search locates the candidate files of the
+    content-matched assets and only those are crawled.
+
+    With delta, repositories recorded in the results store by an earlier
+    crawl are only scanned for the files changed since.
+
+    With events_path or listen_port no crawl is run: the push events replayed
+    from the JSONL file at events_path, or received by a webhook on
+    listen_port, update the results store, which is then written to output_file.
+
+    With manifest_path the organizations and output files of the manifest
+    are crawled in one run, through one worker pool and one GitHub client,
+    instead of user_or_org into output_file.
+
+    With queue_path the crawl is shared with other nodes through the work queue
+    at that path: the coordinator enqueues the repositories, crawls alongside the
+    nodes and writes every node's results to output_file once the queue drains.
+    With node, the process only crawls from the queue. The coordinator
+    empties the queue of an earlier crawl first, unless resume is set.
+    """
+
+    started = time.time()
+    profiler.init_profiling(options.profile_dir, fresh=True)
+    profiler.profile_current_thread()
+    tracing.init_tracing(bool(options.trace_path))
+    metrics_path = None
+    try:
         config = load_config(config_path)
         if not config:
             return
 
+        metrics_path = (config.get('metrics') or {}).get('path')
+        metrics.track_api_calls()
+
+        crawler_config = config.get('crawler') or {}
+        settings = crawl_settings(config, options.profile_dir, bool(options.trace_path))
+
+        # Get Github tokens: comma separated PATs and/or GitHub App installations
+        gh_tokens = load_env_list("GH_TOKEN")
+        app_id = load_optional_env_var("GH_APP_ID")
+        installation_ids = [int(installation_id) for installation_id in load_env_list("GH_APP_INSTALLATION_IDS")]
+        if not gh_tokens and not (app_id and installation_ids):
+            gh_tokens = [load_env_var("GH_TOKEN")]
+        # one keep-alive connection per I/O thread
+        g = init_github(gh_tokens, gh_endpoint, pool_size=settings.io_workers,
+                        seconds_between_requests=crawler_config.get('seconds_between_requests'),
+                        app_id=app_id, app_private_key=load_optional_env_var("GH_APP_PRIVATE_KEY"),
+                        installation_ids=installation_ids)
+
         headers = config.get('headers')
         config_assets = config.get('assets')
+        rollup_config = config.get('rollups') or {}
+        rollups.init_rollups(config_assets, rollup_config)
+
+        files_by_repo = None
+        store_path = (config.get('results_store') or {}).get('path')
+        results_store = ResultsStore(store_path) if store_path else None
+        if options.delta and results_store is None:
+            logger.warning("Delta scans need results_store.path in config.yaml; crawling every repository in full")
+
+        if options.events_path or options.listen_port:
+            if results_store is None:
+                logger.error("Push event updates need results_store.path in config.yaml")
+                return
+            updater = PushUpdater(g, results_store, config, output_file)
+            if options.events_path:
+                replay(updater, options.events_path)
+            else:
+                events_config = config.get('events') or {}
+                listen(updater, options.listen_port, load_optional_env_var("GH_WEBHOOK_SECRET"),
+                       events_config.get('batch_seconds', DEFAULT_BATCH_SECONDS))
+            return
+
+        def crawl(repos, sink=None):
+            process_repos(repos, settings, output_file, sink, files_by_repo, results_store, options.delta)
+
+        queue = None
+        if options.queue_path:
+            queue_config = config.get('work_queue') or {}
+            queue = WorkQueue(options.queue_path, queue_config.get('lease_seconds', DEFAULT_LEASE_SECONDS),
+                              queue_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+            if not options.node and not options.resume:
+                dropped = queue.reset()
+                if dropped:
+                    logger.info("Dropped the %s work items and results of an earlier crawl from '%s'",
+                                dropped, options.queue_path)
+            if options.node:
+                run_node(queue, g, crawl, queue_config.get('lease_batch', DEFAULT_LEASE_BATCH),
+                         queue_config.get('poll_seconds', DEFAULT_POLL_SECONDS))
+                return
+
+        if options.manifest_path:
+            try:
+                targets = load_manifest(options.manifest_path)
+            except (OSError, ValueError) as e:
+                logger.error("Failed loading the manifest: %s", e)
+                return
+            repos, targets_by_repo = retrieve_targets(g, targets)
+            metrics.set_gauge('repos_found', len(repos))
+            start_outputs(targets, headers)
+            logger.info("Starting to process %s repos of %s targets ...", len(repos), len(targets))
+            with ProgressReporter(len(repos), crawler_config.get('progress_interval')):
+                crawl(repos, batch_sink(targets_by_repo))
+            if rollup_config.get('path'):
+                rollups.write_rollups(rollup_config['path'])
+            for target in targets:
+                if target.rollups:
+                    rollups.write_rollups(target.rollups, target_repos(target, targets_by_repo))
+            logger.info("Completed processing repos.")
+            metrics.set_gauge('last_success_timestamp_seconds', time.time())
+            return
 
         # Retrieve repositories
-        repos = retrieve_repos(g, user_or_org, repository)
+        if options.discover:
+            # hits in vendored paths are pruned like in a walk
+            init_prune_rules(config.get('prune'))
+            repos, files_by_repo = discover_files(g, config_assets, user_or_org, repository, config.get('discovery'))
+        else:
+            repos = retrieve_repos(g, user_or_org, repository)
+        metrics.set_gauge('repos_found', len(repos))
 
         if not repos:
             logger.info("No repos found for '%s'. Exiting.", user_or_org)
+            if queue:
+                # let waiting nodes exit
+                queue.seal()
+            return
+
+        if options.plan:
+            init_prune_rules(config.get('prune'))
+            crawl_plan = plan_crawl(g, repos, settings, crawler_config.get('seconds_between_requests'),
+                                    config.get('discovery'))
+            log_plan(crawl_plan)
+            with open(output_file, 'w', encoding='utf-8') as plan_file:
+                json.dump(crawl_plan, plan_file, indent=2)
+            return
+
+        if queue:
+            added = queue.enqueue(work_items(repos))
+            queue.seal()
+            logger.info("Queued %s work items for %s repos in '%s'", added, len(repos), options.queue_path)
+            # returns once every node's work items are done or failed
+            run_node(queue, g, crawl, queue_config.get('lease_batch', DEFAULT_LEASE_BATCH),
+                     queue_config.get('poll_seconds', DEFAULT_POLL_SECONDS))
+            for key, error in queue.failures():
+                logger.error("Work item '%s' failed: %s", key, error)
+                metrics.inc('errors_total', stage='work_queue')
+            queue.export(output_file, headers)
+            if rollup_config.get('path'):
+                # every node's rollups; those crawled here are replaced by the same counts
+                for repo, teams, rollup in queue.rollups():
+                    rollups.record(repo, teams, rollup)
+                rollups.write_rollups(rollup_config['path'])
+            logger.info("Completed processing repos.")
+            metrics.set_gauge('last_success_timestamp_seconds', time.time())
             return
 
         logger.info("")
@@ -47,14 +213,29 @@ def main(config_path: str, user_or_org: str, output_file: str, gh_endpoint: str,
             writer.writerow(headers)
 
         # Process the repos
-        process_repos(repos, config_assets, output_file)
+        with ProgressReporter(len(repos), crawler_config.get('progress_interval')):
+            crawl(repos)
+        if rollup_config.get('path'):
+            rollups.write_rollups(rollup_config['path'])
 
         logger.info("Completed processing repos.")
+        metrics.set_gauge('last_success_timestamp_seconds', time.time())
 
     except RateLimitExceededException as e:
         logger.error("Github API rate limit exceeded: %s", e)
+        metrics.inc('errors_total', stage='rate_limit')
     except GithubException as e:
         logger.error("An error occurred accessing Github: %s", e)
+        metrics.inc('errors_total', stage='github')
+    finally:
+        metrics.set_gauge('run_duration_seconds', time.time() - started)
+        if metrics_path:
+            metrics.write_metrics(metrics_path)
+        if options.trace_path:
+            tracing.write_trace(options.trace_path)
+        if options.profile_dir:
+            profiler.dump_profiles()
+            profiler.merge_profiles(options.profile_dir)
 
 
 if __name__ == "__main__":
@@ -72,7 +253,72 @@ if __name__ == "__main__":
                         help="The name of a specific GitHub repository to analyze",
                         dest="repository",
                         required=False)
+    parser.add_argument("--profile",
+                        help="Profile the run with cProfile into this directory (default: profile)",
+                        dest="profile_dir",
+                        nargs="?",
+                        const="profile",
+                        required=False)
+    parser.add_argument("--trace",
+                        help="Write a Chrome trace-event timeline of the run to this file (default: trace.json)",
+                        dest="trace_path",
+                        nargs="?",
+                        const="trace.json",
+                        required=False)
+    parser.add_argument("--plan",
+                        help="Only estimate the API calls, bytes and time of the crawl and write the plan as JSON to output_file",
+                        action="store_true")
+    parser.add_argument("--queue",
+                        help="Share the crawl with other nodes through the work queue in this SQLite file",
+                        dest="queue_path",
+                        required=False)
+    parser.add_argument("--resume",
+                        help="With --queue, continue the crawl left in the queue file: its done items and results are kept",
+                        action="store_true")
+    parser.add_argument("--node",
+                        help="With --queue, only crawl work items queued by a coordinator; user_or_org and output_file are ignored",
+                        action="store_true")
+    parser.add_argument("--delta",
+                        help="Only scan the files changed since the head commit recorded by an earlier crawl",
+                        action="store_true")
+    parser.add_argument("--events",
+                        help="Update the results store from the push events of this JSONL file instead of crawling",
+                        dest="events_path",
+                        required=False)
+    parser.add_argument("--listen",
+                        help=f"Update the results store from push events received by a webhook on this port (default: {DEFAULT_WEBHOOK_PORT})",
+                        dest="listen_port",
+                        type=int,
+                        nargs="?",
+                        const=DEFAULT_WEBHOOK_PORT,
+                        required=False)
+    parser.add_argument("--manifest",
+                        help="Crawl the organizations of this YAML manifest, each into its own output file; user_or_org and output_file are ignored",
+                        dest="manifest_path",
+                        required=False)
+    parser.add_argument("--discover",
+                        help="Locate the files of content-matched assets with code search instead of walking every repository",
+                        action="store_true")
     args = parser.parse_args()
+    if args.node and not args.queue_path:
+        parser.error("--node requires --queue")
+    if args.resume and (not args.queue_path or args.node):
+        parser.error("--resume requires --queue and is for the coordinator, not --node")
+    if (args.events_path or args.listen_port) and (args.plan or args.queue_path or args.discover or args.delta):
+        parser.error("--events and --listen cannot be combined with --plan, --queue, --discover or --delta")
+    if args.manifest_path and (args.plan or args.queue_path or args.discover or args.events_path or args.listen_port):
+        parser.error("--manifest cannot be combined with --plan, --queue, --discover, --events or --listen")
+    if args.discover and (args.plan or args.queue_path or args.delta):
+        parser.error("--discover cannot be combined with --plan, --queue or --delta")
 
-    main(args.config_path, args.user_or_org, args.output_file, args.gh_endpoint, args.repository)
-    logger.info("Devops assets written to '%s'!", args.output_file)
+    main(args.config_path, args.user_or_org, args.output_file, args.gh_endpoint, args.repository,
+         RunOptions(args.profile_dir, args.trace_path, args.plan, args.queue_path, args.node, args.discover,
+                    args.delta, args.events_path, args.listen_port, args.manifest_path, args.resume))
+    if args.plan:
+        logger.info("Crawl plan written to '%s'!", args.output_file)
+    elif args.node:
+        logger.info("Node done, results left in '%s'!", args.queue_path)
+    elif args.manifest_path:
+        logger.info("Devops assets written to the outputs of '%s'!", args.manifest_path)
+    else:
+        logger.info("Devops assets written to '%s'!", args.output_file)
@@ -0,0 +1,71 @@
+"""Tests of the push event handling of the results store updater"""
+
+import json
+
+from lib.push_updater import PAYLOAD_MAX_COMMITS, PushEvent, events_since, parse_push, read_events, touched_paths
+
+
+def push(before, after, commits=(), incomplete=False, repo='org/a'):
+    return PushEvent(repo, before, after, list(commits), incomplete)
+
+
+def payload(before='sha-0', after='sha-1', ref='refs/heads/main', **fields):
+    return dict({'ref': ref, 'before': before, 'after': after,
+                 'repository': {'full_name': 'org/a', 'default_branch': 'main'},
+                 'commits': [{'added': ['new.tf'], 'removed': [], 'modified': ['main.tf']}]}, **fields)
+
+
+def test_parse_push():
+    assert parse_push(payload()) == push('sha-0', 'sha-1', [(['new.tf'], [], ['main.tf'])])
+
+
+def test_parse_push_skips_other_branches_and_deletions():
+    assert parse_push(payload(ref='refs/heads/feature')) is None
+    assert parse_push(payload(deleted=True)) is None
+    assert parse_push({'zen': 'Keep it logically awesome.'}) is None
+
+
+def test_parse_push_flags_forced_and_long_pushes():
+    assert parse_push(payload(forced=True)).incomplete
+    commits = [{'added': [], 'removed': [], 'modified': ['main.tf']}] * PAYLOAD_MAX_COMMITS
+    assert parse_push(payload(commits=commits)).incomplete
+
+
+def test_read_events_reads_payloads_and_deliveries(tmp_path):
+    path = tmp_path / 'pushes.jsonl'
+    path.write_text('\n'.join([json.dumps(payload()),
+                               json.dumps({'event': 'push', 'payload': payload('sha-1', 'sha-2')}),
+                               json.dumps({'event': 'issues', 'payload': payload('sha-2', 'sha-3')}),
+                               '']), encoding='utf-8')
+    assert [(event.before, event.after) for event in read_events(str(path))] == [('sha-0', 'sha-1'),
+                                                                                ('sha-1', 'sha-2')]
+
+
+def test_events_since_chains_from_base_to_head():
+    events = [push('sha-0', 'sha-1'), push('sha-1', 'sha-2')]
+    assert events_since(events, 'sha-0', 'sha-2') == events
+
+
+def test_events_since_leaves_out_recorded_events():
+    events = [push('sha-0', 'sha-1'), push('sha-1', 'sha-2'), push('sha-2', 'sha-3')]
+    assert events_since(events, 'sha-1', 'sha-3') == events[1:]
+
+
+def test_events_since_unchained():
+    # an event was missed
+    assert events_since([push('sha-0', 'sha-1'), push('sha-2', 'sha-3')], 'sha-0', 'sha-3') is None
+    # base_sha is not among the events
+    assert events_since([push('sha-1', 'sha-2')], 'sha-0', 'sha-2') is None
+    # the head moved on since the last event
+    assert events_since([push('sha-0', 'sha-1')], 'sha-0', 'sha-2') is None
+
+
+def test_events_since_incomplete_event():
+    events = [push('sha-0', 'sha-1'), push('sha-1', 'sha-2', incomplete=True)]
+    assert events_since(events, 'sha-0', 'sha-2') is None
+
+
+def test_touched_paths_applies_commits_in_order():
+    events = [push('sha-0', 'sha-1', [(['a.tf', 'b.tf'], [], []), ([], ['a.tf'], ['c.tf'])]),
+              push('sha-1', 'sha-2', [(['a.tf'], ['b.tf'], [])])]
+    assert touched_paths(events) == ({'a.tf', 'c.tf'}, {'b.tf'})
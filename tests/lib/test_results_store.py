@@ -0,0 +1,56 @@
+"""Tests of the results store recording heads and findings for delta scans"""
+
+import pytest
+
+from lib.file_manager import Finding
+from lib.results_store import ResultsStore, fingerprint
+
+FINDINGS = [Finding('main.tf', 'https://github.com/org/a/blob/main/main.tf', 'sha-1', 'Terraform', {'aws_s3_bucket': 1}),
+            Finding('app.py', 'https://github.com/org/a/blob/main/app.py', 'sha-2', 'Python', {'s3': ['list_buckets']})]
+
+
+@pytest.fixture(name='store')
+def fixture_store(tmp_path):
+    return ResultsStore(str(tmp_path / 'cache' / 'results.sqlite'))
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint({'a': 1, 'b': [1, 2]}) == fingerprint({'b': [1, 2], 'a': 1})
+
+
+def test_fingerprint_changes_with_settings():
+    assert fingerprint([{'type': 'Terraform'}], None, {'terraform': 1}) != \
+        fingerprint([{'type': 'Terraform'}], None, {'terraform': 2})
+
+
+def test_save_records_head_metadata_and_findings(store):
+    store.save('org/a', 'head-1', 'fp', {'Branch Protection': True}, FINDINGS)
+    assert store.head('org/a', 'fp') == 'head-1'
+    assert store.metadata('org/a') == {'Branch Protection': True}
+    assert store.findings('org/a') == sorted(FINDINGS)
+    assert store.repos() == ['org/a']
+
+
+def test_unknown_repo_has_no_head(store):
+    assert store.head('org/a', 'fp') is None
+    assert not store.findings('org/a')
+    assert not store.metadata('org/a')
+
+
+def test_other_fingerprint_invalidates_head(store):
+    store.save('org/a', 'head-1', 'fp', {}, FINDINGS)
+    assert store.head('org/a', 'other-fp') is None
+
+
+def test_save_replaces_findings(store):
+    store.save('org/a', 'head-1', 'fp', {}, FINDINGS)
+    store.save('org/a', 'head-2', 'fp', {}, FINDINGS[:1])
+    assert store.head('org/a', 'fp') == 'head-2'
+    assert store.findings('org/a') == FINDINGS[:1]
+
+
+def test_findings_persist_across_instances(store):
+    store.save('org/a', 'head-1', 'fp', {}, FINDINGS)
+    reopened = ResultsStore(store.path)
+    assert reopened.head('org/a', 'fp') == 'head-1'
+    assert reopened.findings('org/a') == sorted(FINDINGS)
@@ -0,0 +1,159 @@
+"""Tests of the lease-based work queue shared by the crawler nodes"""
+
+from typing import NamedTuple
+
+import pytest
+from github import GithubException
+
+from lib.work_queue import WorkQueue, run_node
+
+ITEMS = [('org/a', ['org/a']), ('org/b', ['org/b', 'org/b-fork'])]
+
+
+class FakeRepo(NamedTuple):
+    full_name: str
+
+
+class FakeGithub:
+    """Resolves every repository, after failing failures times for those of failing."""
+
+    def __init__(self, failing=(), failures=0):
+        self.failing = set(failing)
+        self.failures = failures
+
+    def get_repo(self, name):
+        if name in self.failing and self.failures:
+            self.failures -= 1
+            raise GithubException(502, {'message': 'Bad Gateway'}, None)
+        return FakeRepo(name)
+
+
+@pytest.fixture(name='queue')
+def fixture_queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=2)
+    queue.enqueue(ITEMS)
+    return queue
+
+
+def test_enqueue_keeps_queued_items(queue):
+    queue.lease('node-1', 1)
+    assert queue.enqueue(ITEMS + [('org/c', ['org/c'])]) == 1
+    assert queue.counts() == {'leased': 1, 'pending': 2}
+
+
+def test_lease_hands_every_item_out_once(queue):
+    assert queue.lease('node-1', 1) == ITEMS[:1]
+    assert queue.lease('node-2', 5) == ITEMS[1:]
+    assert not queue.lease('node-3', 5)
+
+
+def test_expired_lease_goes_to_another_node(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=-1, max_attempts=2)
+    queue.enqueue(ITEMS[:1])
+    queue.lease('node-1', 1)
+    assert queue.lease('node-2', 1) == ITEMS[:1]
+    # node-1 lost the lease, node-2 holds it
+    assert queue.heartbeat('node-1', ['org/a']) == ['org/a']
+    assert not queue.heartbeat('node-2', ['org/a'])
+
+
+def test_expired_lease_fails_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=-1, max_attempts=2)
+    queue.enqueue(ITEMS[:1])
+    queue.lease('node-1', 1)
+    queue.lease('node-2', 1)
+    assert not queue.lease('node-3', 1)
+    assert queue.failures() == [('org/a', 'lease expired 2 times')]
+
+
+def test_release_returns_item_until_max_attempts(queue):
+    queue.lease('node-1', 1)
+    queue.release('node-1', ['org/a'], 'boom')
+    assert queue.counts() == {'pending': 2}
+    assert queue.lease('node-1', 1) == ITEMS[:1]
+    queue.release('node-1', ['org/a'], 'boom again')
+    assert queue.failures() == [('org/a', 'boom again')]
+
+
+def test_release_ignores_items_leased_by_another_node(queue):
+    queue.lease('node-1', 1)
+    queue.release('node-2', ['org/a'], 'boom')
+    assert queue.counts() == {'leased': 1, 'pending': 1}
+
+
+def test_complete_marks_done(queue):
+    queue.lease('node-1', 2)
+    queue.complete(['org/a', 'org/b'])
+    assert queue.counts() == {'done': 2}
+    assert not queue.lease('node-1', 2)
+
+
+def test_drained_needs_seal(queue):
+    queue.lease('node-1', 2)
+    queue.complete(['org/a', 'org/b'])
+    assert not queue.drained()
+    queue.seal()
+    assert queue.sealed()
+    assert queue.drained()
+
+
+def test_leased_items_keep_queue_undrained(queue):
+    queue.seal()
+    queue.lease('node-1', 1)
+    queue.complete(['org/a'])
+    assert not queue.drained()
+    queue.lease('node-1', 1)
+    queue.complete(['org/b'])
+    assert queue.drained()
+
+
+def test_store_replaces_rows_of_earlier_attempt(queue, tmp_path):
+    queue.store('org/a', 'first\r\n', 1, 'node-1')
+    queue.store('org/a', 'second\r\n', 1, 'node-2')
+    output = tmp_path / 'output.csv'
+    queue.export(str(output), ['Repository', 'Analysis, Result'])
+    assert output.read_text(encoding='utf-8') == 'Repository,"Analysis, Result"\nsecond\n'
+
+
+def test_reset_drops_earlier_crawl(queue):
+    queue.store('org/a', 'rows\r\n', 1, 'node-1')
+    queue.seal()
+    assert queue.reset() == 2
+    assert not queue.counts()
+    assert not queue.sealed()
+
+
+def test_run_node_crawls_every_item(queue):
+    queue.seal()
+    crawled = []
+    assert run_node(queue, FakeGithub(), lambda repos, sink: crawled.extend(repos), poll_seconds=0) == 2
+    assert [repo.full_name for repo in crawled] == ['org/a', 'org/b', 'org/b-fork']
+    assert queue.counts() == {'done': 2}
+
+
+def test_run_node_retries_items_failing_to_resolve(queue):
+    queue.seal()
+    crawled = []
+    github_client = FakeGithub(failing=['org/b-fork'], failures=1)
+    assert run_node(queue, github_client, lambda repos, sink: crawled.extend(repos), poll_seconds=0) == 2
+    assert [repo.full_name for repo in crawled] == ['org/a', 'org/b', 'org/b-fork']
+    assert queue.counts() == {'done': 2}
+
+
+def test_run_node_fails_items_never_resolved(queue):
+    queue.seal()
+    crawled = []
+    github_client = FakeGithub(failing=['org/b-fork'], failures=2)
+    assert run_node(queue, github_client, lambda repos, sink: crawled.extend(repos), poll_seconds=0) == 1
+    assert [repo.full_name for repo in crawled] == ['org/a']
+    assert [key for key, _ in queue.failures()] == ['org/b']
+
+
+def test_run_node_releases_items_of_failed_crawl(queue):
+    queue.seal()
+
+    def crawl(repos, sink):
+        raise RuntimeError('worker died')
+
+    assert run_node(queue, FakeGithub(), crawl, poll_seconds=0) == 0
+    assert queue.failures() == [('org/a', 'RuntimeError: worker died'), ('org/b', 'RuntimeError: worker died')]